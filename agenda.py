@@ -0,0 +1,335 @@
+# agenda.py
+# Appointment calendar (day / week / month) and the typeahead lookups used by
+# the booking forms.
+#
+# The calendar reads only the appointments inside the visible window, through
+# ix_appointments_hospital_date (or ix_appointments_hospital_doctor_date when
+# filtered by doctor), so a page costs the same whatever the size of the
+# hospital's history. At most CALENDAR_MAX_EVENTS are drawn; a busier window
+# shows a notice and should be narrowed by doctor, department or a shorter view.
+#
+# Booking forms no longer embed every patient and doctor in <select> lists; they
+# ask the lookup endpoints for a handful of matches as the user types.
+#
+#   GET /appointments/calendar?view=week&date=2026-01-05&doctor_id=3
+#   GET /appointments/calendar?view=month&department_id=2
+#   GET /lookup/patients?q=jo%20smi
+#   GET /lookup/doctors?q=card&department_id=2
+
+from datetime import date, datetime, timedelta
+
+from flask import Blueprint, abort, current_app, g, jsonify, request, url_for
+from sqlalchemy import or_, select
+from sqlalchemy.orm import joinedload
+
+from app import Appointment, Department, Doctor, Patient, cached_fragment, db, login_required, render_page
+from replicas import replica_reads
+from search import like_pattern, search_patients
+
+agenda_bp = Blueprint('agenda', __name__)
+
+VIEWS = ('day', 'week', 'month')
+
+
+# ----------------------------------------------------
+# Templates
+# ----------------------------------------------------
+
+CALENDAR_HTML = r"""
+<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <title>Appointment Calendar - HMS</title>
+    <link href="https://cdn.jsdelivr.net/npm/bootstrap@5.3.3/dist/css/bootstrap.min.css" rel="stylesheet">
+    <link rel="stylesheet" href="https://cdn.jsdelivr.net/npm/bootstrap-icons@1.10.0/font/bootstrap-icons.css">
+    <style>
+        body { background-color: #f5f5f5; }
+        .navbar { background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); }
+        .navbar a { color: white !important; }
+        .btn-back { color: white; text-decoration: none; }
+        .calendar td { vertical-align: top; width: 14.28%; height: 7rem; }
+        .calendar .other-month { background-color: #eee; }
+        .calendar .today { outline: 2px solid #667eea; outline-offset: -2px; }
+        .event { font-size: 0.8rem; white-space: nowrap; overflow: hidden; text-overflow: ellipsis; }
+    </style>
+</head>
+<body>
+    <nav class="navbar navbar-dark">
+        <div class="container-fluid">
+            <span class="navbar-brand"><a href="{{ url_for('appointments') }}" class="btn-back"><i class="bi bi-arrow-left"></i> Back to Appointments</a></span>
+            <span style="color: white;">Welcome, {{ user_name }}</span>
+        </div>
+    </nav>
+    <div class="container mt-5">
+        <h2>🗓️ {{ title }}</h2>
+
+        <form method="GET" class="row g-2 align-items-end mt-3">
+            <input type="hidden" name="view" value="{{ view }}">
+            <input type="hidden" name="date" value="{{ anchor.isoformat() }}">
+            <div class="col-md-4 position-relative">
+                <label class="form-label">Doctor</label>
+                <input type="text" class="form-control" autocomplete="off" placeholder="All doctors"
+                       value="{{ 'Dr. %s %s'|format(doctor.first_name, doctor.last_name) if doctor else '' }}"
+                       data-lookup="{{ url_for('agenda.lookup_doctors') }}" data-target="filter-doctor-id" data-submit="1">
+                <input type="hidden" id="filter-doctor-id" name="doctor_id" value="{{ doctor.id if doctor else '' }}">
+                <div class="list-group position-absolute w-100 shadow-sm" style="z-index: 10;"></div>
+            </div>
+            <div class="col-md-3">
+                <label class="form-label">Department</label>
+                <select class="form-select" name="department_id" id="filter-department" onchange="this.form.submit()">
+                    <option value="">All departments</option>
+                    {{ department_options }}
+                </select>
+            </div>
+            <div class="col-md-5 text-end">
+                <div class="btn-group">
+                    {% for name in views %}
+                        <a class="btn btn-outline-primary {{ 'active' if name == view }}" href="{{ nav_url(view=name) }}">{{ name|capitalize }}</a>
+                    {% endfor %}
+                </div>
+                <div class="btn-group ms-2">
+                    <a class="btn btn-outline-secondary" href="{{ nav_url(date=prev_anchor) }}">&laquo;</a>
+                    <a class="btn btn-outline-secondary" href="{{ nav_url(date=today) }}">Today</a>
+                    <a class="btn btn-outline-secondary" href="{{ nav_url(date=next_anchor) }}">&raquo;</a>
+                </div>
+            </div>
+        </form>
+
+        {% if truncated %}
+            <div class="alert alert-warning mt-3">Showing the first {{ max_events }} appointments in this period. Pick a doctor, a department or a shorter view to see them all.</div>
+        {% endif %}
+
+        <div class="card mt-3">
+            <div class="card-body">
+                {% if view == 'day' %}
+                    {% set events = events_by_day.get(anchor, []) %}
+                    {% if events %}
+                        <table class="table table-striped table-hover mb-0">
+                            <thead class="table-dark">
+                                <tr><th>Time</th><th>Patient</th><th>Doctor</th><th>Reason</th><th>Status</th></tr>
+                            </thead>
+                            <tbody>
+                                {% for apt in events %}
+                                <tr>
+                                    <td>{{ apt.appointment_date.strftime('%H:%M') }}</td>
+                                    <td>{{ apt.patient.first_name }} {{ apt.patient.last_name }}</td>
+                                    <td>Dr. {{ apt.doctor.first_name }} {{ apt.doctor.last_name }}</td>
+                                    <td>{{ apt.reason or 'General' }}</td>
+                                    <td><span class="badge bg-{{ 'success' if apt.status == 'SCHEDULED' else 'warning' if apt.status == 'COMPLETED' else 'danger' }}">{{ apt.status }}</span></td>
+                                </tr>
+                                {% endfor %}
+                            </tbody>
+                        </table>
+                    {% else %}
+                        <div class="alert alert-info mb-0">No appointments on this day.</div>
+                    {% endif %}
+                {% else %}
+                    <table class="table table-bordered calendar mb-0">
+                        <thead class="table-dark">
+                            <tr>{% for name in weekdays %}<th>{{ name }}</th>{% endfor %}</tr>
+                        </thead>
+                        <tbody>
+                            {% for week in weeks %}
+                            <tr>
+                                {% for day in week %}
+                                {% set events = events_by_day.get(day, []) %}
+                                <td class="{{ 'other-month' if view == 'month' and day.month != anchor.month }} {{ 'today' if day == today }}">
+                                    <a href="{{ nav_url(view='day', date=day) }}" class="fw-bold text-decoration-none">{{ day.day }}</a>
+                                    {% for apt in events[:per_cell] %}
+                                        <div class="event" title="{{ apt.patient.first_name }} {{ apt.patient.last_name }} &middot; Dr. {{ apt.doctor.last_name }}">
+                                            <span class="badge bg-{{ 'success' if apt.status == 'SCHEDULED' else 'warning' if apt.status == 'COMPLETED' else 'danger' }}">{{ apt.appointment_date.strftime('%H:%M') }}</span>
+                                            {{ apt.patient.last_name }} / Dr. {{ apt.doctor.last_name }}
+                                        </div>
+                                    {% endfor %}
+                                    {% if events|length > per_cell %}
+                                        <a href="{{ nav_url(view='day', date=day) }}" class="small">+{{ events|length - per_cell }} more</a>
+                                    {% endif %}
+                                </td>
+                                {% endfor %}
+                            </tr>
+                            {% endfor %}
+                        </tbody>
+                    </table>
+                {% endif %}
+            </div>
+        </div>
+    </div>
+    <script>document.getElementById('filter-department').value = '{{ department_id or '' }}';</script>
+    {% include 'typeahead.html' %}
+</body>
+</html>
+"""
+
+
+@agenda_bp.record_once
+def _register_templates(state):
+    state.app.extensions['hms_templates'].register('appointments_calendar.html', CALENDAR_HTML)
+
+
+# ----------------------------------------------------
+# Calendar
+# ----------------------------------------------------
+
+def calendar_window(view, anchor):
+    """(first, last + 1 day, previous anchor, next anchor) of the period shown for `anchor`.
+
+    Week and month views start on a Monday; a month view covers whole weeks.
+    """
+    if view == 'day':
+        return anchor, anchor + timedelta(days=1), anchor - timedelta(days=1), anchor + timedelta(days=1)
+    if view == 'week':
+        first = anchor - timedelta(days=anchor.weekday())
+        return first, first + timedelta(days=7), anchor - timedelta(days=7), anchor + timedelta(days=7)
+    month_start = anchor.replace(day=1)
+    next_month = (month_start + timedelta(days=32)).replace(day=1)
+    prev_month = (month_start - timedelta(days=1)).replace(day=1)
+    first = month_start - timedelta(days=month_start.weekday())
+    last = next_month + timedelta(days=(7 - next_month.weekday()) % 7)
+    return first, last, prev_month, next_month
+
+
+def appointments_between(hospital_id, start, end, doctor_id=None, department_id=None, limit=None):
+    """Appointments with start <= appointment_date < end, in time order, with patient and doctor."""
+    query = Appointment.query.filter(
+        Appointment.hospital_id == hospital_id,
+        Appointment.appointment_date >= start,
+        Appointment.appointment_date < end
+    )
+    if doctor_id:
+        query = query.filter(Appointment.doctor_id == doctor_id)
+    elif department_id:
+        query = query.filter(Appointment.doctor_id.in_(
+            select(Doctor.id).where(Doctor.hospital_id == hospital_id, Doctor.department_id == department_id)
+        ))
+    query = query.options(
+        joinedload(Appointment.patient).load_only(Patient.first_name, Patient.last_name),
+        joinedload(Appointment.doctor).load_only(Doctor.first_name, Doctor.last_name)
+    ).order_by(Appointment.appointment_date, Appointment.id)
+    if limit is not None:
+        query = query.limit(limit)
+    return query.all()
+
+
+def _parse_date(value):
+    if not value:
+        return date.today()
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        abort(400, description=f'invalid date {value!r}, expected YYYY-MM-DD')
+
+
+@agenda_bp.route('/appointments/calendar')
+@login_required
+@replica_reads
+def calendar():
+    """Day, week or month view of the hospital's appointments."""
+    view = request.args.get('view', 'week')
+    if view not in VIEWS:
+        abort(400, description=f"view must be one of {', '.join(VIEWS)}")
+    anchor = _parse_date(request.args.get('date'))
+    doctor_id = request.args.get('doctor_id', type=int)
+    department_id = request.args.get('department_id', type=int)
+    doctor = Doctor.query.filter_by(hospital_id=g.hospital_id, id=doctor_id).first() if doctor_id else None
+    if doctor_id and doctor is None:
+        abort(404)
+
+    first, last, prev_anchor, next_anchor = calendar_window(view, anchor)
+    max_events = current_app.config['CALENDAR_MAX_EVENTS']
+    # One extra row tells us whether the window holds more than we draw
+    rows = appointments_between(g.hospital_id, datetime.combine(first, datetime.min.time()),
+                                datetime.combine(last, datetime.min.time()),
+                                doctor_id, department_id, max_events + 1)
+    events_by_day = {}
+    for apt in rows[:max_events]:
+        events_by_day.setdefault(apt.appointment_date.date(), []).append(apt)
+
+    days = [first + timedelta(days=offset) for offset in range((last - first).days)]
+    if view == 'day':
+        title = anchor.strftime('%A %d %B %Y')
+    elif view == 'week':
+        title = f"Week of {first.strftime('%d %B %Y')}"
+    else:
+        title = anchor.strftime('%B %Y')
+
+    def nav_url(**changes):
+        args = dict(view=view, date=anchor, doctor_id=doctor_id, department_id=department_id)
+        args.update(changes)
+        args['date'] = args['date'].isoformat()
+        return url_for('agenda.calendar', **args)
+
+    def department_options():
+        department_list = Department.query.filter_by(hospital_id=g.hospital_id).order_by(Department.name).all()
+        return render_page('department_options.html', departments=department_list)
+
+    return render_page('appointments_calendar.html',
+        user_name=g.user.name,
+        title=title,
+        view=view,
+        views=VIEWS,
+        anchor=anchor,
+        today=date.today(),
+        prev_anchor=prev_anchor,
+        next_anchor=next_anchor,
+        weeks=[days[i:i + 7] for i in range(0, len(days), 7)],
+        weekdays=('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun'),
+        events_by_day=events_by_day,
+        per_cell=3 if view == 'month' else max_events,
+        truncated=len(rows) > max_events,
+        max_events=max_events,
+        doctor=doctor,
+        department_id=department_id,
+        department_options=cached_fragment('departments', department_options, by_args=False),
+        nav_url=nav_url
+    )
+
+
+# ----------------------------------------------------
+# Lookups
+# ----------------------------------------------------
+
+def lookup_limit():
+    return min(max(request.args.get('limit', 10, type=int), 1), current_app.config['LOOKUP_MAX_RESULTS'])
+
+
+@agenda_bp.route('/lookup/patients')
+@login_required
+@replica_reads
+def lookup_patients():
+    """A few patients matching `q`, for pickers."""
+    return lookup_patients_response(search_patients(g.hospital_id, request.args.get('q', ''), lookup_limit()))
+
+
+def lookup_patients_response(rows):
+    return jsonify(results=[{
+        'id': row['id'],
+        'label': f"{row['first_name']} {row['last_name']}",
+        'detail': row['phone'] or row['email'],
+    } for row in rows])
+
+
+@agenda_bp.route('/lookup/doctors')
+@login_required
+@replica_reads
+def lookup_doctors():
+    """Active doctors whose first name, last name or specialization starts with `q`.
+
+    A hospital has hundreds of doctors, not millions, so a prefix match over the
+    tenant's rows (ix_doctors_hospital_created) is cheap without a search index.
+    """
+    query = db.session.query(Doctor.id, Doctor.first_name, Doctor.last_name, Doctor.specialization) \
+        .filter(Doctor.hospital_id == g.hospital_id, Doctor.status == 'ACTIVE')
+    if request.args.get('department_id'):
+        query = query.filter(Doctor.department_id == request.args.get('department_id', type=int))
+    for term in request.args.get('q', '').split():
+        pattern = like_pattern(term, prefix_only=True)
+        query = query.filter(or_(Doctor.first_name.ilike(pattern, escape='\\'),
+                                 Doctor.last_name.ilike(pattern, escape='\\'),
+                                 Doctor.specialization.ilike(pattern, escape='\\')))
+    rows = query.order_by(Doctor.last_name, Doctor.first_name, Doctor.id).limit(lookup_limit())
+    return jsonify(results=[{
+        'id': row.id,
+        'label': f'Dr. {row.first_name} {row.last_name}',
+        'detail': row.specialization,
+    } for row in rows])
@@ -0,0 +1,163 @@
+# api.py
+# Versioned JSON API (v1) over the tenant resources, for kiosks and the mobile app.
+#
+#   GET /api/v1/<resource>?fields=id,first_name&per_page=50&sort=newest&cursor=...
+#   GET /api/v1/<resource>/<id>?fields=...
+#
+# - ?fields= selects columns in the SQL itself, not after loading full rows.
+# - Lists use the same (created_at, id) keyset cursors as the HTML pages.
+# - Responses carry an ETag computed from the body. A matching If-None-Match
+#   gets an empty 304. There is no Last-Modified: rows have no update time, and
+#   created_at would keep answering If-Modified-Since with 304 after an update.
+# - Bodies are serialized with orjson when it is installed.
+
+import json
+from datetime import date, datetime
+from functools import wraps
+
+from flask import Blueprint, Response, abort, g, request
+from sqlalchemy import select
+from werkzeug.exceptions import HTTPException
+
+from app import Appointment, Department, Doctor, MedicalRecord, Patient, db
+from pagination import keyset_page, keyset_query, request_page_args
+from replicas import replica_reads
+
+try:
+    import orjson
+except ImportError:  # optional speed-up
+    orjson = None
+
+api_bp = Blueprint('api_v1', __name__)
+
+# Resource name -> (model, fields returned when ?fields= is absent)
+RESOURCES = {
+    'patients': (Patient, ('id', 'first_name', 'last_name', 'email', 'phone', 'date_of_birth',
+                           'gender', 'blood_group', 'created_at')),
+    'doctors': (Doctor, ('id', 'first_name', 'last_name', 'specialization', 'department_id',
+                         'email', 'phone', 'status', 'created_at')),
+    'departments': (Department, ('id', 'name', 'head_name', 'email', 'phone', 'created_at')),
+    'appointments': (Appointment, ('id', 'patient_id', 'doctor_id', 'appointment_date', 'reason',
+                                   'status', 'created_at')),
+    'medical_records': (MedicalRecord, ('id', 'patient_id', 'doctor_id', 'diagnosis', 'created_at')),
+}
+# Never exposed, whatever ?fields= asks for
+HIDDEN_FIELDS = {'hospital_id'}
+
+
+def _default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+def dumps(payload):
+    """Serialize to JSON bytes, preferring orjson."""
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload, default=_default, separators=(',', ':')).encode()
+
+
+def json_response(payload, status=200):
+    """JSON response that answers conditional GETs with 304 Not Modified."""
+    response = Response(dumps(payload), status=status, mimetype='application/json')
+    if status == 200 and request.method == 'GET':
+        response.add_etag()
+        # Clients may keep a copy but must revalidate it (cheaply, via the ETag)
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        response.make_conditional(request)
+    return response
+
+
+def api_login_required(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if g.get('user') is None:
+            return json_response({'error': 'authentication required'}, 401)
+        return f(*args, **kwargs)
+    return decorated_function
+
+
+@api_bp.errorhandler(HTTPException)
+def _http_error(error):
+    return json_response({'error': error.description}, error.code)
+
+
+def _resource(name):
+    if name not in RESOURCES:
+        abort(404, description=f'unknown resource {name!r}')
+    return RESOURCES[name]
+
+
+def _projection(model, default_fields):
+    """Columns requested with ?fields=, validated against the table."""
+    requested = request.args.get('fields')
+    if not requested:
+        return list(default_fields)
+    fields = [name.strip() for name in requested.split(',') if name.strip()]
+    unknown = [name for name in fields if name not in model.__table__.c or name in HIDDEN_FIELDS]
+    if unknown:
+        abort(400, description=f"unknown field(s): {', '.join(unknown)}")
+    return fields
+
+
+def _select(model, fields):
+    # id and created_at are always loaded: the keyset cursor is built from them
+    columns = list(dict.fromkeys(['id', 'created_at'] + fields))
+    return select(*[model.__table__.c[name] for name in columns])
+
+
+# The statements are built and the responses shaped here; the views (and asgi.py,
+# which runs them on the async engine) only execute them.
+
+def list_statement(resource, hospital_id):
+    """(statement, keyset plan, fields) for one page of `resource`, from the request arguments."""
+    model, default_fields = _resource(resource)
+    fields = _projection(model, default_fields)
+    statement = _select(model, fields).where(model.hospital_id == hospital_id)
+    statement, plan = keyset_query(statement, model, **request_page_args())
+    return statement, plan, fields
+
+
+def list_response(rows, plan, fields):
+    page = keyset_page(rows, plan)
+    payload = {
+        'data': [{name: getattr(row, name) for name in fields} for row in page.items],
+        'next_cursor': page.next_cursor,
+        'prev_cursor': page.prev_cursor,
+        'per_page': page.per_page,
+        'sort': page.sort,
+    }
+    return json_response(payload)
+
+
+def item_statement(resource, item_id, hospital_id):
+    """(statement, fields) for one row of `resource`."""
+    model, default_fields = _resource(resource)
+    fields = _projection(model, default_fields)
+    return _select(model, fields).where(model.hospital_id == hospital_id, model.id == item_id), fields
+
+
+def item_response(resource, item_id, row, fields):
+    if row is None:
+        abort(404, description=f'{resource} {item_id} not found')
+    return json_response({name: getattr(row, name) for name in fields})
+
+
+@api_bp.route('/<resource>')
+@api_login_required
+@replica_reads
+def list_resource(resource):
+    """One keyset page of a resource, projected to the requested fields."""
+    statement, plan, fields = list_statement(resource, g.hospital_id)
+    return list_response(db.session.execute(statement).all(), plan, fields)
+
+
+@api_bp.route('/<resource>/<int:item_id>')
+@api_login_required
+@replica_reads
+def get_resource(resource, item_id):
+    """A single row of a resource, projected to the requested fields."""
+    statement, fields = item_statement(resource, item_id, g.hospital_id)
+    return item_response(resource, item_id, db.session.execute(statement).first(), fields)
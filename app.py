@@ -1,13 +1,38 @@
 # single_file_hms.py
 # A single-file multi-tenant HMS prototype implementing FR-1 (Hospital Self-Registration) and basic Login.
 
-from flask import Flask, redirect, url_for, render_template_string, request, flash, Blueprint, session
+from flask import Flask, Response, abort, redirect, url_for, render_template, request, flash, Blueprint, session, current_app, g, jsonify
+from flask.cli import AppGroup
 from flask_sqlalchemy import SQLAlchemy
-from werkzeug.security import generate_password_hash, check_password_hash
+from flask_sqlalchemy.session import Session as FlaskSQLAlchemySession
+from werkzeug.middleware.proxy_fix import ProxyFix
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+from jinja2 import ChoiceLoader, DictLoader, FileSystemBytecodeCache
+from sqlalchemy import select, update, func, tuple_, event, text
+from sqlalchemy.exc import DBAPIError, IntegrityError
+from sqlalchemy.orm import deferred, joinedload, object_session
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import ClauseElement, Executable
 import uuid
 import os
+import hashlib
+import hmac
+import tempfile
+import click
 from functools import wraps
 from datetime import datetime
+from types import SimpleNamespace
+from cache import FileSystemCache, FragmentCache, TTLCache
+from markupsafe import Markup
+from db_pool import engine_options, pool_status
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE
+from metrics import init_app as init_metrics
+from replicas import primary_reads, replica_reads
+from replicas import init_app as init_replicas
+from shards import DEFAULT_SHARD, ShardedSession, parse_shards, route_to_shard, shard_context
+from shards import init_app as init_shards
+from pagination import keyset_page, keyset_query, paginate_request, request_page_args
+from security import LoginLimiter, VerifierBusy, hash_password, needs_rehash, verify_password
 
 # ----------------------------------------------------
 # 1. Configuration 
@@ -20,15 +45,112 @@ class Config:
         database_url = database_url.replace('postgres://', 'postgresql://', 1)
     SQLALCHEMY_DATABASE_URI = database_url or 'sqlite:///hms_main.db'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Pool sizing, pre-ping, recycle and statement timeout (PostgreSQL) or WAL/busy timeout (SQLite)
+    SQLALCHEMY_ENGINE_OPTIONS = engine_options(SQLALCHEMY_DATABASE_URI)
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'your_super_secret_key_change_me_in_production'
     JWT_SECRET_KEY = "jwt-secret-key" 
+    # List views are keyset-paginated; per_page must be one of PAGE_SIZES
+    PAGE_SIZES = (10, 25, 50, 100)
+    PAGE_SIZE_DEFAULT = int(os.environ.get('HMS_PAGE_SIZE', 25))
+    # Optional directory for compiled template bytecode, shared by all workers on a host
+    TEMPLATE_BYTECODE_CACHE_DIR = os.environ.get('HMS_TEMPLATE_CACHE_DIR')
+    # Per-worker cache of the logged-in user/hospital (seconds, entries)
+    TENANT_CACHE_TTL = int(os.environ.get('HMS_TENANT_CACHE_TTL', 60))
+    TENANT_CACHE_SIZE = int(os.environ.get('HMS_TENANT_CACHE_SIZE', 4096))
+    # Rendered list fragments: 'filesystem' (shared by the workers of one host, under
+    # CACHE_DIR) or 'memory' (per worker: a write invalidates only the worker that made
+    # it, so the others serve stale lists for up to FRAGMENT_CACHE_TTL)
+    CACHE_BACKEND = os.environ.get('HMS_CACHE_BACKEND', 'filesystem')
+    CACHE_DIR = os.environ.get('HMS_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'hms-cache'))
+    FRAGMENT_CACHE_TTL = int(os.environ.get('HMS_FRAGMENT_CACHE_TTL', 300))
+    FRAGMENT_CACHE_SIZE = int(os.environ.get('HMS_FRAGMENT_CACHE_SIZE', 4096))
+    # Rows per INSERT batch for bulk patient imports
+    IMPORT_BATCH_SIZE = int(os.environ.get('HMS_IMPORT_BATCH_SIZE', 1000))
+    # Rows fetched per round trip when streaming exports
+    EXPORT_YIELD_PER = int(os.environ.get('HMS_EXPORT_YIELD_PER', 1000))
+    # How far ahead free-slot searches look, and the most slots one request may return
+    SCHEDULING_HORIZON_DAYS = int(os.environ.get('HMS_SCHEDULING_HORIZON_DAYS', 90))
+    SCHEDULING_MAX_SLOTS = 100
+    # Working hours of doctors who have none set (weekdays 0 = Monday, as in `set-hours`)
+    SCHEDULING_DEFAULT_WEEKDAYS = os.environ.get('HMS_DEFAULT_WEEKDAYS', '0-4')
+    SCHEDULING_DEFAULT_START = os.environ.get('HMS_DEFAULT_START', '09:00')
+    SCHEDULING_DEFAULT_END = os.environ.get('HMS_DEFAULT_END', '17:00')
+    SCHEDULING_DEFAULT_SLOT_MINUTES = int(os.environ.get('HMS_DEFAULT_SLOT_MINUTES', 30))
+    # Matches a patient search ranks and pages through (typeahead users refine instead of paging)
+    SEARCH_MAX_RESULTS = 1000
+    # Appointments drawn in one calendar view, and matches returned by picker lookups
+    CALENDAR_MAX_EVENTS = int(os.environ.get('HMS_CALENDAR_MAX_EVENTS', 2000))
+    LOOKUP_MAX_RESULTS = 20
+    # Longest date range one report may cover
+    REPORT_MAX_DAYS = int(os.environ.get('HMS_REPORT_MAX_DAYS', 366))
+    # Background jobs (see jobs.py). JOB_THREADS > 0 runs workers inside the web
+    # process; otherwise run `flask hms worker`.
+    JOB_THREADS = int(os.environ.get('HMS_JOB_THREADS', 0))
+    JOB_POLL_INTERVAL = float(os.environ.get('HMS_JOB_POLL_INTERVAL', 1.0))
+    JOB_MAX_ATTEMPTS = 5
+    JOB_BACKOFF_SECONDS = 10
+    JOB_BACKOFF_MAX_SECONDS = 3600
+    # A running job's worker renews its lease every third of this; a job whose lease
+    # expires is taken to have lost its worker
+    JOB_LEASE_SECONDS = 600
+    # Outgoing mail; without MAIL_SERVER messages are only logged
+    MAIL_SERVER = os.environ.get('MAIL_SERVER')
+    MAIL_PORT = int(os.environ.get('MAIL_PORT', 587))
+    MAIL_USE_TLS = os.environ.get('MAIL_USE_TLS', '1') == '1'
+    MAIL_USERNAME = os.environ.get('MAIL_USERNAME')
+    MAIL_PASSWORD = os.environ.get('MAIL_PASSWORD')
+    MAIL_SENDER = os.environ.get('MAIL_SENDER', 'no-reply@hms.local')
+    BASE_URL = os.environ.get('HMS_BASE_URL', 'http://localhost:5000')
+    # Lifetime of the link a new hospital admin sets their password with
+    ACTIVATION_TOKEN_MAX_AGE = int(os.environ.get('HMS_ACTIVATION_MAX_AGE', 3 * 24 * 3600))
+    # Password hashing policy; hashes made under an older policy are upgraded at login
+    PASSWORD_HASH_METHOD = os.environ.get('HMS_PASSWORD_HASH', 'scrypt')
+    PASSWORD_SCRYPT_N = int(os.environ.get('HMS_SCRYPT_N', 2 ** 15))
+    PASSWORD_SCRYPT_R = 8
+    PASSWORD_SCRYPT_P = 1
+    PASSWORD_PBKDF2_ITERATIONS = int(os.environ.get('HMS_PBKDF2_ITERATIONS', 600000))
+    # Processes verifying passwords per web worker (0 = in the request thread)
+    PASSWORD_HASH_WORKERS = int(os.environ.get('HMS_PASSWORD_WORKERS', 2))
+    PASSWORD_HASH_MAX_PENDING = 32
+    # Login attempts allowed per client IP and per email from one client IP, as "attempts/seconds"
+    LOGIN_RATE_PER_IP = os.environ.get('HMS_LOGIN_RATE_PER_IP', '20/60')
+    LOGIN_RATE_PER_EMAIL = os.environ.get('HMS_LOGIN_RATE_PER_EMAIL', '5/60')
+    # Reverse proxies in front of the app (1 on Render). Their X-Forwarded-For/-Proto
+    # headers are trusted, so the client IP is the caller's, not the proxy's
+    PROXY_HOPS = int(os.environ.get('HMS_PROXY_HOPS', 0))
+    # Users allowed on the /admin/* views, comma-separated (create_superadmin.py's account by default)
+    SUPERADMIN_EMAILS = os.environ.get('HMS_SUPERADMIN_EMAILS', 'superadmin@test.com')
+    # Instrumentation (see metrics.py): slow-request / slow-query log thresholds, and the
+    # bearer token required to scrape /metrics (unset: /metrics refuses every request)
+    SLOW_REQUEST_MS = float(os.environ.get('HMS_SLOW_REQUEST_MS', 500))
+    SLOW_QUERY_MS = float(os.environ.get('HMS_SLOW_QUERY_MS', 100))
+    METRICS_TOKEN = os.environ.get('HMS_METRICS_TOKEN')
+    # ASGI mode (see asgi.py): threads running the routes that stay synchronous
+    ASGI_SYNC_THREADS = int(os.environ.get('HMS_ASGI_SYNC_THREADS', 16))
+    # Read replicas (see replicas.py): comma-separated URLs of read-only copies of the
+    # database, how long a user reads from the primary after writing, and the health checks
+    REPLICA_URLS = [url.strip() for url in os.environ.get('HMS_REPLICA_URLS', '').split(',') if url.strip()]
+    REPLICA_STICKY_SECONDS = float(os.environ.get('HMS_REPLICA_STICKY_SECONDS', 5))
+    REPLICA_CHECK_SECONDS = float(os.environ.get('HMS_REPLICA_CHECK_SECONDS', 10))
+    REPLICA_MAX_LAG_SECONDS = float(os.environ.get('HMS_REPLICA_MAX_LAG_SECONDS', 30))
+    # Tenant shards (see shards.py and tenants.py): extra databases as name=url pairs, the
+    # shards new hospitals may be placed on (default: all), and the PostgreSQL id range
+    # reserved per shard so rows keep their ids when a hospital moves
+    SHARD_URLS = parse_shards(os.environ.get('HMS_SHARDS', ''))
+    SHARDS_OPEN = [name.strip() for name in os.environ.get('HMS_SHARDS_OPEN', '').split(',') if name.strip()]
+    SHARD_ID_STRIDE = int(os.environ.get('HMS_SHARD_ID_STRIDE', 100_000_000))
+    SHARD_MOVE_BATCH_SIZE = 1000
 
 # ----------------------------------------------------
 # 2. Initialization & Blueprint Definition
 # ----------------------------------------------------
-db = SQLAlchemy()
+# Tenant tables go to the tenant's shard, and reads of @replica_reads views to a
+# replica when REPLICA_URLS is set
+db = SQLAlchemy(session_options={'class_': ShardedSession})
 # Define Blueprint globally
 auth_bp = Blueprint('auth', __name__)
+# Maintenance commands, available as `flask hms <command>`
+hms_cli = AppGroup('hms', help='HMS maintenance commands.')
 
 # ----------------------------------------------------
 # 3. Database Models 
@@ -44,6 +166,23 @@ class Hospital(db.Model):
     license_number = db.Column(db.String(50), unique=True, nullable=False)
     admin_email = db.Column(db.String(120), unique=True, nullable=False)
     status = db.Column(db.String(20), default='PENDING', nullable=False) # Status flow: PENDING → VERIFIED → ACTIVE → SUSPENDED → INACTIVE
+    placement = db.relationship('TenantShard', uselist=False, lazy='joined')
+
+# Where a hospital's rows live (see shards.py); no row means the default shard
+class TenantShard(db.Model):
+    __tablename__ = 'tenant_shards'
+    hospital_id = db.Column(db.String(36), db.ForeignKey('hospitals.id'), primary_key=True)
+    shard = db.Column(db.String(64), nullable=False, default=DEFAULT_SHARD)
+    # ACTIVE, or MOVING while `flask hms move-tenant` copies the rows (writes are paused)
+    status = db.Column(db.String(20), nullable=False, default='ACTIVE')
+    moved_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index('ix_tenant_shards_shard', 'shard'),
+    )
+
+    def __repr__(self):
+        return f'<TenantShard {self.hospital_id} {self.shard}>'
 
 # Model for Users (FR-6)
 class User(db.Model):
@@ -53,13 +192,17 @@ class User(db.Model):
     first_name = db.Column(db.String(50), nullable=False)
     last_name = db.Column(db.String(50), nullable=False)
     email = db.Column(db.String(120), unique=True, nullable=False)
-    password_hash = db.Column(db.String(128))
+    password_hash = db.Column(db.String(255))
+
+    __table_args__ = (
+        db.Index('ix_users_hospital', 'hospital_id'),
+    )
 
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = hash_password(password)
 
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return verify_password(self.password_hash, password)
 
 # Model for Patients
 class Patient(db.Model):
@@ -75,6 +218,12 @@ class Patient(db.Model):
     blood_group = db.Column(db.String(5))
     address = db.Column(db.String(255))
     created_at = db.Column(db.DateTime, default=datetime.now)
+
+    # Every query is tenant-scoped, so every index leads with hospital_id
+    __table_args__ = (
+        db.Index('ix_patients_hospital_created', 'hospital_id', 'created_at', 'id'),
+        db.Index('ix_patients_hospital_email', 'hospital_id', 'email'),
+    )
     
     def __repr__(self):
         return f'<Patient {self.first_name} {self.last_name}>'
@@ -90,6 +239,11 @@ class Department(db.Model):
     email = db.Column(db.String(120))
     phone = db.Column(db.String(20))
     created_at = db.Column(db.DateTime, default=datetime.now)
+
+    __table_args__ = (
+        db.Index('ix_departments_hospital_created', 'hospital_id', 'created_at', 'id'),
+        db.Index('ix_departments_hospital_name', 'hospital_id', 'name'),
+    )
     
     def __repr__(self):
         return f'<Department {self.name}>'
@@ -109,10 +263,20 @@ class Doctor(db.Model):
     experience_years = db.Column(db.Integer)
     status = db.Column(db.String(20), default='ACTIVE')
     created_at = db.Column(db.DateTime, default=datetime.now)
+
+    department = db.relationship('Department')
+
+    __table_args__ = (
+        db.Index('ix_doctors_hospital_created', 'hospital_id', 'created_at', 'id'),
+        db.Index('ix_doctors_hospital_email', 'hospital_id', 'email'),
+        db.Index('ix_doctors_hospital_department', 'hospital_id', 'department_id'),
+    )
     
     def __repr__(self):
         return f'<Doctor {self.first_name} {self.last_name}>'
 
+APPOINTMENT_STATUSES = ('SCHEDULED', 'COMPLETED', 'CANCELLED', 'NO_SHOW')
+
 # Model for Appointments
 class Appointment(db.Model):
     __tablename__ = 'appointments'
@@ -122,9 +286,25 @@ class Appointment(db.Model):
     doctor_id = db.Column(db.Integer, db.ForeignKey('doctors.id'), nullable=False)
     appointment_date = db.Column(db.DateTime, nullable=False)
     reason = db.Column(db.String(255))
-    status = db.Column(db.String(20), default='SCHEDULED')  # SCHEDULED, COMPLETED, CANCELLED
+    status = db.Column(db.String(20), default='SCHEDULED')  # APPOINTMENT_STATUSES; changes go through appointment_workflow.py
     notes = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.now)
+
+    # Many-to-one only; list views eager-load these with joinedload() to avoid N+1 queries
+    patient = db.relationship('Patient')
+    doctor = db.relationship('Doctor')
+
+    __table_args__ = (
+        db.Index('ix_appointments_hospital_created', 'hospital_id', 'created_at', 'id'),
+        db.Index('ix_appointments_hospital_doctor_date', 'hospital_id', 'doctor_id', 'appointment_date'),
+        db.Index('ix_appointments_hospital_patient', 'hospital_id', 'patient_id'),
+        db.Index('ix_appointments_hospital_date', 'hospital_id', 'appointment_date'),
+        # A doctor can hold one live booking per slot start; cancelling frees the slot.
+        # Enforced by the database, so concurrent bookings cannot both succeed.
+        db.Index('uq_appointments_doctor_slot', 'doctor_id', 'appointment_date', unique=True,
+                 sqlite_where=text("status != 'CANCELLED'"),
+                 postgresql_where=text("status != 'CANCELLED'")),
+    )
     
     def __repr__(self):
         return f'<Appointment {self.id}>'
@@ -137,27 +317,275 @@ class MedicalRecord(db.Model):
     patient_id = db.Column(db.Integer, db.ForeignKey('patients.id'), nullable=False)
     doctor_id = db.Column(db.Integer, db.ForeignKey('doctors.id'))
     diagnosis = db.Column(db.String(255))
-    treatment = db.Column(db.Text)
-    prescription = db.Column(db.Text)
+    # Large bodies: loaded on first access, so timeline lists only read the headers
+    treatment = deferred(db.Column(db.Text), group='body')
+    prescription = deferred(db.Column(db.Text), group='body')
     created_at = db.Column(db.DateTime, default=datetime.now)
+
+    patient = db.relationship('Patient')
+    doctor = db.relationship('Doctor')
+
+    __table_args__ = (
+        db.Index('ix_medical_records_hospital_patient_created', 'hospital_id', 'patient_id', 'created_at'),
+        db.Index('ix_medical_records_hospital_created', 'hospital_id', 'created_at', 'id'),
+    )
     
     def __repr__(self):
         return f'<MedicalRecord {self.id}>'
 
+# Model for per-hospital row counters, maintained on insert/delete (see section 5)
+class HospitalStats(db.Model):
+    __tablename__ = 'hospital_stats'
+    hospital_id = db.Column(db.String(36), db.ForeignKey('hospitals.id'), primary_key=True)
+    patients = db.Column(db.Integer, default=0, nullable=False)
+    appointments = db.Column(db.Integer, default=0, nullable=False)
+    doctors = db.Column(db.Integer, default=0, nullable=False)
+    departments = db.Column(db.Integer, default=0, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
+
+    def __repr__(self):
+        return f'<HospitalStats {self.hospital_id}>'
+
+# ----------------------------------------------------
+# 4. Multi-tenancy Context (FR-2)
+# ----------------------------------------------------
+# The logged-in user and their hospital are resolved once per request into plain
+# snapshots on flask.g (g.user, g.hospital, g.hospital_id). Snapshots are kept in a
+# per-worker TTL cache and evicted when the underlying row is updated or deleted.
+
+def _tenant_cache():
+    return current_app.extensions['hms_tenant_cache']
+
+def user_snapshot(user):
+    """Plain copy of a User row for g.user and the tenant cache."""
+    if user is None:
+        return None
+    return SimpleNamespace(
+        id=user.id,
+        hospital_id=user.hospital_id,
+        first_name=user.first_name,
+        last_name=user.last_name,
+        email=user.email,
+        name=f"{user.first_name} {user.last_name}"
+    )
+
+def hospital_snapshot(hospital):
+    """Plain copy of a Hospital row for g.hospital and the tenant cache."""
+    if hospital is None:
+        return None
+    return SimpleNamespace(
+        id=hospital.id,
+        name=hospital.name,
+        address=hospital.address,
+        contact_details=hospital.contact_details,
+        license_number=hospital.license_number,
+        admin_email=hospital.admin_email,
+        status=hospital.status,
+        shard=hospital.placement.shard if hospital.placement else DEFAULT_SHARD,
+        shard_status=hospital.placement.status if hospital.placement else 'ACTIVE'
+    )
+
+def load_tenant_user(user_id):
+    """Snapshot of a User, served from the tenant cache."""
+    return _tenant_cache().get_or_load(('user', user_id), lambda: user_snapshot(db.session.get(User, user_id)))
+
+def load_tenant_hospital(hospital_id):
+    """Snapshot of a Hospital, served from the tenant cache."""
+    return _tenant_cache().get_or_load(
+        ('hospital', hospital_id), lambda: hospital_snapshot(db.session.get(Hospital, hospital_id))
+    )
+
+def _queue_tenant_eviction(kind, key='id'):
+    def listener(mapper, connection, target):
+        # Evict once the change is committed, so a concurrent request cannot
+        # re-cache the old row between flush and commit
+        object_session(target).info.setdefault('hms_tenant_evict', set()).add((kind, getattr(target, key)))
+    return listener
+
+for _model, _kind in ((User, 'user'), (Hospital, 'hospital')):
+    event.listen(_model, 'after_update', _queue_tenant_eviction(_kind))
+    event.listen(_model, 'after_delete', _queue_tenant_eviction(_kind))
+# The hospital snapshot carries its shard
+for _event in ('after_insert', 'after_update', 'after_delete'):
+    event.listen(TenantShard, _event, _queue_tenant_eviction('hospital', 'hospital_id'))
+
+@event.listens_for(FlaskSQLAlchemySession, 'after_commit')
+def _evict_tenant_cache(db_session):
+    keys = db_session.info.pop('hms_tenant_evict', ())
+    cache = current_app.extensions.get('hms_tenant_cache')
+    if cache is not None:
+        for key in keys:
+            cache.pop(key)
+
+@event.listens_for(FlaskSQLAlchemySession, 'after_rollback')
+def _discard_tenant_eviction(db_session):
+    db_session.info.pop('hms_tenant_evict', None)
+
+# Rendered fragments (list tables, select options) are cached per tenant and scope.
+# Writes to a model invalidate the scopes that display it, once committed.
+# Bulk Core writes bypass the mapper events and must call invalidate_fragments().
+
+# Model -> fragment scopes showing its rows (the doctor list shows department names)
+FRAGMENT_SCOPES = {
+    Department: ('departments', 'doctors'),
+    Doctor: ('doctors',),
+}
+
+def make_cache_backend(config, ttl, maxsize, namespace):
+    """Cache backend selected by CACHE_BACKEND."""
+    if config['CACHE_BACKEND'] == 'filesystem':
+        return FileSystemCache(os.path.join(config['CACHE_DIR'], namespace), ttl, maxsize)
+    return TTLCache(ttl, maxsize)
+
+def cached_fragment(scope, render, by_args=True):
+    """Render (or reuse) a fragment of the current tenant.
+
+    The fragment varies with the endpoint and, unless `by_args` is False, the request arguments.
+    """
+    args = tuple(sorted(request.args.items(multi=True))) if by_args else ()
+    variant = (request.endpoint if by_args else None, render.__name__, args)
+    def render_from_primary():
+        # Fragments are shared until the next write invalidates them, so a lagging
+        # replica must not fill the cache
+        with primary_reads():
+            return render()
+    html = current_app.extensions['hms_fragments'].get_or_render(g.hospital_id, scope, variant, render_from_primary)
+    return Markup(html)
+
+def invalidate_fragments(hospital_id, *scopes):
+    current_app.extensions['hms_fragments'].invalidate(hospital_id, *scopes)
+
+def _queue_fragment_invalidation(scopes):
+    def listener(mapper, connection, target):
+        pending = object_session(target).info.setdefault('hms_fragment_invalidate', set())
+        pending.update((target.hospital_id, scope) for scope in scopes)
+    return listener
+
+for _model, _scopes in FRAGMENT_SCOPES.items():
+    for _event in ('after_insert', 'after_update', 'after_delete'):
+        event.listen(_model, _event, _queue_fragment_invalidation(_scopes))
+
+@event.listens_for(FlaskSQLAlchemySession, 'after_commit')
+def _invalidate_fragments(db_session):
+    pending = db_session.info.pop('hms_fragment_invalidate', ())
+    fragments = current_app.extensions.get('hms_fragments') if pending else None
+    if fragments is not None:
+        for hospital_id, scope in pending:
+            fragments.invalidate(hospital_id, scope)
+
+@event.listens_for(FlaskSQLAlchemySession, 'after_rollback')
+def _discard_fragment_invalidation(db_session):
+    db_session.info.pop('hms_fragment_invalidate', None)
+
+# ----------------------------------------------------
+# 5. Hospital Statistics
+# ----------------------------------------------------
+# Dashboard totals come from one hospital_stats row per tenant instead of COUNT(*)
+# scans. The row is bumped in the same transaction as every insert/delete of a
+# counted model; bulk Core inserts must call bump_hospital_stats() themselves.
+# `flask hms rebuild-stats` recomputes the counters from the tables.
+
+# Counter column -> model it counts
+COUNTED_MODELS = {
+    'patients': Patient,
+    'appointments': Appointment,
+    'doctors': Doctor,
+    'departments': Department,
+}
+
+def bump_hospital_stats(connection, hospital_id, **deltas):
+    """Add deltas (e.g. patients=1) to a hospital's counters on `connection`."""
+    stats = HospitalStats.__table__
+    values = {name: stats.c[name] + delta for name, delta in deltas.items() if delta}
+    if values:
+        connection.execute(
+            update(stats).where(stats.c.hospital_id == hospital_id).values(updated_at=datetime.now(), **values)
+        )
+
+def _counter_listener(column, delta):
+    def listener(mapper, connection, target):
+        bump_hospital_stats(connection, target.hospital_id, **{column: delta})
+    return listener
+
+for _column, _model in COUNTED_MODELS.items():
+    event.listen(_model, 'after_insert', _counter_listener(_column, 1))
+    event.listen(_model, 'after_delete', _counter_listener(_column, -1))
+
+@event.listens_for(Hospital, 'after_insert')
+def _create_hospital_stats(mapper, connection, target):
+    if target.placement is not None and target.placement.shard != DEFAULT_SHARD:
+        return  # tenants.place_tenant() creates it on the hospital's shard
+    connection.execute(HospitalStats.__table__.insert().values(hospital_id=target.id))
+
+def count_hospital_rows(hospital_id):
+    """All counters for one hospital, computed in a single aggregated query."""
+    counts = select(*[
+        select(func.count()).select_from(model).where(model.hospital_id == hospital_id)
+        .scalar_subquery().label(column)
+        for column, model in COUNTED_MODELS.items()
+    ])
+    return dict(db.session.execute(counts).one()._mapping)
+
+def load_hospital_stats(hospital_id):
+    """Dashboard counters for a hospital, seeding its stats row on first use."""
+    stats = db.session.get(HospitalStats, hospital_id)
+    if stats is not None:
+        return {column: getattr(stats, column) for column in COUNTED_MODELS}
+    counts = count_hospital_rows(hospital_id)
+    try:
+        with db.session.begin_nested():
+            db.session.add(HospitalStats(hospital_id=hospital_id, **counts))
+        db.session.commit()
+    except IntegrityError:
+        # Another request seeded the row first
+        db.session.rollback()
+    return counts
+
+# The list pages' statements, shared with their async versions in asgi.py
+def patients_statement(hospital_id):
+    return select(Patient).where(Patient.hospital_id == hospital_id)
+
+def appointments_statement(hospital_id):
+    return select(Appointment).where(Appointment.hospital_id == hospital_id).options(
+        joinedload(Appointment.patient),
+        joinedload(Appointment.doctor)
+    )
+
+def dashboard_context(stats):
+    """Template context of the dashboard for the current tenant and its counters."""
+    return dict(
+        user_name=g.user.name,
+        hospital_name=g.hospital.name,
+        total_patients=stats['patients'],
+        total_appointments=stats['appointments'],
+        total_doctors=stats['doctors'],
+        total_departments=stats['departments']
+    )
+
 # ----------------------------------------------------
-# 4. HTML Templates (Embedded)
+# 6. HTML Templates (Embedded)
 # ----------------------------------------------------
 
 # Login required decorator
 def login_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        if 'user_id' not in session:
+        if g.get('user') is None:
             flash('Please log in first.', 'warning')
             return redirect(url_for('auth.login'))
         return f(*args, **kwargs)
     return decorated_function
 
+# Superadmin required decorator, for views that show every tenant's data
+def superadmin_required(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        admins = {email.strip().lower() for email in current_app.config['SUPERADMIN_EMAILS'].split(',')}
+        if g.user.email.lower() not in admins:
+            abort(403)
+        return f(*args, **kwargs)
+    return login_required(decorated_function)
+
 # HTML Templates for additional pages
 PATIENTS_HTML = r"""
 <!DOCTYPE html>
@@ -194,6 +622,14 @@ PATIENTS_HTML = r"""
             {% endif %}
         {% endwith %}
 
+        <div class="card mt-4">
+            <div class="card-body position-relative">
+                <label class="form-label" for="patient-search"><i class="bi bi-search"></i> Find a patient</label>
+                <input type="search" id="patient-search" class="form-control" placeholder="Name, email or phone" autocomplete="off">
+                <div id="patient-search-results" class="list-group position-absolute w-100 shadow" style="z-index: 10;"></div>
+            </div>
+        </div>
+
         <div class="card mt-4">
             <div class="card-header bg-primary text-white">
                 <h5 class="mb-0">Add New Patient</h5>
@@ -259,8 +695,39 @@ PATIENTS_HTML = r"""
         </div>
 
         <div class="card mt-4">
-            <div class="card-header bg-secondary text-white">
-                <h5 class="mb-0">Patient List ({{ patient_count }})</h5>
+            <div class="card-header bg-primary text-white">
+                <h5 class="mb-0">Bulk Import</h5>
+            </div>
+            <div class="card-body">
+                <form method="POST" action="{{ url_for('patient_import.upload_patients') }}" enctype="multipart/form-data" class="row g-2 align-items-end">
+                    <div class="col-md-8">
+                        <label class="form-label">CSV or JSONL file</label>
+                        <input type="file" class="form-control" name="file" accept=".csv,.jsonl,.ndjson" required>
+                        <div class="form-text">Columns: first_name, last_name, email, phone, date_of_birth (YYYY-MM-DD), gender, blood_group, address</div>
+                    </div>
+                    <div class="col-md-4">
+                        <button type="submit" class="btn btn-outline-primary w-100"><i class="bi bi-upload"></i> Import Patients</button>
+                    </div>
+                </form>
+            </div>
+        </div>
+
+        <div class="card mt-4">
+            <div class="card-header bg-secondary text-white d-flex justify-content-between align-items-center">
+                <h5 class="mb-0">Patient List (showing {{ patients|length }})</h5>
+                <form method="GET" class="d-flex gap-2">
+                    <select name="sort" class="form-select form-select-sm" onchange="this.form.submit()">
+                        {% for option in patients.sort_options %}
+                            <option value="{{ option }}" {{ 'selected' if option == patients.sort }}>{{ option|capitalize }} first</option>
+                        {% endfor %}
+                    </select>
+                    <select name="per_page" class="form-select form-select-sm" onchange="this.form.submit()">
+                        {% for size in patients.page_sizes %}
+                            <option value="{{ size }}" {{ 'selected' if size == patients.per_page }}>{{ size }} / page</option>
+                        {% endfor %}
+                    </select>
+                    <a class="btn btn-sm btn-light text-nowrap" href="{{ url_for('exports.export_resource', resource='patients', file_format='csv') }}"><i class="bi bi-download"></i> CSV</a>
+                </form>
             </div>
             <div class="card-body">
                 {% if patients %}
@@ -286,19 +753,51 @@ PATIENTS_HTML = r"""
                                 <td><span class="badge bg-info">{{ patient.blood_group or 'N/A' }}</span></td>
                                 <td>{{ patient.created_at.strftime('%d/%m/%Y') }}</td>
                                 <td>
-                                    <a href="#" class="btn btn-sm btn-info">View</a>
+                                    <a href="{{ url_for('medical_records.timeline', patient_id=patient.id) }}" class="btn btn-sm btn-info">Records</a>
                                     <a href="#" class="btn btn-sm btn-warning">Edit</a>
                                 </td>
                             </tr>
                             {% endfor %}
                         </tbody>
                     </table>
+                    <nav aria-label="Patient pages">
+                        <ul class="pagination justify-content-end mb-0">
+                            <li class="page-item {{ 'disabled' if not patients.has_prev }}"><a class="page-link" href="{{ patients.prev_url or '#' }}">&laquo; Previous</a></li>
+                            <li class="page-item {{ 'disabled' if not patients.has_next }}"><a class="page-link" href="{{ patients.next_url or '#' }}">Next &raquo;</a></li>
+                        </ul>
+                    </nav>
                 {% else %}
                     <div class="alert alert-info">✓ Patient management system is ready. Add your first patient above!</div>
                 {% endif %}
             </div>
         </div>
     </div>
+    <script>
+        (function () {
+            var input = document.getElementById('patient-search');
+            var results = document.getElementById('patient-search-results');
+            var timer = null, latest = 0;
+            input.addEventListener('input', function () {
+                clearTimeout(timer);
+                timer = setTimeout(function () {
+                    var q = input.value.trim(), request = ++latest;
+                    if (!q) { results.innerHTML = ''; return; }
+                    fetch('{{ url_for('search.search') }}?per_page=10&q=' + encodeURIComponent(q))
+                        .then(function (response) { return response.json(); })
+                        .then(function (data) {
+                            if (request !== latest) { return; }  // a newer keystroke won
+                            results.innerHTML = '';
+                            data.results.forEach(function (patient) {
+                                var item = document.createElement('div');
+                                item.className = 'list-group-item';
+                                item.textContent = '#' + patient.id + ' ' + patient.name + ' \u00b7 ' + patient.email + ' \u00b7 ' + patient.phone;
+                                results.appendChild(item);
+                            });
+                        });
+                }, 150);
+            });
+        })();
+    </script>
 </body>
 </html>
 """
@@ -345,23 +844,19 @@ APPOINTMENTS_HTML = r"""
             <div class="card-body">
                 <form method="POST" action="{{ url_for('add_appointment') }}">
                     <div class="row">
-                        <div class="col-md-6 mb-3">
+                        <div class="col-md-6 mb-3 position-relative">
                             <label class="form-label">Patient</label>
-                            <select class="form-control" name="patient_id" required>
-                                <option value="">Select Patient</option>
-                                {% for patient in patients %}
-                                    <option value="{{ patient.id }}">{{ patient.first_name }} {{ patient.last_name }}</option>
-                                {% endfor %}
-                            </select>
+                            <input type="text" class="form-control" autocomplete="off" placeholder="Type a name, email or phone" required
+                                   data-lookup="{{ url_for('agenda.lookup_patients') }}" data-target="patient-id">
+                            <input type="hidden" id="patient-id" name="patient_id">
+                            <div class="list-group position-absolute w-100 shadow-sm" style="z-index: 10;"></div>
                         </div>
-                        <div class="col-md-6 mb-3">
+                        <div class="col-md-6 mb-3 position-relative">
                             <label class="form-label">Doctor</label>
-                            <select class="form-control" name="doctor_id" required>
-                                <option value="">Select Doctor</option>
-                                {% for doctor in doctors %}
-                                    <option value="{{ doctor.id }}">Dr. {{ doctor.first_name }} {{ doctor.last_name }} ({{ doctor.specialization }})</option>
-                                {% endfor %}
-                            </select>
+                            <input type="text" class="form-control" autocomplete="off" placeholder="Type a name or specialization" required
+                                   data-lookup="{{ url_for('agenda.lookup_doctors') }}" data-target="doctor-id">
+                            <input type="hidden" id="doctor-id" name="doctor_id">
+                            <div class="list-group position-absolute w-100 shadow-sm" style="z-index: 10;"></div>
                         </div>
                     </div>
                     <div class="row">
@@ -384,8 +879,22 @@ APPOINTMENTS_HTML = r"""
         </div>
 
         <div class="card mt-4">
-            <div class="card-header bg-secondary text-white">
-                <h5 class="mb-0">Appointments ({{ appointment_count }})</h5>
+            <div class="card-header bg-secondary text-white d-flex justify-content-between align-items-center">
+                <h5 class="mb-0">Appointments (showing {{ appointments|length }})</h5>
+                <form method="GET" class="d-flex gap-2">
+                    <select name="sort" class="form-select form-select-sm" onchange="this.form.submit()">
+                        {% for option in appointments.sort_options %}
+                            <option value="{{ option }}" {{ 'selected' if option == appointments.sort }}>{{ option|capitalize }} first</option>
+                        {% endfor %}
+                    </select>
+                    <select name="per_page" class="form-select form-select-sm" onchange="this.form.submit()">
+                        {% for size in appointments.page_sizes %}
+                            <option value="{{ size }}" {{ 'selected' if size == appointments.per_page }}>{{ size }} / page</option>
+                        {% endfor %}
+                    </select>
+                    <a class="btn btn-sm btn-light text-nowrap" href="{{ url_for('agenda.calendar') }}"><i class="bi bi-calendar3"></i> Calendar</a>
+                    <a class="btn btn-sm btn-light text-nowrap" href="{{ url_for('exports.export_resource', resource='appointments', file_format='csv') }}"><i class="bi bi-download"></i> CSV</a>
+                </form>
             </div>
             <div class="card-body">
                 {% if appointments %}
@@ -409,22 +918,86 @@ APPOINTMENTS_HTML = r"""
                                 <td>{{ apt.reason or 'General' }}</td>
                                 <td><span class="badge bg-{{ 'success' if apt.status == 'SCHEDULED' else 'warning' if apt.status == 'COMPLETED' else 'danger' }}">{{ apt.status }}</span></td>
                                 <td>
-                                    <a href="#" class="btn btn-sm btn-info">View</a>
+                                    <a href="{{ url_for('appointment_workflow.appointment_detail', appointment_id=apt.id) }}" class="btn btn-sm btn-info">View</a>
                                 </td>
                             </tr>
                             {% endfor %}
                         </tbody>
                     </table>
+                    <nav aria-label="Appointment pages">
+                        <ul class="pagination justify-content-end mb-0">
+                            <li class="page-item {{ 'disabled' if not appointments.has_prev }}"><a class="page-link" href="{{ appointments.prev_url or '#' }}">&laquo; Previous</a></li>
+                            <li class="page-item {{ 'disabled' if not appointments.has_next }}"><a class="page-link" href="{{ appointments.next_url or '#' }}">Next &raquo;</a></li>
+                        </ul>
+                    </nav>
                 {% else %}
                     <div class="alert alert-info">✓ No appointments scheduled yet. Schedule your first appointment above!</div>
                 {% endif %}
             </div>
         </div>
     </div>
+    {% include 'typeahead.html' %}
 </body>
 </html>
 """
 
+# Pickers: a text input with data-lookup (a /lookup/... URL) and data-target (the id
+# of the hidden input that receives the chosen id), followed by an empty .list-group.
+# data-submit submits the form on every choice, e.g. for filters.
+TYPEAHEAD_HTML = r"""
+<script>
+    (function () {
+        document.querySelectorAll('input[data-lookup]').forEach(function (input) {
+            var target = document.getElementById(input.dataset.target);
+            var results = input.parentNode.querySelector('.list-group');
+            var timer = null, latest = 0;
+            function pick(id, label) {
+                input.value = label;
+                target.value = id;
+                results.innerHTML = '';
+                if (input.dataset.submit) { input.form.submit(); }
+            }
+            input.addEventListener('input', function () {
+                target.value = '';
+                input.setCustomValidity('');
+                clearTimeout(timer);
+                timer = setTimeout(function () {
+                    var q = input.value.trim(), request = ++latest;
+                    if (!q) {
+                        results.innerHTML = '';
+                        if (input.dataset.submit) { pick('', ''); }
+                        return;
+                    }
+                    fetch(input.dataset.lookup + '?q=' + encodeURIComponent(q))
+                        .then(function (response) { return response.json(); })
+                        .then(function (data) {
+                            if (request !== latest) { return; }  // a newer keystroke won
+                            results.innerHTML = '';
+                            data.results.forEach(function (match) {
+                                var item = document.createElement('button');
+                                item.type = 'button';
+                                item.className = 'list-group-item list-group-item-action';
+                                item.textContent = match.label + (match.detail ? ' \u00b7 ' + match.detail : '');
+                                item.addEventListener('click', function () { pick(match.id, match.label); });
+                                results.appendChild(item);
+                            });
+                        });
+                }, 150);
+            });
+            if (input.required) {
+                input.form.addEventListener('submit', function (event) {
+                    if (!target.value) {
+                        event.preventDefault();
+                        input.setCustomValidity('Pick one of the suggestions.');
+                        input.reportValidity();
+                    }
+                });
+            }
+        });
+    })();
+</script>
+"""
+
 DOCTORS_HTML = r"""
 <!DOCTYPE html>
 <html lang="en">
@@ -505,9 +1078,7 @@ DOCTORS_HTML = r"""
                             <label class="form-label">Department</label>
                             <select class="form-control" name="department_id">
                                 <option value="">Select Department</option>
-                                {% for dept in departments %}
-                                    <option value="{{ dept.id }}">{{ dept.name }}</option>
-                                {% endfor %}
+                                {{ department_options }}
                             </select>
                         </div>
                     </div>
@@ -516,9 +1087,28 @@ DOCTORS_HTML = r"""
             </div>
         </div>
 
+        {{ doctor_list }}
+    </div>
+</body>
+</html>
+"""
+
+DOCTOR_LIST_HTML = r"""
         <div class="card mt-4">
-            <div class="card-header bg-secondary text-white">
-                <h5 class="mb-0">Doctor List ({{ doctor_count }})</h5>
+            <div class="card-header bg-secondary text-white d-flex justify-content-between align-items-center">
+                <h5 class="mb-0">Doctor List (showing {{ doctors|length }})</h5>
+                <form method="GET" class="d-flex gap-2">
+                    <select name="sort" class="form-select form-select-sm" onchange="this.form.submit()">
+                        {% for option in doctors.sort_options %}
+                            <option value="{{ option }}" {{ 'selected' if option == doctors.sort }}>{{ option|capitalize }} first</option>
+                        {% endfor %}
+                    </select>
+                    <select name="per_page" class="form-select form-select-sm" onchange="this.form.submit()">
+                        {% for size in doctors.page_sizes %}
+                            <option value="{{ size }}" {{ 'selected' if size == doctors.per_page }}>{{ size }} / page</option>
+                        {% endfor %}
+                    </select>
+                </form>
             </div>
             <div class="card-body">
                 {% if doctors %}
@@ -528,6 +1118,7 @@ DOCTORS_HTML = r"""
                                 <th>ID</th>
                                 <th>Name</th>
                                 <th>Specialization</th>
+                                <th>Department</th>
                                 <th>Experience</th>
                                 <th>Email</th>
                                 <th>Status</th>
@@ -540,6 +1131,7 @@ DOCTORS_HTML = r"""
                                 <td>#{{ doctor.id }}</td>
                                 <td>Dr. {{ doctor.first_name }} {{ doctor.last_name }}</td>
                                 <td>{{ doctor.specialization }}</td>
+                                <td>{{ doctor.department.name if doctor.department else '-' }}</td>
                                 <td>{{ doctor.experience_years or 'N/A' }} years</td>
                                 <td>{{ doctor.email }}</td>
                                 <td><span class="badge bg-success">{{ doctor.status }}</span></td>
@@ -550,14 +1142,17 @@ DOCTORS_HTML = r"""
                             {% endfor %}
                         </tbody>
                     </table>
+                    <nav aria-label="Doctor pages">
+                        <ul class="pagination justify-content-end mb-0">
+                            <li class="page-item {{ 'disabled' if not doctors.has_prev }}"><a class="page-link" href="{{ doctors.prev_url or '#' }}">&laquo; Previous</a></li>
+                            <li class="page-item {{ 'disabled' if not doctors.has_next }}"><a class="page-link" href="{{ doctors.next_url or '#' }}">Next &raquo;</a></li>
+                        </ul>
+                    </nav>
                 {% else %}
                     <div class="alert alert-info">✓ No doctors added yet. Add your first doctor above!</div>
                 {% endif %}
             </div>
         </div>
-    </div>
-</body>
-</html>
 """
 
 DEPARTMENTS_HTML = r"""
@@ -630,9 +1225,34 @@ DEPARTMENTS_HTML = r"""
             </div>
         </div>
 
+        {{ department_list }}
+    </div>
+</body>
+</html>
+"""
+
+DEPARTMENT_OPTIONS_HTML = r"""
+{% for dept in departments %}
+    <option value="{{ dept.id }}">{{ dept.name }}</option>
+{% endfor %}
+"""
+
+DEPARTMENT_LIST_HTML = r"""
         <div class="card mt-4">
-            <div class="card-header bg-secondary text-white">
-                <h5 class="mb-0">Department List ({{ department_count }})</h5>
+            <div class="card-header bg-secondary text-white d-flex justify-content-between align-items-center">
+                <h5 class="mb-0">Department List (showing {{ departments|length }})</h5>
+                <form method="GET" class="d-flex gap-2">
+                    <select name="sort" class="form-select form-select-sm" onchange="this.form.submit()">
+                        {% for option in departments.sort_options %}
+                            <option value="{{ option }}" {{ 'selected' if option == departments.sort }}>{{ option|capitalize }} first</option>
+                        {% endfor %}
+                    </select>
+                    <select name="per_page" class="form-select form-select-sm" onchange="this.form.submit()">
+                        {% for size in departments.page_sizes %}
+                            <option value="{{ size }}" {{ 'selected' if size == departments.per_page }}>{{ size }} / page</option>
+                        {% endfor %}
+                    </select>
+                </form>
             </div>
             <div class="card-body">
                 {% if departments %}
@@ -660,14 +1280,17 @@ DEPARTMENTS_HTML = r"""
                             {% endfor %}
                         </tbody>
                     </table>
+                    <nav aria-label="Department pages">
+                        <ul class="pagination justify-content-end mb-0">
+                            <li class="page-item {{ 'disabled' if not departments.has_prev }}"><a class="page-link" href="{{ departments.prev_url or '#' }}">&laquo; Previous</a></li>
+                            <li class="page-item {{ 'disabled' if not departments.has_next }}"><a class="page-link" href="{{ departments.next_url or '#' }}">Next &raquo;</a></li>
+                        </ul>
+                    </nav>
                 {% else %}
                     <div class="alert alert-info">✓ No departments added yet. Add your first department above!</div>
                 {% endif %}
             </div>
         </div>
-    </div>
-</body>
-</html>
 """
 
 SETTINGS_HTML = r"""
@@ -849,6 +1472,56 @@ LOGIN_HTML = r"""
 </html>
 """
 
+ACTIVATE_HTML = r"""
+<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <title>HMS Account Activation</title>
+    <link href="https://cdn.jsdelivr.net/npm/bootstrap@5.3.3/dist/css/bootstrap.min.css" rel="stylesheet">
+</head>
+<body class="bg-light">
+    <div class="container my-5">
+        <div class="row justify-content-center">
+            <div class="col-md-5">
+                <div class="card shadow">
+                    <div class="card-header bg-secondary text-white">
+                        <h2 class="mb-0">🔑 Set Your Password</h2>
+                    </div>
+                    <div class="card-body">
+                        {% with messages = get_flashed_messages(with_categories=true) %}
+                            {% if messages %}
+                                <div class="mb-3">
+                                    {% for category, message in messages %}
+                                        <div class="alert alert-{{ 'danger' if category == 'danger' else 'success' }}" role="alert">{{ message }}</div>
+                                    {% endfor %}
+                                </div>
+                            {% endif %}
+                        {% endwith %}
+                        <form method="POST">
+                            <div class="mb-3">
+                                <label class="form-label">Email Address:</label>
+                                <input type="email" class="form-control" value="{{ email }}" disabled>
+                            </div>
+                            <div class="mb-3">
+                                <label for="password" class="form-label">New Password:</label>
+                                <input type="password" class="form-control" id="password" name="password" required>
+                            </div>
+                            <div class="mb-3">
+                                <label for="confirm" class="form-label">Confirm Password:</label>
+                                <input type="password" class="form-control" id="confirm" name="confirm" required>
+                            </div>
+                            <button type="submit" class="btn btn-primary w-100">Set Password</button>
+                        </form>
+                    </div>
+                </div>
+            </div>
+        </div>
+    </div>
+</body>
+</html>
+"""
+
 # IMPORTANT CHANGE: Adding the Chatbot Widget Code before </body>
 DASHBOARD_HTML = r"""
 <!DOCTYPE html>
@@ -932,6 +1605,7 @@ DASHBOARD_HTML = r"""
                     <a href="{{ url_for('appointments') }}"><i class="bi bi-calendar-event"></i> Appointments</a>
                     <a href="{{ url_for('doctors') }}"><i class="bi bi-person-badge"></i> Doctors</a>
                     <a href="{{ url_for('departments') }}"><i class="bi bi-building"></i> Departments</a>
+                    <a href="{{ url_for('reports.reports') }}"><i class="bi bi-bar-chart"></i> Reports</a>
                     <a href="{{ url_for('hospital_settings') }}"><i class="bi bi-gear"></i> Settings</a>
                 </div>
             </div>
@@ -1008,11 +1682,84 @@ DASHBOARD_HTML = r"""
 </html>
 """
 
+# Embedded templates by name. TemplateRegistry compiles them once per app
+# instead of re-parsing the source on every request.
+EMBEDDED_TEMPLATES = {
+    'patients.html': PATIENTS_HTML,
+    'appointments.html': APPOINTMENTS_HTML,
+    'typeahead.html': TYPEAHEAD_HTML,
+    'doctors.html': DOCTORS_HTML,
+    'doctor_list.html': DOCTOR_LIST_HTML,
+    'departments.html': DEPARTMENTS_HTML,
+    'department_list.html': DEPARTMENT_LIST_HTML,
+    'department_options.html': DEPARTMENT_OPTIONS_HTML,
+    'settings.html': SETTINGS_HTML,
+    'register.html': REGISTER_HTML,
+    'login.html': LOGIN_HTML,
+    'activate.html': ACTIVATE_HTML,
+    'dashboard.html': DASHBOARD_HTML,
+}
+
+class TemplateRegistry:
+    """Holds the compiled embedded templates of one app."""
+
+    def __init__(self, app, templates, bytecode_cache_dir=None):
+        self.app = app
+        self.loader = DictLoader({})
+        # Embedded templates win over the (empty) templates folder
+        app.jinja_env.loader = ChoiceLoader([self.loader, app.jinja_env.loader])
+        if bytecode_cache_dir:
+            os.makedirs(bytecode_cache_dir, exist_ok=True)
+            app.jinja_env.bytecode_cache = FileSystemBytecodeCache(bytecode_cache_dir)
+        self.templates = {}
+        for name, source in templates.items():
+            self.register(name, source)
+
+    def register(self, name, source):
+        """Add a template and compile it right away."""
+        self.loader.mapping[name] = source
+        self.templates[name] = self.app.jinja_env.get_template(name)
+        return self.templates[name]
+
+    def render(self, name, **context):
+        # render_template() accepts a Template object, so context processors
+        # and the template_rendered signal still apply
+        return render_template(self.templates[name], **context)
+
+def render_page(name, **context):
+    """Render an embedded template of the current app by name."""
+    return current_app.extensions['hms_templates'].render(name, **context)
+
 # ----------------------------------------------------
-# 5. ROUTES (BLUEPRINT) - DEFINED BEFORE APP CREATION
+# 7. ROUTES (BLUEPRINT) - DEFINED BEFORE APP CREATION
 # ----------------------------------------------------
 # These functions MUST be defined before create_app() is called in __main__.
 
+MIN_PASSWORD_LENGTH = 8
+
+# Activation links let a new hospital admin set the first password (see jobs.send_activation_email).
+# The signed token carries a digest of the stored password hash, so it stops working once used.
+def _activation_serializer():
+    return URLSafeTimedSerializer(current_app.config['SECRET_KEY'], salt='hms-activation')
+
+def _password_digest(user):
+    return hashlib.sha256((user.password_hash or '').encode()).hexdigest()[:16]
+
+def activation_token(user):
+    """Single-use token that lets `user` set their password at /auth/activate/<token>."""
+    return _activation_serializer().dumps([user.id, _password_digest(user)])
+
+def user_for_activation_token(token):
+    """The user `token` was issued to, or None if it is invalid, expired or already used."""
+    try:
+        user_id, digest = _activation_serializer().loads(token, max_age=current_app.config['ACTIVATION_TOKEN_MAX_AGE'])
+    except (BadSignature, TypeError, ValueError):
+        return None
+    user = db.session.get(User, user_id)
+    if user is None or not hmac.compare_digest(str(digest), _password_digest(user)):
+        return None
+    return user
+
 @auth_bp.route('/register', methods=['GET', 'POST'])
 def register():
     """Handles Hospital Self-Registration (FR-1)."""
@@ -1027,7 +1774,7 @@ def register():
         # 2. Validate license number uniqueness
         if Hospital.query.filter_by(license_number=license_number).first():
             flash('License number is already registered.', 'danger')
-            return render_template_string(REGISTER_HTML)
+            return render_page('register.html')
         
         # 3. Auto-generate tenant ID (UUID-based) & create Hospital
         tenant_id = str(uuid.uuid4())
@@ -1041,30 +1788,32 @@ def register():
             status='PENDING' 
         )
         db.session.add(new_hospital)
+        from tenants import place_tenant
+        place_tenant(new_hospital)
         
-        # 4. Create Admin Credentials automatically
-        admin_username = f"admin@{name.lower().replace(' ', '')}.hms" 
-        temp_password = 'TemporaryPass1!' 
-        
+        # 4. Create the admin without a password; the activation link sets it
         admin_user = User(
             hospital_id=tenant_id,
             first_name='Hospital',
             last_name='Admin',
             email=admin_email,
-            password_hash=generate_password_hash(temp_password)
         )
         db.session.add(admin_user)
+
+        # 5. Queue the activation email; it commits (or rolls back) with the registration
+        from jobs import enqueue
+        enqueue('send_activation_email', hospital_id=tenant_id)
         
         try:
             db.session.commit()
-            flash('Registration successful! Please check your email for the activation link and temporary admin credentials.', 'success')
+            flash('Registration successful! Please check your email for the link to set your admin password.', 'success')
             return redirect(url_for('auth.login'))
         except Exception as e:
             db.session.rollback()
             flash(f'An error occurred during registration: {e}', 'danger')
-            return render_template_string(REGISTER_HTML)
+            return render_page('register.html')
         
-    return render_template_string(REGISTER_HTML)
+    return render_page('register.html')
 
 @auth_bp.route('/login', methods=['GET', 'POST'])
 def login():
@@ -1072,10 +1821,27 @@ def login():
     if request.method == 'POST':
         email = request.form.get('email')
         password = request.form.get('password')
+
+        # Refuse bursts before doing any hashing
+        wait = current_app.extensions['hms_login_limiter'].check(request.remote_addr, email)
+        if wait:
+            flash(f'Too many login attempts. Try again in {int(wait) + 1} seconds.', 'danger')
+            return render_page('login.html'), 429, {'Retry-After': str(int(wait) + 1)}
         
         user = User.query.filter_by(email=email).first()
+
+        try:
+            authenticated = user is not None and user.check_password(password)
+        except VerifierBusy:
+            flash('The server is busy. Please try again in a moment.', 'danger')
+            return render_page('login.html'), 503, {'Retry-After': '5'}
         
-        if user and user.check_password(password):
+        if authenticated:
+            if needs_rehash(user.password_hash):
+                # The hashing policy changed since this password was stored
+                user.set_password(password)
+                db.session.commit()
+
             # Set session data
             session['user_id'] = user.id
             session['user_email'] = user.email
@@ -1087,7 +1853,27 @@ def login():
         else:
             flash('Invalid email or password.', 'danger')
             
-    return render_template_string(LOGIN_HTML)
+    return render_page('login.html')
+
+@auth_bp.route('/activate/<token>', methods=['GET', 'POST'])
+def activate(token):
+    """Set the first password of a new hospital admin from their activation link."""
+    user = user_for_activation_token(token)
+    if user is None:
+        flash('This activation link is invalid, expired or already used.', 'danger')
+        return redirect(url_for('auth.login'))
+    if request.method == 'POST':
+        password = request.form.get('password') or ''
+        if len(password) < MIN_PASSWORD_LENGTH:
+            flash(f'Use at least {MIN_PASSWORD_LENGTH} characters.', 'danger')
+        elif password != request.form.get('confirm'):
+            flash('The passwords do not match.', 'danger')
+        else:
+            user.set_password(password)
+            db.session.commit()
+            flash('Your password is set. You can log in now.', 'success')
+            return redirect(url_for('auth.login'))
+    return render_page('activate.html', email=user.email)
 
 @auth_bp.route('/logout')
 def logout():
@@ -1097,7 +1883,7 @@ def logout():
     return redirect(url_for('auth.login'))
 
 # ----------------------------------------------------
-# 6. CORE APPLICATION ROUTES (HELPER FUNCTION)
+# 8. CORE APPLICATION ROUTES (HELPER FUNCTION)
 # ----------------------------------------------------
 # This function attaches routes to the main app instance.
 
@@ -1106,9 +1892,26 @@ def register_app_routes(app_instance):
     
     @app_instance.before_request
     def before_request_func():
-        """Placeholder for the Multi-tenancy Context Adapter (FR-2)."""
-        # Middleware that handles cross-tenant data access prevention
-        pass
+        """Multi-tenancy Context Adapter (FR-2): resolve the user and hospital for this request."""
+        g.user = g.hospital = g.hospital_id = None
+        user_id = session.get('user_id')
+        if user_id is None:
+            return
+        user = load_tenant_user(user_id)
+        # A deleted user, or a session pointing at another tenant, ends the session
+        if user is None or session.get('hospital_id') not in (None, user.hospital_id):
+            session.clear()
+            return
+        g.user = user
+        g.hospital = load_tenant_hospital(user.hospital_id)
+        g.hospital_id = user.hospital_id
+        if g.hospital is None:
+            return
+        route_to_shard(g.hospital.shard)
+        if g.hospital.shard_status == 'MOVING' and request.method not in ('GET', 'HEAD', 'OPTIONS'):
+            # `flask hms move-tenant` is copying this hospital to another shard
+            return Response('This hospital is being moved to a new database. Changes are paused '
+                            'for a few minutes; please try again shortly.', 503, {'Retry-After': '60'})
 
     @app_instance.route('/')
     def index():
@@ -1116,36 +1919,24 @@ def register_app_routes(app_instance):
 
     @app_instance.route('/dashboard')
     @login_required
+    @replica_reads
     def dashboard():
         """Main dashboard - protected route."""
-        user = User.query.get(session['user_id'])
-        hospital = Hospital.query.get(user.hospital_id)
-        
         # Get statistics
-        total_patients = Patient.query.filter_by(hospital_id=user.hospital_id).count()
-        total_appointments = Appointment.query.filter_by(hospital_id=user.hospital_id).count()
-        total_doctors = Doctor.query.filter_by(hospital_id=user.hospital_id).count()
-        total_departments = Department.query.filter_by(hospital_id=user.hospital_id).count()
+        stats = load_hospital_stats(g.hospital_id)
         
-        return render_template_string(DASHBOARD_HTML,
-            user_name=session['user_name'],
-            hospital_name=hospital.name,
-            total_patients=total_patients,
-            total_appointments=total_appointments,
-            total_doctors=total_doctors,
-            total_departments=total_departments
-        )
+        return render_page('dashboard.html', **dashboard_context(stats))
 
     @app_instance.route('/patients')
     @login_required
+    @replica_reads
     def patients():
         """Patients management page."""
-        user = User.query.get(session['user_id'])
-        patient_list = Patient.query.filter_by(hospital_id=user.hospital_id).all()
-        return render_template_string(PATIENTS_HTML, 
-            user_name=session['user_name'],
-            patients=patient_list,
-            patient_count=len(patient_list)
+        statement, plan = keyset_query(patients_statement(g.hospital_id), Patient, **request_page_args())
+        patient_page = keyset_page(db.session.scalars(statement).all(), plan)
+        return render_page('patients.html', 
+            user_name=g.user.name,
+            patients=patient_page
         )
 
     @app_instance.route('/add_patient', methods=['POST'])
@@ -1153,9 +1944,8 @@ def register_app_routes(app_instance):
     def add_patient():
         """Add a new patient."""
         try:
-            user = User.query.get(session['user_id'])
             new_patient = Patient(
-                hospital_id=user.hospital_id,
+                hospital_id=g.hospital_id,
                 first_name=request.form.get('first_name'),
                 last_name=request.form.get('last_name'),
                 email=request.form.get('email'),
@@ -1175,33 +1965,33 @@ def register_app_routes(app_instance):
 
     @app_instance.route('/appointments')
     @login_required
+    @replica_reads
     def appointments():
         """Appointments management page."""
-        user = User.query.get(session['user_id'])
-        appointment_list = Appointment.query.filter_by(hospital_id=user.hospital_id).all()
-        patient_list = Patient.query.filter_by(hospital_id=user.hospital_id).all()
-        doctor_list = Doctor.query.filter_by(hospital_id=user.hospital_id).all()
+        statement, plan = keyset_query(appointments_statement(g.hospital_id), Appointment, **request_page_args())
+        appointment_page = keyset_page(db.session.scalars(statement).all(), plan)
         
-        return render_template_string(APPOINTMENTS_HTML, 
-            user_name=session['user_name'],
-            appointments=appointment_list,
-            patients=patient_list,
-            doctors=doctor_list,
-            appointment_count=len(appointment_list)
+        return render_page('appointments.html', 
+            user_name=g.user.name,
+            appointments=appointment_page
         )
 
     @app_instance.route('/add_appointment', methods=['POST'])
     @login_required
     def add_appointment():
         """Add a new appointment."""
+        from scheduling import validate_slot
         try:
-            user = User.query.get(session['user_id'])
             appointment_datetime = datetime.strptime(
                 request.form.get('appointment_date'), 
                 '%Y-%m-%dT%H:%M'
             )
+            # The pickers only offer this hospital's patients, but the form can be replayed
+            if Patient.query.filter_by(hospital_id=g.hospital_id, id=request.form.get('patient_id', type=int)).first() is None:
+                raise ValueError('Unknown patient.')
+            validate_slot(g.hospital_id, request.form.get('doctor_id', type=int), appointment_datetime)
             new_appointment = Appointment(
-                hospital_id=user.hospital_id,
+                hospital_id=g.hospital_id,
                 patient_id=request.form.get('patient_id'),
                 doctor_id=request.form.get('doctor_id'),
                 appointment_date=appointment_datetime,
@@ -1212,6 +2002,10 @@ def register_app_routes(app_instance):
             db.session.add(new_appointment)
             db.session.commit()
             flash('Appointment scheduled successfully!', 'success')
+        except IntegrityError:
+            # uq_appointments_doctor_slot: someone else booked this slot first
+            db.session.rollback()
+            flash('That doctor is already booked at this time. Please pick another slot.', 'error')
         except Exception as e:
             db.session.rollback()
             flash(f'Error scheduling appointment: {str(e)}', 'error')
@@ -1219,17 +2013,21 @@ def register_app_routes(app_instance):
 
     @app_instance.route('/doctors')
     @login_required
+    @replica_reads
     def doctors():
         """Doctors management page."""
-        user = User.query.get(session['user_id'])
-        doctor_list = Doctor.query.filter_by(hospital_id=user.hospital_id).all()
-        department_list = Department.query.filter_by(hospital_id=user.hospital_id).all()
+        def doctor_list():
+            doctor_query = Doctor.query.filter_by(hospital_id=g.hospital_id).options(joinedload(Doctor.department))
+            return render_page('doctor_list.html', doctors=paginate_request(doctor_query, Doctor))
+
+        def department_options():
+            department_list = Department.query.filter_by(hospital_id=g.hospital_id).order_by(Department.name).all()
+            return render_page('department_options.html', departments=department_list)
         
-        return render_template_string(DOCTORS_HTML, 
-            user_name=session['user_name'],
-            doctors=doctor_list,
-            departments=department_list,
-            doctor_count=len(doctor_list)
+        return render_page('doctors.html', 
+            user_name=g.user.name,
+            doctor_list=cached_fragment('doctors', doctor_list),
+            department_options=cached_fragment('departments', department_options, by_args=False)
         )
 
     @app_instance.route('/add_doctor', methods=['POST'])
@@ -1237,9 +2035,8 @@ def register_app_routes(app_instance):
     def add_doctor():
         """Add a new doctor."""
         try:
-            user = User.query.get(session['user_id'])
             new_doctor = Doctor(
-                hospital_id=user.hospital_id,
+                hospital_id=g.hospital_id,
                 first_name=request.form.get('first_name'),
                 last_name=request.form.get('last_name'),
                 specialization=request.form.get('specialization'),
@@ -1260,15 +2057,16 @@ def register_app_routes(app_instance):
 
     @app_instance.route('/departments')
     @login_required
+    @replica_reads
     def departments():
         """Departments management page."""
-        user = User.query.get(session['user_id'])
-        department_list = Department.query.filter_by(hospital_id=user.hospital_id).all()
+        def department_list():
+            department_page = paginate_request(Department.query.filter_by(hospital_id=g.hospital_id), Department)
+            return render_page('department_list.html', departments=department_page)
         
-        return render_template_string(DEPARTMENTS_HTML, 
-            user_name=session['user_name'],
-            departments=department_list,
-            department_count=len(department_list)
+        return render_page('departments.html', 
+            user_name=g.user.name,
+            department_list=cached_fragment('departments', department_list)
         )
 
     @app_instance.route('/add_department', methods=['POST'])
@@ -1276,9 +2074,8 @@ def register_app_routes(app_instance):
     def add_department():
         """Add a new department."""
         try:
-            user = User.query.get(session['user_id'])
             new_department = Department(
-                hospital_id=user.hospital_id,
+                hospital_id=g.hospital_id,
                 name=request.form.get('name'),
                 description=request.form.get('description'),
                 head_name=request.form.get('head_name'),
@@ -1293,14 +2090,46 @@ def register_app_routes(app_instance):
             flash(f'Error adding department: {str(e)}', 'error')
         return redirect(url_for('departments'))
 
+    @app_instance.route('/admin/pool')
+    @superadmin_required
+    def pool_stats():
+        """Connection pool usage of the worker serving this request."""
+        return jsonify(dict(pool_status(db.engine), replicas=current_app.extensions['hms_replicas'].status(),
+                            shards=current_app.extensions['hms_shards'].status()))
+
+    @app_instance.route('/admin/cache')
+    @superadmin_required
+    def cache_stats():
+        """Hit/miss counters of this worker's caches."""
+        fragments = current_app.extensions['hms_fragments']
+        return jsonify(
+            pid=os.getpid(),
+            backend=type(fragments.backend).__name__,
+            fragments=fragments.stats.as_dict(),
+            fragment_store=dict(fragments.backend.stats.as_dict(), entries=len(fragments.backend)),
+            tenant=dict(_tenant_cache().stats.as_dict(), entries=len(_tenant_cache())),
+        )
+
+    @app_instance.route('/metrics')
+    def metrics():
+        """Prometheus metrics of the worker serving this request."""
+        collector = current_app.extensions['hms_metrics']
+        if not collector.authorized():
+            abort(401)
+        fragments = current_app.extensions['hms_fragments']
+        body = collector.render(pool=pool_status(db.engine), caches={
+            'fragments': (fragments.stats, len(fragments.backend)),
+            'tenant': (_tenant_cache().stats, len(_tenant_cache())),
+        })
+        return Response(body, content_type=METRICS_CONTENT_TYPE)
+
     @app_instance.route('/hospital_settings')
     @login_required
     def hospital_settings():
         """Hospital settings page."""
-        user = User.query.get(session['user_id'])
-        hospital = Hospital.query.get(user.hospital_id)
-        return render_template_string(SETTINGS_HTML, 
-            user_name=session['user_name'],
+        hospital = g.hospital
+        return render_page('settings.html', 
+            user_name=g.user.name,
             hospital_name=hospital.name,
             hospital_email=hospital.admin_email,
             hospital_phone=hospital.contact_details,
@@ -1309,7 +2138,200 @@ def register_app_routes(app_instance):
 
 
 # ----------------------------------------------------
-# 7. APP FACTORY
+# 9. CLI COMMANDS
+# ----------------------------------------------------
+# Registered on the `hms` group; run with `flask --app app hms <command>`.
+
+class Explain(Executable, ClauseElement):
+    """EXPLAIN wrapper for a SELECT, rendered per dialect."""
+    inherit_cache = False
+
+    def __init__(self, statement):
+        self.statement = statement
+
+@compiles(Explain)
+def _compile_explain(element, compiler, **kw):
+    prefix = 'EXPLAIN QUERY PLAN ' if compiler.dialect.name == 'sqlite' else 'EXPLAIN '
+    return prefix + compiler.process(element.statement, **kw)
+
+def hot_queries(hospital_id):
+    """The tenant-scoped queries issued by the routes, as (label, statement) pairs."""
+    now = datetime.now()
+    queries = []
+    for model in (Patient, Appointment, Doctor, Department):
+        scoped = select(model).where(model.hospital_id == hospital_id)
+        newest = (model.created_at.desc(), model.id.desc())
+        queries.append((f'{model.__tablename__}: first page', scoped.order_by(*newest).limit(26)))
+        queries.append((f'{model.__tablename__}: cursor page',
+                        scoped.where(tuple_(model.created_at, model.id) < (now, 0)).order_by(*newest).limit(26)))
+        queries.append((f'{model.__tablename__}: dashboard count',
+                        select(func.count()).select_from(model).where(model.hospital_id == hospital_id)))
+    queries.append(('departments: doctor form dropdown',
+                    select(Department).where(Department.hospital_id == hospital_id).order_by(Department.name)))
+    queries.append(('appointments: doctor day schedule',
+                    select(Appointment).where(Appointment.hospital_id == hospital_id,
+                                              Appointment.doctor_id == 0,
+                                              Appointment.appointment_date >= now,
+                                              Appointment.appointment_date < now)))
+    queries.append(('patients: lookup by email',
+                    select(Patient).where(Patient.hospital_id == hospital_id, Patient.email == '')))
+    queries.append(('medical_records: patient timeline',
+                    select(MedicalRecord).where(MedicalRecord.hospital_id == hospital_id,
+                                                MedicalRecord.patient_id == 0)
+                    .order_by(MedicalRecord.created_at.desc())))
+    queries.append(('users: login by email', select(User).where(User.email == '')))
+    return queries
+
+def _plan_uses_index(plan_lines):
+    markers = ('USING INDEX', 'USING COVERING INDEX', 'USING PRIMARY KEY', 'USING INTEGER PRIMARY KEY',
+               'Index Scan', 'Index Only Scan', 'Bitmap Index Scan')
+    return any(marker in line for line in plan_lines for marker in markers)
+
+def create_missing_indexes(engine, echo=click.echo, tables=None):
+    """Create declared indexes that are missing from existing tables (idempotent).
+
+    Returns False if any index could not be created (e.g. a unique index over
+    existing duplicate rows).
+    """
+    inspector = db.inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    all_created = True
+    for table in tables or db.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            echo(f'- {table.name}: table missing, run `flask hms init` first')
+            continue
+        present = {ix['name'] for ix in inspector.get_indexes(table.name)}
+        for index in sorted(table.indexes, key=lambda ix: ix.name):
+            if index.name in present:
+                echo(f'  {index.name}: exists')
+                continue
+            try:
+                # One transaction per index so a failure does not undo the others
+                with engine.begin() as conn:
+                    index.create(bind=conn, checkfirst=True)
+                echo(f'+ {index.name}: created')
+            except DBAPIError as e:
+                all_created = False
+                echo(f'! {index.name}: FAILED ({e.orig})')
+    return all_created
+
+@hms_cli.command('create-indexes')
+@click.option('--explain/--no-explain', default=True, help='Print the query plan report afterwards.')
+def create_indexes_command(explain):
+    """Create any missing model indexes on an existing database (idempotent)."""
+    engine = db.engine
+    ok = create_missing_indexes(engine)
+    from tenants import shard_tables
+    for name, shard_engine in current_app.extensions['hms_shards'].engines.items():
+        click.echo(f'\nShard {name}:')
+        ok = create_missing_indexes(shard_engine, tables=shard_tables()) and ok
+    if explain:
+        ok = explain_report(engine) and ok
+    if not ok:
+        raise SystemExit(1)
+
+def explain_report(engine):
+    """Print the plan of every hot query and whether it is index-backed."""
+    hospital = db.session.execute(select(Hospital.id).limit(1)).scalar() or str(uuid.uuid4())
+    all_ok = True
+    click.echo(f'\nQuery plans ({engine.dialect.name}):')
+    with engine.begin() as conn:
+        if engine.dialect.name == 'postgresql':
+            # Small tables make the planner prefer sequential scans; we only want to
+            # know that an index *can* serve each query.
+            conn.exec_driver_sql('SET LOCAL enable_seqscan = off')
+        for label, statement in hot_queries(hospital):
+            plan = [' '.join(col for col in row if isinstance(col, str)) for row in conn.execute(Explain(statement))]
+            uses_index = _plan_uses_index(plan)
+            all_ok = all_ok and uses_index
+            click.echo(f"[{'ok' if uses_index else 'NO INDEX'}] {label}")
+            for line in plan:
+                click.echo(f'      {line}')
+    return all_ok
+
+@hms_cli.command('rebuild-stats')
+@click.option('--hospital-id', default=None, help='Only rebuild this hospital.')
+def rebuild_stats_command(hospital_id):
+    """Recompute the hospital_stats counters from the tenant tables."""
+    from tenants import hospitals_by_shard
+    total = fixed = 0
+    for shard, hospital_ids in hospitals_by_shard(hospital_id).items():
+        with shard_context(shard):
+            fixed += rebuild_stats(hospital_ids, hospital_id)
+        total += len(hospital_ids)
+    click.echo(f'Rebuilt stats for {total} hospital(s); {fixed} corrected.')
+
+def rebuild_stats(hospital_ids, hospital_id=None):
+    """Recompute the counters of `hospital_ids` (all on the current shard); returns how many changed."""
+    counts = {h: dict.fromkeys(COUNTED_MODELS, 0) for h in hospital_ids}
+    # One GROUP BY per table for all hospitals
+    for column, model in COUNTED_MODELS.items():
+        grouped = select(model.hospital_id, func.count()).group_by(model.hospital_id)
+        if hospital_id:
+            grouped = grouped.where(model.hospital_id == hospital_id)
+        for h, total in db.session.execute(grouped):
+            if h in counts:
+                counts[h][column] = total
+    fixed = 0
+    for h, values in counts.items():
+        stats = db.session.get(HospitalStats, h)
+        if stats is None:
+            db.session.add(HospitalStats(hospital_id=h, **values))
+            fixed += 1
+        elif any(getattr(stats, column) != value for column, value in values.items()):
+            for column, value in values.items():
+                setattr(stats, column, value)
+            fixed += 1
+    db.session.commit()
+    return fixed
+
+# (table, column) pairs whose declared length grew after tables were first created
+WIDENED_COLUMNS = (
+    ('users', 'password_hash'),  # scrypt hashes are ~160 characters
+)
+
+def widen_columns(engine, echo=click.echo):
+    """ALTER existing VARCHAR columns that are shorter than the model declares (PostgreSQL)."""
+    if engine.dialect.name != 'postgresql':
+        return  # SQLite does not enforce VARCHAR lengths
+    inspector = db.inspect(engine)
+    for table_name, column_name in WIDENED_COLUMNS:
+        declared = db.metadata.tables[table_name].c[column_name].type.length
+        current = {c['name']: c['type'] for c in inspector.get_columns(table_name)}[column_name]
+        if getattr(current, 'length', None) and current.length < declared:
+            with engine.begin() as conn:
+                conn.execute(text(f'ALTER TABLE {table_name} ALTER COLUMN {column_name} TYPE VARCHAR({declared})'))
+            echo(f'+ {table_name}.{column_name}: widened to {declared}')
+
+def bootstrap(app, verbose=True):
+    """Create tables, indexes and the search index and make sure the super admin exists."""
+    with app.app_context():
+        db.create_all()
+        echo = click.echo if verbose else (lambda message: None)
+        widen_columns(db.engine, echo=echo)
+        create_missing_indexes(db.engine, echo=echo)
+        from search import setup_search
+        setup_search(db.engine)
+        from tenants import init_shard_schemas
+        init_shard_schemas(echo=echo)
+    from create_superadmin import init_superadmin
+    return init_superadmin(app, verbose=verbose)
+
+def start_job_threads(app):
+    """Start JOB_THREADS in-process job workers (none by default)."""
+    if app.config['JOB_THREADS'] > 0:
+        from jobs import Worker
+        return Worker(app, app.config['JOB_THREADS']).start()
+
+@hms_cli.command('init')
+@click.option('--quiet', is_flag=True, help='Only report failures.')
+def init_command(quiet):
+    """Bootstrap the database: tables, indexes and the super admin user."""
+    if not bootstrap(current_app._get_current_object(), verbose=not quiet):
+        raise SystemExit(1)
+
+# ----------------------------------------------------
+# 10. APP FACTORY
 # ----------------------------------------------------
 # This function is responsible for creating and configuring the app instance.
 
@@ -1317,40 +2339,98 @@ def create_app():
     app = Flask(__name__)
     app.config.from_object(Config)
     app.secret_key = app.config['SECRET_KEY']  # Required for session management
+    if app.config['PROXY_HOPS']:
+        # Behind a proxy every request comes from the proxy's address, which would turn
+        # the per-IP login limit into one limit for everybody
+        hops = app.config['PROXY_HOPS']
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=hops, x_proto=hops)
     db.init_app(app)
+    init_replicas(app)
+    init_shards(app)
+
+    app.extensions['hms_tenant_cache'] = TTLCache(app.config['TENANT_CACHE_TTL'], app.config['TENANT_CACHE_SIZE'])
+    app.extensions['hms_fragments'] = FragmentCache(make_cache_backend(
+        app.config, app.config['FRAGMENT_CACHE_TTL'], app.config['FRAGMENT_CACHE_SIZE'], 'fragments'
+    ))
+    app.extensions['hms_login_limiter'] = LoginLimiter(app.config['LOGIN_RATE_PER_IP'], app.config['LOGIN_RATE_PER_EMAIL'])
+
+    # Compile the embedded templates once for the lifetime of the app
+    app.extensions['hms_templates'] = TemplateRegistry(
+        app, EMBEDDED_TEMPLATES, app.config['TEMPLATE_BYTECODE_CACHE_DIR']
+    )
     
     # 1. Register Blueprint (this is safe now that all routes are defined above)
     app.register_blueprint(auth_bp, url_prefix='/auth')
     
+    # Request timing hooks go first so they cover the tenant lookup as well
+    init_metrics(app)
+
     # 2. Register core app routes
     register_app_routes(app)
+
+    # Feature modules import their models from this module, so load them lazily
+    from patient_import import import_bp
+    from exports import exports_bp
+    from scheduling import scheduling_bp
+    from api import api_bp
+    from search import search_bp
+    from medical_records import records_bp
+    from jobs import jobs_bp
+    from agenda import agenda_bp
+    from reports import reports_bp
+    from appointment_workflow import workflow_bp
+    import tenants  # noqa: F401 (move-tenant and shards commands)
+    app.register_blueprint(import_bp)
+    app.register_blueprint(exports_bp)
+    app.register_blueprint(scheduling_bp)
+    app.register_blueprint(api_bp, url_prefix='/api/v1')
+    app.register_blueprint(search_bp)
+    app.register_blueprint(records_bp)
+    app.register_blueprint(jobs_bp)
+    app.register_blueprint(agenda_bp)
+    app.register_blueprint(reports_bp)
+    app.register_blueprint(workflow_bp)
+
+    # 3. Register CLI commands
+    app.cli.add_command(hms_cli)
     
     return app
 
 
 # ----------------------------------------------------
-# 8. EXECUTION BLOCK
+# 11. EXECUTION BLOCK
 # ----------------------------------------------------
 if __name__ == '__main__':
     print("Hospital Management System (HMS) - Initializing Single-File Flask App")
     print("Database: sqlite:///hms_main.db")
 
-    # Create the application instance
-    app_instance = create_app()
+    # Re-import under the canonical module name so create_superadmin.py (which
+    # does `from app import db`) shares this app's SQLAlchemy instance
+    import app as hms
 
-    with app_instance.app_context():
-        # Create database tables for the main metadata DB
-        db.create_all()
-        print("Database tables created/checked.")
+    # Create the application instance
+    app_instance = hms.create_app()
+    hms.bootstrap(app_instance)
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        # Only in the reloader's serving child, not the watcher process
+        hms.start_job_threads(app_instance)
     
     # Run the application
-    # For production, use: gunicorn app:app_instance
+    # For production, use: gunicorn app:app
     app_instance.run(debug=True, host='0.0.0.0', port=5000)
 
-# WSGI app for production (Gunicorn/Render)
-app = create_app()
-with app.app_context():
-    db.create_all()
-    # Auto-initialize super admin on startup (verbose=False for production)
-    from create_superadmin import init_superadmin
-    init_superadmin(app, verbose=False)
+# WSGI app for production (Gunicorn/Render): `gunicorn app:app`.
+# Built on first access and does no database work, so importing this module (from
+# create_superadmin.py, create_user.py or a gunicorn worker) stays cheap. Run
+# `flask --app app hms init` once per deploy, or set HMS_AUTO_INIT=1 to bootstrap
+# the database when the app is built.
+def __getattr__(name):
+    if name == 'app':
+        global app
+        app = create_app()
+        if os.environ.get('HMS_AUTO_INIT') == '1':
+            bootstrap(app, verbose=False)
+        # Threads do not survive fork: with HMS_JOB_THREADS, don't use gunicorn --preload
+        start_job_threads(app)
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,342 @@
+# appointment_workflow.py
+# Appointment status workflow: allowed transitions, batch changes and an audit trail.
+#
+#   SCHEDULED -> COMPLETED | CANCELLED | NO_SHOW
+#   NO_SHOW   -> COMPLETED     (the patient turned up late after all)
+#   CANCELLED -> SCHEDULED     (reinstated, if nobody has taken the slot since)
+#
+# COMPLETED and NO_SHOW only apply once the appointment's time has come, and a
+# reinstatement only while it is still ahead.
+#
+# A change of many appointments ("cancel Dr. X's appointments today", "mark
+# yesterday's no-shows") is one UPDATE ... WHERE status = <source> ... RETURNING
+# per allowed source status, not a load-and-commit per row. The returned rows
+# give one appointment_status_changes row each (a single multi-row INSERT) and
+# move their counts between the report rollups, in the same transaction.
+#
+#   GET  /appointments/<id>            details, status history and the next steps
+#   POST /appointments/<id>/status     status=CANCELLED&reason=...
+#   POST /appointments/status          {"status": "NO_SHOW", "date": "2026-01-05"}
+#                                      {"status": "CANCELLED", "doctor_id": 3, "date": "2026-01-06", "reason": "..."}
+#                                      {"status": "COMPLETED", "ids": [12, 13]}
+
+import uuid
+from collections import Counter
+from datetime import date, datetime, timedelta
+
+from flask import Blueprint, abort, flash, g, redirect, request, url_for
+from sqlalchemy import insert, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload
+
+from api import api_login_required, json_response
+from app import APPOINTMENT_STATUSES, Appointment, db, login_required, render_page
+from replicas import replica_reads
+from reports import bump_appointments
+
+workflow_bp = Blueprint('appointment_workflow', __name__)
+
+TRANSITIONS = {
+    'SCHEDULED': ('COMPLETED', 'CANCELLED', 'NO_SHOW'),
+    'NO_SHOW': ('COMPLETED',),
+    'CANCELLED': ('SCHEDULED',),
+    'COMPLETED': (),
+}
+# Statuses an appointment can only reach once its time has come
+AFTER_START = frozenset({'COMPLETED', 'NO_SHOW'})
+# ... and those it can only reach while its time is still ahead
+BEFORE_START = frozenset({'SCHEDULED'})
+
+
+# Model for the audit trail: one row per status change
+class AppointmentStatusChange(db.Model):
+    __tablename__ = 'appointment_status_changes'
+    id = db.Column(db.Integer, primary_key=True)
+    hospital_id = db.Column(db.String(36), db.ForeignKey('hospitals.id'), nullable=False)
+    appointment_id = db.Column(db.Integer, db.ForeignKey('appointments.id'), nullable=False)
+    from_status = db.Column(db.String(20), nullable=False)
+    to_status = db.Column(db.String(20), nullable=False)
+    reason = db.Column(db.String(255))
+    # Users live in the directory database (see shards.py), so no foreign key
+    changed_by = db.Column(db.Integer)
+    changed_by_name = db.Column(db.String(100))
+    batch_id = db.Column(db.String(36), nullable=False)  # the changes made by one request
+    changed_at = db.Column(db.DateTime, default=datetime.now, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_appointment_status_changes_hospital_appointment', 'hospital_id', 'appointment_id', 'changed_at'),
+    )
+
+    def __repr__(self):
+        return f'<AppointmentStatusChange {self.appointment_id} {self.from_status}->{self.to_status}>'
+
+
+def next_statuses(appointment, now=None):
+    """Statuses `appointment` may move to now."""
+    now = now or datetime.now()
+    return [status for status in TRANSITIONS.get(appointment.status or 'SCHEDULED', ())
+            if (status not in AFTER_START or appointment.appointment_date <= now)
+            and (status not in BEFORE_START or appointment.appointment_date > now)]
+
+
+def _update_returning(conditions, to_status):
+    """UPDATE the matching appointments; returns their (id, doctor_id, appointment_date) rows."""
+    table = Appointment.__table__
+    columns = (table.c.id, table.c.doctor_id, table.c.appointment_date)
+    statement = update(table).where(*conditions).values(status=to_status)
+    if db.session.connection().dialect.update_returning:
+        return db.session.execute(statement.returning(*columns)).all()
+    # No RETURNING (e.g. MySQL): lock the rows, then update them by key
+    rows = db.session.execute(select(*columns).where(*conditions).with_for_update()).all()
+    if rows:
+        db.session.execute(update(table).where(table.c.id.in_([row.id for row in rows])).values(status=to_status))
+    return rows
+
+
+def transition_appointments(hospital_id, to_status, conditions, reason=None, user=None):
+    """Move every appointment of `hospital_id` matching `conditions` that may reach `to_status`.
+
+    `conditions` are extra WHERE clauses on Appointment columns. Appointments
+    whose status cannot move to `to_status` (or whose time has not come, for
+    AFTER_START statuses, or has passed, for BEFORE_START ones) are left alone. Returns [(appointment id, old status)].
+    The caller commits; a reinstated appointment whose slot has been taken since
+    raises IntegrityError.
+    """
+    if to_status not in TRANSITIONS:
+        raise ValueError(f"status must be one of {', '.join(TRANSITIONS)}")
+    table = Appointment.__table__
+    now = datetime.now()
+    batch_id = str(uuid.uuid4())
+    changed, audit, moved = [], [], Counter()
+    for from_status in [status for status, targets in TRANSITIONS.items() if to_status in targets]:
+        where = [table.c.hospital_id == hospital_id, table.c.status == from_status, *conditions]
+        if to_status in AFTER_START:
+            where.append(table.c.appointment_date <= now)
+        if to_status in BEFORE_START:
+            where.append(table.c.appointment_date > now)
+        for row in _update_returning(where, to_status):
+            changed.append((row.id, from_status))
+            audit.append(dict(hospital_id=hospital_id, appointment_id=row.id, from_status=from_status,
+                              to_status=to_status, reason=reason, changed_by=user.id if user else None,
+                              changed_by_name=user.name if user else None, batch_id=batch_id, changed_at=now))
+            moved[(row.appointment_date.date(), row.doctor_id, from_status)] += 1
+    if audit:
+        db.session.execute(insert(AppointmentStatusChange.__table__), audit)
+        # A bulk UPDATE skips the ORM events that keep the report rollups current
+        connection = db.session.connection()
+        for (day, doctor_id, from_status), count in moved.items():
+            when = datetime.combine(day, datetime.min.time())
+            bump_appointments(connection, hospital_id, when, doctor_id, from_status, -count)
+            bump_appointments(connection, hospital_id, when, doctor_id, to_status, count)
+    return changed
+
+
+def _batch_conditions(payload):
+    """WHERE clauses of a batch request: ids and/or a doctor, within a day or a range of days."""
+    table = Appointment.__table__
+    conditions = []
+    ids = payload.get('ids')
+    if ids is not None:
+        if not isinstance(ids, list) or not all(isinstance(ident, int) for ident in ids):
+            raise ValueError('ids must be a list of appointment ids')
+        conditions.append(table.c.id.in_(ids))
+    try:
+        if payload.get('date'):
+            start = end = date.fromisoformat(payload['date'])
+        elif payload.get('start') or payload.get('end'):
+            start, end = date.fromisoformat(payload['start']), date.fromisoformat(payload['end'])
+        else:
+            start = end = None
+    except (KeyError, TypeError, ValueError):
+        raise ValueError('date, or start and end, must be dates (YYYY-MM-DD)') from None
+    if start is not None:
+        conditions.append(table.c.appointment_date >= datetime.combine(start, datetime.min.time()))
+        conditions.append(table.c.appointment_date < datetime.combine(end + timedelta(days=1), datetime.min.time()))
+    elif ids is None:
+        raise ValueError('ids, date, or start and end are required')
+    if payload.get('doctor_id') is not None:
+        if not isinstance(payload['doctor_id'], int):
+            raise ValueError('doctor_id must be an integer')
+        conditions.append(table.c.doctor_id == payload['doctor_id'])
+    reason = payload.get('reason')
+    if reason is not None and (not isinstance(reason, str) or len(reason) > 255):
+        raise ValueError('reason must be text of at most 255 characters')
+    return conditions
+
+
+# ----------------------------------------------------
+# Views
+# ----------------------------------------------------
+
+APPOINTMENT_HTML = r"""
+<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <title>Appointment - HMS</title>
+    <link href="https://cdn.jsdelivr.net/npm/bootstrap@5.3.3/dist/css/bootstrap.min.css" rel="stylesheet">
+    <link rel="stylesheet" href="https://cdn.jsdelivr.net/npm/bootstrap-icons@1.10.0/font/bootstrap-icons.css">
+    <style>
+        body { background-color: #f5f5f5; }
+        .navbar { background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); }
+        .navbar a { color: white !important; }
+        .btn-back { color: white; text-decoration: none; }
+    </style>
+</head>
+<body>
+    <nav class="navbar navbar-dark">
+        <div class="container-fluid">
+            <span class="navbar-brand"><a href="{{ url_for('appointments') }}" class="btn-back"><i class="bi bi-arrow-left"></i> Back to Appointments</a></span>
+            <span style="color: white;">Welcome, {{ user_name }}</span>
+        </div>
+    </nav>
+    <div class="container mt-5">
+        {% with messages = get_flashed_messages(with_categories=true) %}
+            {% if messages %}
+                <div class="mb-3">
+                    {% for category, message in messages %}
+                        <div class="alert alert-{{ 'danger' if category == 'error' else category }}" role="alert">{{ message }}</div>
+                    {% endfor %}
+                </div>
+            {% endif %}
+        {% endwith %}
+
+        <div class="card">
+            <div class="card-header bg-primary text-white d-flex justify-content-between align-items-center">
+                <h5 class="mb-0">Appointment #{{ apt.id }} &middot; {{ apt.appointment_date.strftime('%d/%m/%Y %H:%M') }}</h5>
+                <span class="badge bg-{{ 'success' if apt.status == 'SCHEDULED' else 'warning' if apt.status == 'COMPLETED' else 'danger' }}">{{ apt.status }}</span>
+            </div>
+            <div class="card-body">
+                <p><strong>Patient:</strong> <a href="{{ url_for('medical_records.timeline', patient_id=apt.patient_id) }}">{{ apt.patient.first_name }} {{ apt.patient.last_name }}</a></p>
+                <p><strong>Doctor:</strong> Dr. {{ apt.doctor.first_name }} {{ apt.doctor.last_name }}</p>
+                <p><strong>Reason:</strong> {{ apt.reason or 'General' }}</p>
+                {% if apt.notes %}<p><strong>Notes:</strong> {{ apt.notes }}</p>{% endif %}
+
+                {% if next_statuses %}
+                    <form method="POST" action="{{ url_for('appointment_workflow.change_status', appointment_id=apt.id) }}" class="row g-2 align-items-end mt-3">
+                        <div class="col-md-8">
+                            <label class="form-label">Reason (optional)</label>
+                            <input type="text" class="form-control" name="reason" maxlength="255">
+                        </div>
+                        <div class="col-md-4 text-end">
+                            {% for status in next_statuses %}
+                                <button type="submit" name="status" value="{{ status }}" class="btn btn-{{ 'danger' if status in ('CANCELLED', 'NO_SHOW') else 'primary' }}">{{ labels[status] }}</button>
+                            {% endfor %}
+                        </div>
+                    </form>
+                {% endif %}
+            </div>
+        </div>
+
+        <div class="card mt-4">
+            <div class="card-header"><h6 class="mb-0">Status history</h6></div>
+            <div class="card-body">
+                {% if history %}
+                    <table class="table table-sm mb-0">
+                        <thead><tr><th>When</th><th>Change</th><th>By</th><th>Reason</th></tr></thead>
+                        <tbody>
+                            {% for change in history %}
+                            <tr>
+                                <td>{{ change.changed_at.strftime('%d/%m/%Y %H:%M') }}</td>
+                                <td>{{ change.from_status }} &rarr; {{ change.to_status }}</td>
+                                <td>{{ change.changed_by_name or '-' }}</td>
+                                <td>{{ change.reason or '' }}</td>
+                            </tr>
+                            {% endfor %}
+                        </tbody>
+                    </table>
+                {% else %}
+                    <p class="text-muted mb-0">No status changes yet.</p>
+                {% endif %}
+            </div>
+        </div>
+    </div>
+</body>
+</html>
+"""
+
+# Button labels of the target statuses
+ACTION_LABELS = {
+    'SCHEDULED': 'Reinstate',
+    'COMPLETED': 'Complete',
+    'CANCELLED': 'Cancel',
+    'NO_SHOW': 'No-show',
+}
+
+
+@workflow_bp.record_once
+def _register_templates(state):
+    state.app.extensions['hms_templates'].register('appointment.html', APPOINTMENT_HTML)
+
+
+def _tenant_appointment(appointment_id):
+    appointment = Appointment.query.options(joinedload(Appointment.patient), joinedload(Appointment.doctor)) \
+        .filter_by(hospital_id=g.hospital_id, id=appointment_id).first()
+    if appointment is None:
+        abort(404)
+    return appointment
+
+
+@workflow_bp.route('/appointments/<int:appointment_id>')
+@login_required
+@replica_reads
+def appointment_detail(appointment_id):
+    """One appointment with its status history and the statuses it can move to."""
+    appointment = _tenant_appointment(appointment_id)
+    history = AppointmentStatusChange.query.filter_by(hospital_id=g.hospital_id, appointment_id=appointment.id) \
+        .order_by(AppointmentStatusChange.changed_at, AppointmentStatusChange.id).all()
+    return render_page('appointment.html', apt=appointment, history=history, next_statuses=next_statuses(appointment),
+                       labels=ACTION_LABELS, user_name=g.user.name)
+
+
+@workflow_bp.route('/appointments/<int:appointment_id>/status', methods=['POST'])
+@login_required
+def change_status(appointment_id):
+    """Move one appointment to the posted status."""
+    appointment = _tenant_appointment(appointment_id)
+    status = request.form.get('status')
+    if status not in next_statuses(appointment):
+        flash(f'An appointment that is {appointment.status} cannot be marked {status} now.', 'error')
+        return redirect(url_for('appointment_workflow.appointment_detail', appointment_id=appointment.id))
+    try:
+        changed = transition_appointments(g.hospital_id, status, [Appointment.__table__.c.id == appointment.id],
+                                          reason=request.form.get('reason', '')[:255] or None, user=g.user)
+        db.session.commit()
+    except IntegrityError:
+        # uq_appointments_doctor_slot: the slot was booked again after the cancellation
+        db.session.rollback()
+        flash('That slot has been booked by another appointment since; it cannot be reinstated.', 'error')
+    else:
+        if changed:
+            flash(f'Appointment marked {status}.', 'success')
+        else:
+            flash('The appointment was changed by someone else meanwhile; please check its status.', 'warning')
+    return redirect(url_for('appointment_workflow.appointment_detail', appointment_id=appointment.id))
+
+
+@workflow_bp.route('/appointments/status', methods=['POST'])
+@api_login_required
+def change_statuses():
+    """Move every matching appointment that may reach the requested status (JSON body)."""
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        return json_response({'error': 'expected a JSON object'}, 400)
+    status = payload.get('status')
+    if status not in APPOINTMENT_STATUSES:
+        return json_response({'error': f"status must be one of {', '.join(APPOINTMENT_STATUSES)}"}, 400)
+    try:
+        conditions = _batch_conditions(payload)
+    except ValueError as e:
+        return json_response({'error': str(e)}, 400)
+    try:
+        changed = transition_appointments(g.hospital_id, status, conditions, reason=payload.get('reason'), user=g.user)
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return json_response({'error': 'some of the appointments cannot be reinstated: '
+                                       'their slots have been booked since'}, 409)
+    return json_response({
+        'status': status,
+        'changed': len(changed),
+        'appointments': [{'id': ident, 'from': from_status} for ident, from_status in changed],
+    })
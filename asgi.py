@@ -0,0 +1,414 @@
+# asgi.py
+# ASGI entry point: the read-heavy routes on SQLAlchemy's asyncio engine.
+#
+# Under gunicorn's sync workers a request holds its worker through every database
+# round trip. Served from here, the dashboard, the patient and appointment lists,
+# patient search and lookup, and the JSON API reads await the database instead
+# (aiosqlite / asyncpg), so one process keeps many of them in flight. They build
+# their statements and responses with the same helpers as the sync views, inside
+# an ordinary Flask request context: sessions, the tenant cache, templates,
+# after_request hooks and metrics behave exactly as under WSGI.
+#
+# Every other request - forms, writes, exports, and the cases the async views hand
+# back (no login, a first dashboard visit that seeds its counters, a database
+# without a search index) - runs the WSGI app on a thread pool of
+# ASGI_SYNC_THREADS. Those threads are the only limit on in-flight sync requests,
+# not the event loop. `gunicorn app:app` keeps working as before.
+#
+# With REPLICA_URLS the async views read from the replicas like the @replica_reads
+# sync views (see replicas.py): same health checks, stickiness and failover.
+# Hospitals on another shard (see shards.py) read from that shard's async engine.
+#
+# Usage: pip install -r requirements-asgi.txt && uvicorn asgi:app --workers 2
+
+import asyncio
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app, g, request, session
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from werkzeug.exceptions import HTTPException
+
+import app as hms
+from agenda import lookup_limit, lookup_patients_response
+from api import item_response, item_statement, list_response, list_statement
+from db_pool import async_database_url, async_engine_options
+from metrics import RequestTimings
+from pagination import keyset_page, keyset_query, request_page_args
+from replicas import wants_replica
+from shards import DEFAULT_SHARD, route_to_shard
+from search import search_request, search_response, search_statement, search_terms
+
+BODY_SPOOL_BYTES = 1024 * 1024  # request bodies larger than this are buffered on disk
+
+ASYNC_VIEWS = {}
+
+
+def async_view(endpoint):
+    """Serve GET/HEAD requests for `endpoint` with the decorated coroutine.
+
+    It is called with the AsyncSession and the view arguments, after the tenant is
+    loaded into `g`. Returning None hands the request to the sync view.
+    """
+    def decorator(view):
+        ASYNC_VIEWS[endpoint] = view
+        return view
+    return decorator
+
+
+# ----------------------------------------------------
+# Views
+# ----------------------------------------------------
+
+async def _search(db_session, query, limit, offset=0):
+    """Indexed search rows, or None where the database has no search index."""
+    if not search_terms(query):
+        return []
+    indexed = search_statement(db_session.bind.dialect.name, g.hospital_id, query, limit, offset)
+    if indexed is None:
+        return None
+    return (await db_session.execute(*indexed)).mappings().all()
+
+
+@async_view('dashboard')
+async def dashboard(db_session):
+    stats = await db_session.get(hms.HospitalStats, g.hospital_id)
+    if stats is None:
+        return None  # first visit: the sync view counts the rows and seeds the stats row
+    counts = {column: getattr(stats, column) for column in hms.COUNTED_MODELS}
+    return hms.render_page('dashboard.html', **hms.dashboard_context(counts))
+
+
+@async_view('patients')
+async def patients(db_session):
+    statement, plan = keyset_query(hms.patients_statement(g.hospital_id), hms.Patient, **request_page_args())
+    patient_page = keyset_page((await db_session.scalars(statement)).all(), plan)
+    return hms.render_page('patients.html', user_name=g.user.name, patients=patient_page)
+
+
+@async_view('appointments')
+async def appointments(db_session):
+    statement, plan = keyset_query(hms.appointments_statement(g.hospital_id), hms.Appointment,
+                                   **request_page_args())
+    appointment_page = keyset_page((await db_session.scalars(statement)).all(), plan)
+    return hms.render_page('appointments.html', user_name=g.user.name, appointments=appointment_page)
+
+
+@async_view('search.search')
+async def search(db_session):
+    query, per_page, page, offset = search_request()
+    rows = []
+    if offset < current_app.config['SEARCH_MAX_RESULTS']:
+        # One extra row tells us whether there is a next page
+        rows = await _search(db_session, query, per_page + 1, offset)
+        if rows is None:
+            return None
+    return search_response(query, per_page, page, rows)
+
+
+@async_view('agenda.lookup_patients')
+async def lookup_patients(db_session):
+    rows = await _search(db_session, request.args.get('q', ''), lookup_limit())
+    return None if rows is None else lookup_patients_response(rows)
+
+
+@async_view('api_v1.list_resource')
+async def list_resource(db_session, resource):
+    statement, plan, fields = list_statement(resource, g.hospital_id)
+    return list_response((await db_session.execute(statement)).all(), plan, fields)
+
+
+@async_view('api_v1.get_resource')
+async def get_resource(db_session, resource, item_id):
+    statement, fields = item_statement(resource, item_id, g.hospital_id)
+    return item_response(resource, item_id, (await db_session.execute(statement)).first(), fields)
+
+
+# ----------------------------------------------------
+# Tenant
+# ----------------------------------------------------
+
+async def _load_snapshot(db_session, key, model, ident, snapshot):
+    # Same keys and snapshots as load_tenant_user()/load_tenant_hospital(), so both
+    # modes share the cache and its eviction on writes
+    cache = current_app.extensions['hms_tenant_cache']
+    value = cache.get(key)
+    if value is None:
+        value = snapshot(await db_session.get(model, ident))
+        if value is not None:
+            cache.set(key, value)
+    return value
+
+
+async def load_tenant(db_session):
+    """before_request_func() on the async engine; False leaves the request to the sync app."""
+    g.user = g.hospital = g.hospital_id = None
+    user_id = session.get('user_id')
+    if user_id is None:
+        return False
+    user = await _load_snapshot(db_session, ('user', user_id), hms.User, user_id, hms.user_snapshot)
+    if user is None or session.get('hospital_id') not in (None, user.hospital_id):
+        return False  # the sync hook clears the session
+    g.user = user
+    g.hospital = await _load_snapshot(db_session, ('hospital', user.hospital_id), hms.Hospital,
+                                      user.hospital_id, hms.hospital_snapshot)
+    g.hospital_id = user.hospital_id
+    return True
+
+
+# ----------------------------------------------------
+# ASGI <-> WSGI
+# ----------------------------------------------------
+
+async def _read_body(receive):
+    """The request body as a file, or None if the client went away."""
+    body = tempfile.SpooledTemporaryFile(max_size=BODY_SPOOL_BYTES)
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            body.close()
+            return None
+        body.write(message.get('body', b''))
+        if not message.get('more_body'):
+            break
+    body.seek(0)
+    return body
+
+
+def wsgi_environ(scope, body):
+    """WSGI environ for an ASGI http `scope`."""
+    root_path = scope.get('root_path', '')
+    path = scope['path']
+    if root_path and path.startswith(root_path):
+        path = path[len(root_path):]
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': root_path.encode('utf-8').decode('latin-1'),
+        'PATH_INFO': path.encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        # The body is read to the end already, so chunked uploads need no Content-Length
+        'wsgi.input_terminated': True,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    server = scope.get('server') or ('localhost', 80)
+    environ['SERVER_NAME'], environ['SERVER_PORT'] = server[0], str(server[1] or 80)
+    if scope.get('client'):
+        environ['REMOTE_ADDR'], environ['REMOTE_PORT'] = scope['client'][0], str(scope['client'][1])
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').lower()
+        if name == 'content-type':
+            key = 'CONTENT_TYPE'
+        elif name == 'content-length':
+            key = 'CONTENT_LENGTH'
+        else:
+            key = 'HTTP_' + name.upper().replace('-', '_')
+        value = value.decode('latin-1')
+        environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
+
+
+def _start_message(status, headers):
+    return {
+        'type': 'http.response.start',
+        'status': int(status.split(' ', 1)[0]),
+        'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers],
+    }
+
+
+class HMSAsgi:
+    """ASGI application around the Flask app: async views first, the WSGI app for the rest."""
+
+    def __init__(self, flask_app, engine, replica_engines=None, shard_engines=None):
+        self.flask_app = flask_app
+        self.engine = engine
+        self.replica_engines = replica_engines or {}
+        self.shard_engines = shard_engines or {}
+        self.sessions = async_sessionmaker(engine, expire_on_commit=False)
+        # On a shard the directory tables still come from the primary
+        self.directory_binds = {hms.Hospital: engine, hms.User: engine}
+        self.sync_threads = ThreadPoolExecutor(flask_app.config['ASGI_SYNC_THREADS'], thread_name_prefix='hms-wsgi')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self._lifespan(receive, send)
+        if scope['type'] != 'http':
+            raise ValueError(f"unsupported ASGI scope type {scope['type']!r}")
+        body = await _read_body(receive)
+        if body is None:
+            return
+        with body:
+            environ = wsgi_environ(scope, body)
+            response = await self._dispatch(environ)
+            if response is None:
+                await self._run_sync(environ, send)
+                return
+            try:
+                app_iter, status, headers = response.get_wsgi_response(environ)
+                # Async views build their bodies in memory
+                await send(_start_message(status, headers))
+                await send({'type': 'http.response.body', 'body': b''.join(app_iter)})
+            finally:
+                response.close()
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.engine.dispose()
+                for other_engine in (*self.replica_engines.values(), *self.shard_engines.values()):
+                    await other_engine.dispose()
+                self.sync_threads.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def _async_view(self, environ):
+        if environ['REQUEST_METHOD'] not in ('GET', 'HEAD'):
+            return None
+        try:
+            endpoint, view_args = self.flask_app.url_map.bind_to_environ(environ).match()
+        except HTTPException:
+            return None  # 404s, 405s and slash redirects come from the sync app
+        view = ASYNC_VIEWS.get(endpoint)
+        return None if view is None else (view, view_args)
+
+    async def _dispatch(self, environ):
+        """The Response of an async view, or None to run the request through the WSGI app.
+
+        Mirrors Flask.wsgi_app()/full_dispatch_request() with the async tenant
+        lookup in place of the before_request hooks.
+        """
+        match = self._async_view(environ)
+        if match is None:
+            return None
+        view, view_args = match
+        app = self.flask_app
+        ctx = app.request_context(environ)
+        error = None
+        ctx.push()
+        try:
+            try:
+                g.hms_timings = RequestTimings()
+                try:
+                    rv = await self._run_view(view, view_args)
+                except Exception as e:
+                    rv = app.handle_user_exception(e)
+                if rv is None:
+                    return None
+                return app.finalize_request(rv)
+            except Exception as e:
+                error = e
+                return app.handle_exception(e)
+        finally:
+            ctx.pop(error)
+
+    async def _call_view(self, view, view_args, engine, binds=None):
+        async with self.sessions(bind=engine, binds=binds) as db_session:
+            return await view(db_session, **view_args)
+
+    async def _run_view(self, view, view_args):
+        """Run `view` on the tenant's shard, or on a replica if one is healthy, else (or if it
+        fails) on the primary."""
+        async with self.sessions() as db_session:
+            if not await load_tenant(db_session) or g.hospital is None:
+                return None
+        route_to_shard(g.hospital.shard)
+        if g.hms_shard != DEFAULT_SHARD:
+            engine = self.shard_engines.get(g.hms_shard)
+            if engine is None:
+                return None  # no asyncio driver for the shard's database
+            return await self._call_view(view, view_args, engine, self.directory_binds)
+        replica = None
+        if self.replica_engines and wants_replica():
+            # Health checks connect synchronously; keep them off the event loop
+            replica = await asyncio.to_thread(self.flask_app.extensions['hms_replicas'].choose)
+        if replica is not None and replica.name in self.replica_engines:
+            g.hms_replica = replica
+            try:
+                return await self._call_view(view, view_args, self.replica_engines[replica.name])
+            except Exception as e:
+                if not g.pop('hms_replica_failed', False):
+                    raise
+                replica.mark_down(e)
+            finally:
+                g.pop('hms_replica', None)
+        return await self._call_view(view, view_args, self.engine)
+
+    async def _run_sync(self, environ, send):
+        """Run the WSGI app on a worker thread, streaming its body back to the event loop."""
+        loop = asyncio.get_running_loop()
+
+        def emit(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        def run():
+            pending = {}
+
+            def start_response(status, headers, exc_info=None):
+                if exc_info and pending.get('started'):
+                    raise exc_info[1].with_traceback(exc_info[2])
+                pending['start'] = _start_message(status, headers)
+                return write
+
+            def write(data):
+                if not pending.get('started'):
+                    emit(pending['start'])
+                    pending['started'] = True
+                if data:
+                    emit({'type': 'http.response.body', 'body': data, 'more_body': True})
+
+            app_iter = self.flask_app(environ, start_response)
+            try:
+                for chunk in app_iter:
+                    write(chunk)
+                write(b'')
+                emit({'type': 'http.response.body', 'body': b''})
+            finally:
+                close = getattr(app_iter, 'close', None)
+                if close is not None:
+                    close()
+
+        await loop.run_in_executor(self.sync_threads, run)
+
+
+def create_asgi_app(flask_app):
+    """Wrap `flask_app` (from create_app()) with an asyncio engine on the same database."""
+    with flask_app.app_context():
+        url = async_database_url(hms.db.engine.url)
+    if url is None:
+        raise RuntimeError(f'No asyncio driver for {hms.db.engine.url.get_backend_name()} databases.')
+    if url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:'):
+        raise RuntimeError('An in-memory SQLite database cannot be shared with the asyncio engine.')
+    engine = create_async_engine(url, **async_engine_options(flask_app.config['SQLALCHEMY_DATABASE_URI']))
+    replica_engines = {}
+    for replica in flask_app.extensions['hms_replicas'].replicas:
+        replica_url = async_database_url(make_url(replica.url))
+        if replica_url is not None:
+            replica_engines[replica.name] = create_async_engine(replica_url, **async_engine_options(replica.url))
+            replica.watch(replica_engines[replica.name].sync_engine)
+    shard_engines = {}
+    for name, shard_url in flask_app.config['SHARD_URLS'].items():
+        async_url = async_database_url(make_url(shard_url))
+        if async_url is not None:
+            shard_engines[name] = create_async_engine(async_url, **async_engine_options(shard_url))
+    return HMSAsgi(flask_app, engine, replica_engines, shard_engines)
+
+
+# ASGI app for production: `uvicorn asgi:app`. Built on first access from the same
+# lazily created WSGI app as `gunicorn app:app`.
+def __getattr__(name):
+    if name == 'app':
+        global app
+        app = create_asgi_app(hms.app)
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,3 @@
+# benchmarks
+# Standalone performance measurements for the HMS app. Run from the repository root,
+# e.g. `python -m benchmarks.templates`.
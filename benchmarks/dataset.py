@@ -0,0 +1,231 @@
+# benchmarks/dataset.py
+# Synthetic multi-tenant data for load tests, written through the real models.
+#
+# Hospital sizes are skewed like real customers: hospital k (1-based) gets a share
+# of the patients proportional to 1 / k**skew, so a few hospitals hold most rows
+# and a long tail holds a handful each. Doctors, departments, appointments and
+# medical records scale with each hospital's patient count. Rows go in with bulk
+# Core inserts per batch; the dashboard counters are bumped to match, the report
+# rollups rebuilt, and the search index is filled by its triggers.
+#
+# Each hospital's admin is admin<k>@bench.hms with password BENCH_PASSWORD.
+# A database that already holds benchmark tenants is reused unless --reset.
+#
+# Usage: python -m benchmarks.dataset --database-url sqlite:////tmp/hms-bench.db --hospitals 50 --patients 200000
+
+import argparse
+import json
+import os
+import random
+import time
+from datetime import date, datetime, time as clock, timedelta
+
+BENCH_DOMAIN = 'bench.hms'
+BENCH_PASSWORD = 'Bench@12345'
+SLOTS_PER_DAY = 16  # 09:00-17:00 in 30 minute slots
+
+FIRST_NAMES = ('James', 'Mary', 'John', 'Patricia', 'Robert', 'Jennifer', 'Michael', 'Linda', 'William',
+               'Elizabeth', 'David', 'Barbara', 'Richard', 'Susan', 'Joseph', 'Jessica', 'Thomas', 'Sarah',
+               'Amit', 'Priya', 'Wei', 'Mei', 'Omar', 'Fatima', 'Carlos', 'Lucia', 'Kenji', 'Yuki')
+LAST_NAMES = ('Smith', 'Johnson', 'Williams', 'Brown', 'Jones', 'Garcia', 'Miller', 'Davis', 'Rodriguez',
+              'Martinez', 'Hernandez', 'Lopez', 'Wilson', 'Anderson', 'Taylor', 'Thomas', 'Moore', 'Jackson',
+              'Sharma', 'Patel', 'Wang', 'Li', 'Khan', 'Ali', 'Silva', 'Santos', 'Tanaka', 'Sato')
+SPECIALIZATIONS = ('Cardiology', 'Neurology', 'Orthopedics', 'Pediatrics', 'Oncology', 'Dermatology',
+                   'Radiology', 'General Medicine', 'Psychiatry', 'Gynecology')
+DIAGNOSES = ('Hypertension', 'Type 2 diabetes', 'Asthma', 'Migraine', 'Fracture', 'Influenza',
+             'Dermatitis', 'Anemia', 'Back pain', 'Anxiety')
+BLOOD_GROUPS = ('A+', 'A-', 'B+', 'B-', 'AB+', 'AB-', 'O+', 'O-')
+
+
+def tenant_sizes(hospitals, patients, skew):
+    """Patients per hospital, largest first, summing to `patients` (at least 1 each)."""
+    weights = [1 / (rank ** skew) for rank in range(1, hospitals + 1)]
+    total = sum(weights)
+    sizes = [max(1, int(patients * weight / total)) for weight in weights]
+    sizes[0] += max(patients - sum(sizes), 0)
+    return sizes
+
+
+def _batches(rows, size):
+    for start in range(0, len(rows), size):
+        yield rows[start:start + size]
+
+
+def _insert(hms, model, rows, batch_size):
+    from sqlalchemy import insert
+    for batch in _batches(rows, batch_size):
+        hms.db.session.execute(insert(model), batch)
+
+
+def _id_range(hms, model, hospital_id, *filters):
+    from sqlalchemy import func
+    return hms.db.session.query(func.min(model.id), func.max(model.id)) \
+        .filter(model.hospital_id == hospital_id, *filters).one()
+
+
+def _populate(hms, rng, rank, patients, password_hash, batch_size):
+    """One hospital and its rows; returns its manifest entry."""
+    from reports import rebuild_rollups
+    db = hms.db
+    hospital = hms.Hospital(name=f'Bench Hospital {rank}', license_number=f'BENCH-{rank:06d}',
+                            admin_email=f'admin{rank}@{BENCH_DOMAIN}', contact_details='555-0100',
+                            address=f'{rank} Benchmark Way', status='ACTIVE')
+    db.session.add(hospital)
+    db.session.flush()
+    db.session.add(hms.User(hospital_id=hospital.id, first_name='Admin', last_name=str(rank),
+                            email=hospital.admin_email, password_hash=password_hash))
+    now = datetime.now()
+
+    department_count = min(len(SPECIALIZATIONS), 2 + patients // 2000)
+    _insert(hms, hms.Department, [dict(
+        hospital_id=hospital.id, name=SPECIALIZATIONS[i], description=f'{SPECIALIZATIONS[i]} department',
+        head_name=f'Dr. {rng.choice(LAST_NAMES)}', email=f'dept{i}@h{rank}.{BENCH_DOMAIN}', phone='555-0101',
+        created_at=now,
+    ) for i in range(department_count)], batch_size)
+    department_low, department_high = _id_range(hms, hms.Department, hospital.id)
+    department_ids = range(department_low, department_high + 1)
+
+    doctor_count = max(2, patients // 250)
+    _insert(hms, hms.Doctor, [dict(
+        hospital_id=hospital.id, department_id=rng.choice(department_ids) if department_ids else None,
+        first_name=rng.choice(FIRST_NAMES), last_name=rng.choice(LAST_NAMES),
+        specialization=rng.choice(SPECIALIZATIONS), email=f'doctor{i}@h{rank}.{BENCH_DOMAIN}',
+        phone=f'555-{i:04d}', license_number=f'LIC-{rank}-{i}', experience_years=rng.randint(1, 35),
+        status='ACTIVE', created_at=now,
+    ) for i in range(doctor_count)], batch_size)
+    doctor_low, doctor_high = _id_range(hms, hms.Doctor, hospital.id)
+
+    rows = []
+    for i in range(patients):
+        first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        rows.append(dict(
+            hospital_id=hospital.id, first_name=first, last_name=last,
+            email=f'{first.lower()}.{last.lower()}{i}@h{rank}.{BENCH_DOMAIN}', phone=f'9{rank:03d}{i:07d}',
+            date_of_birth=date(1940, 1, 1) + timedelta(days=rng.randrange(30000)),
+            gender=rng.choice(('Male', 'Female')), blood_group=rng.choice(BLOOD_GROUPS),
+            address=f'{rng.randint(1, 999)} Main St', created_at=now - timedelta(minutes=patients - i),
+        ))
+        if len(rows) == batch_size:
+            _insert(hms, hms.Patient, rows, batch_size)
+            rows = []
+    _insert(hms, hms.Patient, rows, batch_size)
+    patient_low, patient_high = _id_range(hms, hms.Patient, hospital.id)
+
+    # Two appointments per patient, in distinct (doctor, slot) pairs centred on today
+    appointment_count = patients * 2
+    slots_per_doctor = -(-appointment_count // doctor_count)
+    first_day = date.today() - timedelta(days=slots_per_doctor // SLOTS_PER_DAY // 2)
+    rows = []
+    for i in range(appointment_count):
+        slot = i // doctor_count
+        when = datetime.combine(first_day + timedelta(days=slot // SLOTS_PER_DAY), clock(9)) \
+            + timedelta(minutes=30 * (slot % SLOTS_PER_DAY))
+        if when < now:
+            status = rng.choices(('COMPLETED', 'CANCELLED'), (9, 1))[0]
+        else:
+            status = 'SCHEDULED'
+        rows.append(dict(
+            hospital_id=hospital.id, patient_id=rng.randint(patient_low, patient_high),
+            doctor_id=doctor_low + i % doctor_count, appointment_date=when, reason='Check-up',
+            status=status, created_at=now,
+        ))
+        if len(rows) == batch_size:
+            _insert(hms, hms.Appointment, rows, batch_size)
+            rows = []
+    _insert(hms, hms.Appointment, rows, batch_size)
+
+    rows = []
+    for i in range(patients):
+        rows.append(dict(
+            hospital_id=hospital.id, patient_id=rng.randint(patient_low, patient_high),
+            doctor_id=rng.randint(doctor_low, doctor_high), diagnosis=rng.choice(DIAGNOSES),
+            treatment='Rest and fluids. ' * rng.randint(1, 20), prescription='Paracetamol 500 mg',
+            created_at=now - timedelta(minutes=rng.randrange(525600)),
+        ))
+        if len(rows) == batch_size:
+            _insert(hms, hms.MedicalRecord, rows, batch_size)
+            rows = []
+    _insert(hms, hms.MedicalRecord, rows, batch_size)
+
+    hms.bump_hospital_stats(db.session.connection(), hospital.id, patients=patients,
+                            appointments=appointment_count, doctors=doctor_count, departments=department_count)
+    rebuild_rollups(db.session.connection(), hospital.id)
+    db.session.commit()
+    return dict(hospital_id=hospital.id, email=hospital.admin_email, patients=patients,
+                patient_ids=[patient_low, patient_high], doctor_ids=[doctor_low, doctor_high])
+
+
+def load_manifest(hms):
+    """Manifest of the benchmark hospitals already in the database, largest first."""
+    from sqlalchemy import func
+    db = hms.db
+    hospitals = hms.Hospital.query.filter(hms.Hospital.admin_email.like(f'%@{BENCH_DOMAIN}')).all()
+    manifest = []
+    for hospital in hospitals:
+        count = db.session.query(func.count(hms.Patient.id)).filter_by(hospital_id=hospital.id).scalar()
+        manifest.append(dict(hospital_id=hospital.id, email=hospital.admin_email, patients=count,
+                             # Generated rows only: patients added by load runs interleave across tenants
+                             patient_ids=list(_id_range(hms, hms.Patient, hospital.id,
+                                                        hms.Patient.email.like(f'%@h%.{BENCH_DOMAIN}'))),
+                             doctor_ids=list(_id_range(hms, hms.Doctor, hospital.id))))
+    manifest.sort(key=lambda entry: -entry['patients'])
+    return manifest
+
+
+def generate(app, hospitals=20, patients=20000, skew=1.1, seed=1, reset=False, batch_size=5000, echo=print):
+    """Create (or reuse) the benchmark tenants in `app`'s database; returns the manifest."""
+    import app as hms
+    from search import setup_search
+    from security import hash_password
+
+    if reset:
+        with app.app_context():
+            hms.db.drop_all()
+    hms.bootstrap(app, verbose=False)
+    with app.app_context():
+        manifest = load_manifest(hms)
+        if manifest:
+            echo(f'Reusing {len(manifest)} benchmark hospitals ({sum(e["patients"] for e in manifest)} patients).')
+            return manifest
+        rng = random.Random(seed)
+        password_hash = hash_password(BENCH_PASSWORD)  # one hash for every admin
+        started = time.perf_counter()
+        for rank, size in enumerate(tenant_sizes(hospitals, patients, skew), start=1):
+            manifest.append(_populate(hms, rng, rank, size, password_hash, batch_size))
+        if reset:
+            setup_search(hms.db.engine, rebuild=True)
+        echo(f'Generated {hospitals} hospitals, {patients} patients in {time.perf_counter() - started:.1f}s.')
+    return manifest
+
+
+def add_arguments(parser):
+    parser.add_argument('--database-url', help='Defaults to DATABASE_URL, else sqlite:////tmp/hms-bench.db.')
+    parser.add_argument('--hospitals', type=int, default=20)
+    parser.add_argument('--patients', type=int, default=20000, help='Across all hospitals.')
+    parser.add_argument('--skew', type=float, default=1.1, help='Zipf exponent of hospital sizes; 0 = uniform.')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--reset', action='store_true', help='Drop all tables first.')
+
+
+def configure_environment(args):
+    """Point the app at the benchmark database; must run before `import app`."""
+    os.environ['DATABASE_URL'] = args.database_url or os.environ.get('DATABASE_URL') or 'sqlite:////tmp/hms-bench.db'
+    # Many virtual users share one admin login; the login limiter would turn them away
+    os.environ.setdefault('HMS_LOGIN_RATE_PER_IP', '1000000/1')
+    os.environ.setdefault('HMS_LOGIN_RATE_PER_EMAIL', '1000000/1')
+    return os.environ['DATABASE_URL']
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate synthetic benchmark tenants.')
+    add_arguments(parser)
+    args = parser.parse_args()
+    configure_environment(args)
+
+    import app as hms
+    manifest = generate(hms.create_app(), args.hospitals, args.patients, args.skew, args.seed, args.reset)
+    print(json.dumps([dict(email=e['email'], patients=e['patients']) for e in manifest[:10]], indent=2))
+
+
+if __name__ == '__main__':
+    main()
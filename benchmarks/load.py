@@ -0,0 +1,348 @@
+# benchmarks/load.py
+# Load test of the HMS routes against synthetic tenants, reported as JSON.
+#
+# Each virtual user picks a hospital, weighted by its size so the big tenants get
+# most of the traffic. It logs in as that hospital's admin, then loops over a
+# weighted mix of page views and writes until the run ends. Every request
+# records its latency, its status and the query count from the Server-Timing
+# header added by metrics.py. Redirects are not followed, so a POST is timed
+# without the page it redirects to.
+#
+# Drivers:
+#   client    Flask test client in this process, one client per virtual user
+#   gunicorn  starts `gunicorn app:app` on a free local port and drives it over HTTP
+#   uvicorn   the same with `uvicorn asgi:app` (async read paths, see asgi.py)
+#   http      an already running server at --url
+#
+# The report holds per-action and overall count, errors, throughput,
+# mean/p50/p95/p99/max latency (ms) and median/max queries. With --baseline,
+# p50 and p95 are also compared with an earlier report.
+#
+# Usage:
+#   python -m benchmarks.load --hospitals 30 --patients 50000 --users 8 --duration 30
+#   python -m benchmarks.load --driver gunicorn --workers 4 --users 16 --output after.json --baseline before.json
+#   python -m benchmarks.load --database-url postgresql://hms@localhost/hms_bench --reset
+
+import argparse
+import http.cookiejar
+import json
+import logging
+import math
+import os
+import platform
+import random
+import re
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import date, datetime, timedelta
+
+from benchmarks.dataset import BENCH_PASSWORD, LAST_NAMES, add_arguments, configure_environment, generate
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_QUERIES = re.compile(r'desc="(\d+) queries"')
+
+
+# ----------------------------------------------------
+# Drivers
+# ----------------------------------------------------
+
+class ClientSession:
+    """One virtual user on the in-process Flask test client."""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, data=None):
+        response = self.client.open(path, method=method, data=data)
+        response.close()
+        return response.status_code, response.headers.get('Server-Timing')
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class HttpSession:
+    """One virtual user over HTTP, with its own cookie jar."""
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), _NoRedirect())
+
+    def request(self, method, path, data=None):
+        body = urllib.parse.urlencode(data).encode() if data is not None else None
+        request = urllib.request.Request(self.base_url + path, data=body, method=method)
+        try:
+            with self.opener.open(request, timeout=60) as response:
+                response.read()
+                return response.status, response.headers.get('Server-Timing')
+        except urllib.error.HTTPError as error:
+            error.read()
+            return error.code, error.headers.get('Server-Timing')
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(driver, workers, threads):
+    """Start gunicorn or uvicorn on the benchmark database; returns (process, base URL)."""
+    port = _free_port()
+    if driver == 'gunicorn':
+        command = ['gunicorn', '--workers', str(workers), '--threads', str(threads),
+                   '--bind', f'127.0.0.1:{port}', '--log-level', 'warning', 'app:app']
+    else:
+        command = ['uvicorn', '--workers', str(workers), '--port', str(port), '--log-level', 'warning',
+                   '--no-access-log', 'asgi:app']
+    process = subprocess.Popen([sys.executable, '-m'] + command, cwd=ROOT, env=dict(os.environ))
+    base_url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'{driver} exited with status {process.returncode}')
+        try:
+            urllib.request.urlopen(base_url + '/auth/login', timeout=2).read()
+            return process, base_url
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f'{driver} did not start within 60s')
+
+
+# ----------------------------------------------------
+# Scenario
+# ----------------------------------------------------
+
+def _patient(tenant, rng):
+    low, high = tenant['patient_ids']
+    return rng.randint(low, high)
+
+
+def _new_patient(tenant, rng):
+    return dict(first_name='Load', last_name=rng.choice(LAST_NAMES), email=f'load{rng.getrandbits(32)}@bench.hms',
+                phone=str(rng.randint(10 ** 9, 10 ** 10 - 1)), dob='1985-06-15', gender='Female',
+                blood_group='O+', address='1 Load Test Rd')
+
+
+def _new_appointment(tenant, rng):
+    low, high = tenant['doctor_ids']
+    when = datetime.combine(date.today(), datetime.min.time()) + timedelta(minutes=rng.randrange(1, 525600))
+    return dict(patient_id=_patient(tenant, rng), doctor_id=rng.randint(low, high),
+                appointment_date=when.strftime('%Y-%m-%dT%H:%M'), reason='Load test')
+
+
+# name -> (weight, method, path(tenant, rng), form data(tenant, rng) or None)
+ACTIONS = {
+    'dashboard': (15, 'GET', lambda t, r: '/dashboard', None),
+    'patients': (12, 'GET', lambda t, r: '/patients?per_page=' + r.choice(('25', '100')), None),
+    'patient_search': (10, 'GET', lambda t, r: '/patients/search?q=' + r.choice(LAST_NAMES)[:r.randint(2, 4)], None),
+    'appointments': (10, 'GET', lambda t, r: '/appointments', None),
+    'calendar': (6, 'GET', lambda t, r: '/appointments/calendar?view=' + r.choice(('day', 'week', 'month')), None),
+    'doctors': (8, 'GET', lambda t, r: '/doctors', None),
+    'departments': (5, 'GET', lambda t, r: '/departments', None),
+    'records': (8, 'GET', lambda t, r: f'/patients/{_patient(t, r)}/records', None),
+    'api_patients': (6, 'GET', lambda t, r: '/api/v1/patients?fields=first_name,last_name', None),
+    'add_patient': (5, 'POST', lambda t, r: '/add_patient', _new_patient),
+    'add_appointment': (4, 'POST', lambda t, r: '/add_appointment', _new_appointment),
+    'login': (1, 'POST', lambda t, r: '/auth/login', lambda t, r: dict(email=t['email'], password=BENCH_PASSWORD)),
+}
+OK_STATUSES = {200, 302, 304}
+
+
+class VirtualUser(threading.Thread):
+    def __init__(self, index, session, tenant, deadline, max_requests, seed):
+        super().__init__(name=f'bench-user-{index}', daemon=True)
+        self.session = session
+        self.tenant = tenant
+        self.deadline = deadline
+        self.max_requests = max_requests
+        self.rng = random.Random(seed)
+        self.samples = []  # (action, seconds, status, queries)
+
+    def _call(self, name):
+        _, method, path, data = ACTIONS[name]
+        path = path(self.tenant, self.rng)
+        data = data(self.tenant, self.rng) if data else None
+        started = time.perf_counter()
+        try:
+            status, timing = self.session.request(method, path, data)
+        except Exception:
+            status, timing = 0, None
+        elapsed = time.perf_counter() - started
+        match = _QUERIES.search(timing or '')
+        self.samples.append((name, elapsed, status, int(match.group(1)) if match else None))
+
+    def run(self):
+        self._call('login')
+        names = list(ACTIONS)
+        weights = [ACTIONS[name][0] for name in names]
+        while time.monotonic() < self.deadline and (not self.max_requests or len(self.samples) < self.max_requests):
+            self._call(self.rng.choices(names, weights)[0])
+
+
+# ----------------------------------------------------
+# Report
+# ----------------------------------------------------
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an ascending list."""
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, max(0, math.ceil(fraction * len(sorted_values)) - 1))]
+
+
+def summarize(samples, elapsed):
+    latencies = sorted(seconds * 1000 for _, seconds, _, _ in samples)
+    queries = sorted(count for _, _, _, count in samples if count is not None)
+    return {
+        'count': len(samples),
+        'errors': sum(1 for _, _, status, _ in samples if status not in OK_STATUSES),
+        'throughput_rps': round(len(samples) / elapsed, 2) if elapsed else None,
+        'mean_ms': round(sum(latencies) / len(latencies), 3) if latencies else None,
+        'p50_ms': _round(percentile(latencies, 0.50)),
+        'p95_ms': _round(percentile(latencies, 0.95)),
+        'p99_ms': _round(percentile(latencies, 0.99)),
+        'max_ms': _round(latencies[-1] if latencies else None),
+        'queries_p50': percentile(queries, 0.50),
+        'queries_max': queries[-1] if queries else None,
+    }
+
+
+def _round(value):
+    return round(value, 3) if value is not None else None
+
+
+def _git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(report, baseline):
+    """p50/p95 change per action against an earlier report, in percent."""
+    changes = {}
+    for name, current in report['actions'].items():
+        before = baseline.get('actions', {}).get(name)
+        if not before:
+            continue
+        changes[name] = {
+            key: round((current[key] - before[key]) / before[key] * 100, 1) if before.get(key) else None
+            for key in ('p50_ms', 'p95_ms')
+        }
+    return changes
+
+
+def print_table(report, out=sys.stderr):
+    print(f"{'action':<16}{'count':>8}{'err':>6}{'rps':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'queries':>9}", file=out)
+    rows = list(report['actions'].items()) + [('TOTAL', report['total'])]
+    for name, stats in rows:
+        print(f"{name:<16}{stats['count']:>8}{stats['errors']:>6}{stats['throughput_rps'] or 0:>9.1f}"
+              f"{stats['p50_ms'] or 0:>9.1f}{stats['p95_ms'] or 0:>9.1f}{stats['p99_ms'] or 0:>9.1f}"
+              f"{stats['queries_p50'] if stats['queries_p50'] is not None else '-':>9}", file=out)
+    for name, change in report.get('baseline_change_pct', {}).items():
+        print(f"  vs baseline {name:<16} p50 {change['p50_ms']:+}%  p95 {change['p95_ms']:+}%"
+              if None not in change.values() else f'  vs baseline {name:<16} n/a', file=out)
+
+
+# ----------------------------------------------------
+# Entry point
+# ----------------------------------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description='Load-test the HMS routes with synthetic tenants.')
+    add_arguments(parser)
+    parser.add_argument('--driver', choices=('client', 'gunicorn', 'uvicorn', 'http'), default='client')
+    parser.add_argument('--url', help='Base URL for --driver http.')
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn/uvicorn worker processes.')
+    parser.add_argument('--threads', type=int, default=4, help='gunicorn threads per worker.')
+    parser.add_argument('--users', type=int, default=4, help='Concurrent virtual users.')
+    parser.add_argument('--duration', type=float, default=20, help='Seconds to run.')
+    parser.add_argument('--requests', type=int, default=0, help='Stop each user after this many requests.')
+    parser.add_argument('--output', help='Also write the JSON report here.')
+    parser.add_argument('--baseline', help='Earlier JSON report to compare with.')
+    parser.add_argument('--slow-log', action='store_true', help='Show the app\'s slow request/query log.')
+    args = parser.parse_args()
+    if args.driver == 'http' and not args.url:
+        parser.error('--driver http needs --url')
+    if not args.slow_log:
+        # Under load most requests cross the thresholds; the report has the numbers
+        logging.getLogger('hms.slow').setLevel(logging.ERROR)
+
+    database_url = configure_environment(args)
+    import app as hms
+    application = hms.create_app()
+    manifest = generate(application, args.hospitals, args.patients, args.skew, args.seed, args.reset,
+                        echo=lambda message: print(message, file=sys.stderr))
+
+    server = None
+    if args.driver == 'client':
+        make_session = lambda: ClientSession(application)
+    else:
+        if args.driver in ('gunicorn', 'uvicorn'):
+            server, args.url = start_server(args.driver, args.workers, args.threads)
+        make_session = lambda: HttpSession(args.url)
+
+    rng = random.Random(args.seed)
+    weights = [entry['patients'] for entry in manifest]
+    started = time.monotonic()
+    users = [VirtualUser(index, make_session(), rng.choices(manifest, weights)[0], started + args.duration,
+                         args.requests, args.seed + index) for index in range(args.users)]
+    try:
+        for user in users:
+            user.start()
+        for user in users:
+            user.join()
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=30)
+    elapsed = time.monotonic() - started
+
+    samples = [sample for user in users for sample in user.samples]
+    by_action = {}
+    for sample in samples:
+        by_action.setdefault(sample[0], []).append(sample)
+    report = {
+        'meta': {
+            'started_at': datetime.now().isoformat(timespec='seconds'),
+            'revision': _git_revision(),
+            'python': platform.python_version(),
+            'driver': args.driver,
+            'database': database_url.split(':', 1)[0],
+            'workers': args.workers if args.driver in ('gunicorn', 'uvicorn') else None,
+            'users': args.users,
+            'duration_s': round(elapsed, 3),
+            'hospitals': len(manifest),
+            'patients': sum(entry['patients'] for entry in manifest),
+            'largest_hospital_patients': manifest[0]['patients'] if manifest else 0,
+            'skew': args.skew,
+        },
+        'total': summarize(samples, elapsed),
+        'actions': {name: summarize(by_action[name], elapsed) for name in sorted(by_action)},
+    }
+    if args.baseline:
+        with open(args.baseline) as f:
+            report['baseline_change_pct'] = compare(report, json.load(f))
+
+    print_table(report)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+# benchmarks/startup.py
+# Time from `import app` to the first served request, in fresh interpreter processes.
+#
+# Each run starts a new Python process against a fresh SQLite file, like a newly
+# spawned gunicorn worker. The lazy entry point (default) is compared with
+# HMS_AUTO_INIT=1, which performs the old create_all + super admin bootstrap.
+#
+# Usage: python -m benchmarks.startup [--runs 5]
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = r"""
+import json, time
+start = time.perf_counter()
+import app as hms
+imported = time.perf_counter()
+application = hms.app
+built = time.perf_counter()
+response = application.test_client().get('/auth/login')
+served = time.perf_counter()
+assert response.status_code == 200, response.status_code
+print(json.dumps({'import': imported - start, 'build': built - imported,
+                  'first_request': served - built, 'total': served - start}))
+"""
+
+
+def run_once(auto_init):
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ,
+                   DATABASE_URL=f"sqlite:///{os.path.join(tmp, 'hms.db')}",
+                   HMS_AUTO_INIT='1' if auto_init else '0')
+        out = subprocess.run([sys.executable, '-c', CHILD], cwd=ROOT, env=env,
+                             check=True, capture_output=True, text=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure import-to-first-request time.')
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'mode':<12}{'import':>10}{'build':>10}{'1st req':>10}{'total':>10}   (median ms)")
+    for label, auto_init in (('lazy', False), ('auto-init', True)):
+        runs = [run_once(auto_init) for _ in range(args.runs)]
+        median = {key: statistics.median(run[key] for run in runs) * 1000 for key in runs[0]}
+        print(f"{label:<12}{median['import']:>10.1f}{median['build']:>10.1f}"
+              f"{median['first_request']:>10.1f}{median['total']:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+# benchmarks/templates.py
+# Render time per request: render_template_string() on every hit vs. the precompiled TemplateRegistry.
+#
+# Usage: python -m benchmarks.templates [--iterations 500]
+
+import argparse
+import os
+import time
+from datetime import datetime
+from types import SimpleNamespace
+
+# Keep the benchmark off the real database
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+
+from flask import render_template_string
+from markupsafe import Markup
+
+import app as hms
+from pagination import Page
+
+
+def _rows(count, **fields):
+    now = datetime.now()
+    return [SimpleNamespace(id=i, created_at=now, **fields) for i in range(count)]
+
+
+def _contexts(per_page, fragment):
+    """name -> (path, source, context); `fragment(name, path, **context)` renders a fragment."""
+    patient = dict(first_name='Jane', last_name='Doe', email='jane@example.com', phone='555-0100',
+                   blood_group='O+')
+    doctor = dict(first_name='John', last_name='Smith', specialization='Cardiology', experience_years=10,
+                  email='john@example.com', status='ACTIVE', department=SimpleNamespace(name='Cardiology'))
+    department = dict(name='Cardiology', head_name='Dr. Smith', email='cardio@example.com', phone='555-0101')
+    patients = _rows(per_page, **patient)
+    doctors = _rows(per_page, **doctor)
+    departments = _rows(per_page, **department)
+    appointment = dict(appointment_date=datetime.now(), patient=patients[0], doctor=doctors[0],
+                       reason='Check-up', status='SCHEDULED')
+    page = lambda rows: Page(rows, per_page, 'newest', next_cursor='x', prev_cursor='y')
+    # The doctors and departments pages embed their tables as fragments (see cached_fragment()),
+    # rendered on a cache miss; time them on their own as well as the pages around them
+    fragments = {
+        'doctor_list': ('/doctors', hms.DOCTOR_LIST_HTML, dict(doctors=page(doctors))),
+        'department_options': ('/doctors', hms.DEPARTMENT_OPTIONS_HTML, dict(departments=departments[:5])),
+        'department_list': ('/departments', hms.DEPARTMENT_LIST_HTML, dict(departments=page(departments))),
+    }
+    rendered = {name: fragment(name, path, **context) for name, (path, _, context) in fragments.items()}
+    return dict(fragments, **{
+        'patients': ('/patients', hms.PATIENTS_HTML, dict(patients=page(patients))),
+        'appointments': ('/appointments', hms.APPOINTMENTS_HTML,
+                         dict(appointments=page(_rows(per_page, **appointment)))),
+        'doctors': ('/doctors', hms.DOCTORS_HTML,
+                    dict(doctor_list=rendered['doctor_list'], department_options=rendered['department_options'])),
+        'departments': ('/departments', hms.DEPARTMENTS_HTML, dict(department_list=rendered['department_list'])),
+        'dashboard': ('/dashboard', hms.DASHBOARD_HTML,
+                      dict(hospital_name='Test Hospital', total_patients=1, total_appointments=2,
+                           total_doctors=3, total_departments=4)),
+        'settings': ('/hospital_settings', hms.SETTINGS_HTML,
+                     dict(hospital_name='Test Hospital', hospital_email='a@b.c', hospital_phone='1',
+                          hospital_address='Main St')),
+        'login': ('/auth/login', hms.LOGIN_HTML, {}),
+    })
+
+
+def _time(render, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        render()
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare per-request template render time.')
+    parser.add_argument('--iterations', type=int, default=500)
+    parser.add_argument('--per-page', type=int, default=25)
+    args = parser.parse_args()
+
+    app = hms.create_app()
+    registry = app.extensions['hms_templates']
+
+    def fragment(name, path, **context):
+        with app.test_request_context(path):
+            return Markup(registry.render(f'{name}.html', **context))
+
+    print(f"{'template':<20}{'string (us)':>14}{'registry (us)':>16}{'speedup':>10}")
+    for name, (path, source, context) in _contexts(args.per_page, fragment).items():
+        with app.test_request_context(path):
+            context = dict(context, user_name='Super Admin')
+            # Warm both paths once so the first-call costs are not measured
+            render_template_string(source, **context)
+            registry.render(f'{name}.html', **context)
+            before = _time(lambda: render_template_string(source, **context), args.iterations)
+            after = _time(lambda: registry.render(f'{name}.html', **context), args.iterations)
+        print(f'{name:<20}{before:>14.1f}{after:>16.1f}{before / after:>9.1f}x')
+
+
+if __name__ == '__main__':
+    main()
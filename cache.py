@@ -0,0 +1,244 @@
+# cache.py
+# Caches used by the HMS app.
+#
+# Backends share one interface (get/set/pop/clear/get_or_load, plus hit/miss
+# stats):
+#   TTLCache         in-process LRU with TTL; each worker process has its own copy
+#   FileSystemCache  pickled entries in a directory shared by every worker on a host
+#
+# FragmentCache keeps rendered HTML fragments per tenant on top of any backend.
+# Invalidation bumps a per-(tenant, scope) generation, which is part of every
+# fragment key, so it needs no key scan and works across workers when the
+# backend is shared.
+
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+
+class CacheStats:
+    """Hit/miss/set counters of one cache."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.sets = 0
+        self.evictions = 0
+
+    def record(self, name, count=1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + count)
+
+    def as_dict(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'sets': self.sets,
+                'evictions': self.evictions,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries expire `ttl` seconds after being stored.
+
+    The cache lives in one worker process; other workers keep their own copy, so
+    anything cached here may be stale for up to `ttl` seconds after a change made
+    elsewhere.
+    """
+
+    def __init__(self, ttl=60, maxsize=1024):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.stats = CacheStats()
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.stats.record('misses')
+                return default
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                self.stats.record('misses')
+                return default
+            self._data.move_to_end(key)
+            self.stats.record('hits')
+            return value
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._data[key] = (time.monotonic() + (ttl or self.ttl), value)
+            self._data.move_to_end(key)
+            self.stats.record('sets')
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.stats.record('evictions')
+
+    def pop(self, key):
+        with self._lock:
+            item = self._data.pop(key, None)
+        return item[1] if item else None
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def get_or_load(self, key, loader):
+        """Return the cached value, calling `loader()` on a miss. None results are not cached."""
+        value = self.get(key)
+        if value is None:
+            value = loader()
+            if value is not None:
+                self.set(key, value)
+        return value
+
+    def __len__(self):
+        return len(self._data)
+
+
+class FileSystemCache:
+    """Cache of pickled entries in `directory`, shared by all processes that use it.
+
+    Writes go through a temporary file and os.replace(), so readers never see a
+    partial entry. Once there are more than `maxsize` entries, the least recently
+    written ones are removed.
+    """
+
+    PRUNE_EVERY = 100  # sets between size checks
+
+    def __init__(self, directory, ttl=60, maxsize=10000):
+        self.directory = directory
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.stats = CacheStats()
+        self._sets = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(repr(key).encode()).hexdigest() + '.cache')
+
+    def get(self, key, default=None):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                expires_at, value = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError, ValueError):
+            self.stats.record('misses')
+            return default
+        if expires_at < time.time():
+            self._remove(path)
+            self.stats.record('misses')
+            return default
+        self.stats.record('hits')
+        return value
+
+    def set(self, key, value, ttl=None):
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump((time.time() + (ttl or self.ttl), value), f, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, self._path(key))
+        except BaseException:
+            self._remove(tmp)
+            raise
+        self.stats.record('sets')
+        self._sets += 1
+        if self._sets % self.PRUNE_EVERY == 0:
+            self._prune()
+
+    def pop(self, key):
+        value = self.get(key)
+        self._remove(self._path(key))
+        return value
+
+    def clear(self):
+        for path in self._entries():
+            self._remove(path)
+
+    def get_or_load(self, key, loader):
+        """Return the cached value, calling `loader()` on a miss. None results are not cached."""
+        value = self.get(key)
+        if value is None:
+            value = loader()
+            if value is not None:
+                self.set(key, value)
+        return value
+
+    def _entries(self):
+        try:
+            return [entry.path for entry in os.scandir(self.directory) if entry.name.endswith('.cache')]
+        except OSError:
+            return []
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _prune(self):
+        entries = []
+        for path in self._entries():
+            try:
+                entries.append((os.path.getmtime(path), path))
+            except OSError:
+                continue
+        excess = len(entries) - self.maxsize
+        if excess <= 0:
+            return
+        entries.sort()  # oldest writes first
+        for _, path in entries[:excess]:
+            self._remove(path)
+            self.stats.record('evictions')
+
+    def __len__(self):
+        return len(self._entries())
+
+
+class FragmentCache:
+    """Rendered fragments per tenant, invalidated by scope ("doctors", "departments", ...)."""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.stats = CacheStats()
+
+    def _generation(self, tenant, scope):
+        key = ('generation', tenant, scope)
+        generation = self.backend.get(key)
+        if generation is None:
+            # A fresh value, never 0: if this key was evicted, fragments cached
+            # under the previous generation must not come back
+            generation = time.time_ns()
+            self.backend.set(key, generation, ttl=self.backend.ttl * 10)
+        return generation
+
+    def get_or_render(self, tenant, scope, variant, render):
+        """Cached fragment for (tenant, scope, variant), calling `render()` on a miss."""
+        key = ('fragment', tenant, scope, self._generation(tenant, scope), variant)
+        html = self.backend.get(key)
+        if html is not None:
+            self.stats.record('hits')
+            return html
+        self.stats.record('misses')
+        html = render()
+        self.backend.set(key, html)
+        self.stats.record('sets')
+        return html
+
+    def invalidate(self, tenant, *scopes):
+        """Drop every cached fragment of `tenant` in `scopes`."""
+        for scope in scopes:
+            self.backend.set(('generation', tenant, scope), time.time_ns(), ttl=self.backend.ttl * 10)
+            self.stats.record('evictions')
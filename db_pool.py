@@ -0,0 +1,167 @@
+# db_pool.py
+# Engine/connection-pool configuration from environment variables, plus per-worker pool metrics.
+#
+# PostgreSQL (all optional):
+#   DB_POOL_SIZE            persistent connections per worker          (default 5)
+#   DB_MAX_OVERFLOW         extra connections allowed under burst      (default 10)
+#   DB_POOL_TIMEOUT         seconds to wait for a free connection      (default 30)
+#   DB_POOL_RECYCLE         recycle connections older than N seconds   (default 1800)
+#   DB_POOL_PRE_PING        test connections on checkout (1/0)         (default 1)
+#   DB_STATEMENT_TIMEOUT_MS server-side statement_timeout, 0 = off     (default 0)
+# SQLite:
+#   SQLITE_BUSY_TIMEOUT_MS  wait this long on a locked database        (default 5000)
+#   SQLITE_WAL              enable write-ahead logging (1/0)           (default 1)
+#
+# The asyncio engine of asgi.py takes the same settings (async_engine_options()).
+
+import os
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import QueuePool
+
+
+def _env_int(name, default):
+    return int(os.environ.get(name, default))
+
+
+def _env_flag(name, default):
+    return os.environ.get(name, default).lower() in ('1', 'true', 'yes', 'on')
+
+
+class PoolWaitStats:
+    """Checkout counts and time spent waiting for a pooled connection."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def record(self, seconds, timed_out=False):
+        with self._lock:
+            self.checkouts += 1
+            self.timeouts += int(timed_out)
+            self.wait_total += seconds
+            self.wait_max = max(self.wait_max, seconds)
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                'checkouts': self.checkouts,
+                'timeouts': self.timeouts,
+                'wait_total_ms': round(self.wait_total * 1000, 3),
+                'wait_avg_ms': round(self.wait_total * 1000 / self.checkouts, 3) if self.checkouts else 0.0,
+                'wait_max_ms': round(self.wait_max * 1000, 3),
+            }
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long each checkout waited (including any new connect)."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.wait_stats = PoolWaitStats()
+
+    def recreate(self):
+        # Keep the accumulated stats when the engine swaps in a fresh pool (e.g. after dispose())
+        pool = super().recreate()
+        pool.wait_stats = self.wait_stats
+        return pool
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except Exception:
+            self.wait_stats.record(time.perf_counter() - start, timed_out=True)
+            raise
+        self.wait_stats.record(time.perf_counter() - start)
+        return connection
+
+
+def engine_options(database_uri):
+    """SQLALCHEMY_ENGINE_OPTIONS for `database_uri`, driven by the environment."""
+    if database_uri.startswith('postgresql'):
+        options = {
+            'poolclass': TimedQueuePool,
+            'pool_size': _env_int('DB_POOL_SIZE', 5),
+            'max_overflow': _env_int('DB_MAX_OVERFLOW', 10),
+            'pool_timeout': _env_int('DB_POOL_TIMEOUT', 30),
+            'pool_recycle': _env_int('DB_POOL_RECYCLE', 1800),
+            'pool_pre_ping': _env_flag('DB_POOL_PRE_PING', '1'),
+        }
+        statement_timeout = _env_int('DB_STATEMENT_TIMEOUT_MS', 0)
+        if statement_timeout:
+            options['connect_args'] = {'options': f'-c statement_timeout={statement_timeout}'}
+        return options
+    if database_uri.startswith('sqlite'):
+        options = {'connect_args': {'timeout': _env_int('SQLITE_BUSY_TIMEOUT_MS', 5000) / 1000}}
+        if database_uri not in ('sqlite://', 'sqlite:///:memory:'):
+            # In-memory databases keep Flask-SQLAlchemy's StaticPool
+            options['poolclass'] = TimedQueuePool
+        return options
+    return {}
+
+
+# Async drivers of the same databases, for asgi.py
+ASYNC_DRIVERS = {'sqlite': 'sqlite+aiosqlite', 'postgresql': 'postgresql+asyncpg'}
+
+
+def async_database_url(url):
+    """`url` (an engine URL) with its async driver, or None if there is no async driver for it."""
+    drivername = ASYNC_DRIVERS.get(url.get_backend_name())
+    return url.set(drivername=drivername) if drivername else None
+
+
+def async_engine_options(database_uri):
+    """create_async_engine() options for `database_uri`, from the same environment variables."""
+    options = engine_options(database_uri)
+    # TimedQueuePool is synchronous; the async engine brings its own adapted pool
+    options.pop('poolclass', None)
+    connect_args = options.get('connect_args', {})
+    if 'options' in connect_args:
+        # asyncpg takes server settings instead of a libpq options string
+        options['connect_args'] = {'server_settings': {
+            'statement_timeout': str(_env_int('DB_STATEMENT_TIMEOUT_MS', 0))
+        }}
+    return options
+
+
+@event.listens_for(Engine, 'connect')
+def _sqlite_pragmas(dbapi_connection, connection_record):
+    """Tune every new SQLite connection: WAL, busy timeout and cheaper fsyncs."""
+    module = type(dbapi_connection).__module__
+    if module.split('.')[0] not in ('sqlite3', 'pysqlite2') and module != 'sqlalchemy.dialects.sqlite.aiosqlite':
+        return
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute(f"PRAGMA busy_timeout = {_env_int('SQLITE_BUSY_TIMEOUT_MS', 5000)}")
+        if _env_flag('SQLITE_WAL', '1'):
+            cursor.execute('PRAGMA journal_mode = WAL')
+            # Safe with WAL: a crash can lose the last commits but never corrupts the database
+            cursor.execute('PRAGMA synchronous = NORMAL')
+        cursor.execute('PRAGMA temp_store = MEMORY')
+        cursor.execute('PRAGMA cache_size = -16000')  # ~16 MB page cache per connection
+    finally:
+        cursor.close()
+
+
+def pool_status(engine):
+    """Snapshot of this worker's pool for `engine`."""
+    pool = engine.pool
+    status = {'pid': os.getpid(), 'pool': type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        status.update(
+            size=pool.size(),
+            checked_in=pool.checkedin(),
+            checked_out=pool.checkedout(),
+            overflow=max(pool.overflow(), 0),
+        )
+    wait_stats = getattr(pool, 'wait_stats', None)
+    if wait_stats is not None:
+        status.update(wait_stats.as_dict())
+    return status
@@ -0,0 +1,139 @@
+# exports.py
+# Streaming CSV / NDJSON export of tenant data.
+#
+# Rows are read with yield_per (a server-side cursor on PostgreSQL) and encoded into
+# ~64 KB chunks as they arrive, optionally gzip-compressed on the fly, so memory use
+# does not depend on how many rows a tenant has.
+#
+#   GET /export/patients.csv?gzip=1
+#   flask --app app hms export appointments --hospital-id <id> --format ndjson --gzip -o out.ndjson.gz
+
+import csv
+import io
+import json
+import sys
+import zlib
+from datetime import date, datetime
+
+import click
+from flask import Blueprint, Response, abort, current_app, g, request, stream_with_context
+from sqlalchemy import select
+
+from app import Appointment, Hospital, MedicalRecord, Patient, db, hms_cli, login_required
+
+exports_bp = Blueprint('exports', __name__)
+
+# Resource name -> (model, exported columns)
+EXPORTS = {
+    'patients': (Patient, ('id', 'first_name', 'last_name', 'email', 'phone', 'date_of_birth',
+                           'gender', 'blood_group', 'address', 'created_at')),
+    'appointments': (Appointment, ('id', 'patient_id', 'doctor_id', 'appointment_date', 'reason',
+                                   'status', 'notes', 'created_at')),
+    'medical_records': (MedicalRecord, ('id', 'patient_id', 'doctor_id', 'diagnosis', 'treatment',
+                                        'prescription', 'created_at')),
+}
+FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+CHUNK_SIZE = 64 * 1024
+
+
+def _cell(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+def iter_rows(resource, hospital_id):
+    """Yield the tenant's rows of `resource` as tuples, streamed from the database."""
+    model, columns = EXPORTS[resource]
+    statement = (
+        select(*[model.__table__.c[name] for name in columns])
+        .where(model.hospital_id == hospital_id)
+        .order_by(model.id)
+        .execution_options(yield_per=current_app.config['EXPORT_YIELD_PER'])
+    )
+    for row in db.session.execute(statement):
+        yield tuple(_cell(value) for value in row)
+
+
+def encode_csv(columns, rows):
+    """CSV bytes of a header row and `rows`, in chunks of about CHUNK_SIZE."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for row in rows:
+        writer.writerow(row)
+        if buffer.tell() >= CHUNK_SIZE:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode()
+
+
+def encode_ndjson(columns, rows):
+    """NDJSON bytes of `rows` as objects keyed by `columns`, in chunks of about CHUNK_SIZE."""
+    chunk = []
+    size = 0
+    for row in rows:
+        line = json.dumps(dict(zip(columns, row)), default=str) + '\n'
+        chunk.append(line)
+        size += len(line)
+        if size >= CHUNK_SIZE:
+            yield ''.join(chunk).encode()
+            chunk, size = [], 0
+    yield ''.join(chunk).encode()
+
+
+def _gzip(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31: gzip container
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def export_chunks(resource, hospital_id, file_format, compress=False):
+    """Encoded (and optionally gzipped) byte chunks of a tenant export."""
+    columns = EXPORTS[resource][1]
+    encode = encode_csv if file_format == 'csv' else encode_ndjson
+    chunks = encode(columns, iter_rows(resource, hospital_id))
+    return _gzip(chunks) if compress else chunks
+
+
+@exports_bp.route('/export/<resource>.<file_format>')
+@login_required
+def export_resource(resource, file_format):
+    """Download the current hospital's rows as CSV or NDJSON (add ?gzip=1 to compress)."""
+    if resource not in EXPORTS or file_format not in FORMATS:
+        abort(404)
+    compress = request.args.get('gzip') in ('1', 'true', 'yes')
+    filename = f'{resource}.{file_format}' + ('.gz' if compress else '')
+    headers = {'Content-Disposition': f'attachment; filename="{filename}"'}
+    mimetype = 'application/gzip' if compress else FORMATS[file_format]
+    chunks = export_chunks(resource, g.hospital_id, file_format, compress)
+    return Response(stream_with_context(chunks), mimetype=mimetype, headers=headers)
+
+
+@hms_cli.command('export')
+@click.argument('resource', type=click.Choice(sorted(EXPORTS)))
+@click.option('--hospital-id', required=True, help='Tenant to export.')
+@click.option('--format', 'file_format', type=click.Choice(sorted(FORMATS)), default='csv')
+@click.option('--gzip', 'compress', is_flag=True, help='Gzip the output.')
+@click.option('-o', '--output', type=click.Path(dir_okay=False, writable=True), default=None,
+              help='Output file (default: stdout).')
+def export_command(resource, hospital_id, file_format, compress, output):
+    """Stream one tenant's patients, appointments or medical records to a file."""
+    if db.session.get(Hospital, hospital_id) is None:
+        raise click.BadParameter(f'no hospital {hospital_id}', param_hint='--hospital-id')
+    from tenants import tenant_shard
+    target = open(output, 'wb') if output else sys.stdout.buffer
+    try:
+        with tenant_shard(hospital_id):
+            for chunk in export_chunks(resource, hospital_id, file_format, compress):
+                target.write(chunk)
+    finally:
+        if output:
+            target.close()
@@ -0,0 +1,382 @@
+# jobs.py
+# Database-backed background jobs: no broker, just a `jobs` table and workers.
+#
+# Request handlers call enqueue(), which only adds a Job row to the current session.
+# The job is committed together with the request's own changes, so it exists exactly
+# when they do. Workers claim due jobs with one UPDATE ... RETURNING statement. On
+# PostgreSQL the candidate row is picked with FOR UPDATE SKIP LOCKED, so concurrent
+# workers never wait on each other. SQLite serializes writers, so the same UPDATE
+# (guarded by status = 'QUEUED') is atomic there as well. Failed jobs are retried
+# with exponential backoff until max_attempts. While a job runs, its worker renews
+# the lease (JOB_LEASE_SECONDS) every third of it, so a long job keeps its claim. A
+# job whose worker died stops being renewed and is requeued once the lease expires,
+# or marked FAILED if that was its last attempt, so a job that crashes its worker
+# is not retried forever.
+#
+#   flask --app app hms worker --concurrency 4       dedicated worker process
+#   HMS_JOB_THREADS=2                                 or worker threads inside the web process
+#   GET /jobs/<id>                                    job status (JSON)
+
+import json
+import logging
+import os
+import random
+import smtplib
+import socket
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+
+import click
+from flask import Blueprint, abort, current_app, g, jsonify
+from sqlalchemy import select, update
+
+from app import Hospital, User, activation_token, db, hms_cli, login_required
+
+jobs_bp = Blueprint('jobs', __name__)
+log = logging.getLogger(__name__)
+
+STATUSES = ('QUEUED', 'RUNNING', 'SUCCEEDED', 'FAILED')
+# Task name -> (function, max_attempts or None for JOB_MAX_ATTEMPTS)
+TASKS = {}
+
+
+# Model for queued background work
+class Job(db.Model):
+    __tablename__ = 'jobs'
+    id = db.Column(db.Integer, primary_key=True)
+    hospital_id = db.Column(db.String(36), db.ForeignKey('hospitals.id'))
+    task = db.Column(db.String(64), nullable=False)
+    payload = db.Column(db.Text, nullable=False, default='{}')
+    status = db.Column(db.String(20), nullable=False, default='QUEUED')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=5)
+    run_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+    locked_by = db.Column(db.String(100))
+    locked_at = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+    result = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.now)
+    finished_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        # Workers look for due QUEUED jobs in run_at order
+        db.Index('ix_jobs_status_run_at', 'status', 'run_at'),
+        db.Index('ix_jobs_hospital_created', 'hospital_id', 'created_at'),
+    )
+
+    def as_dict(self):
+        return {
+            'id': self.id,
+            'task': self.task,
+            'status': self.status,
+            'attempts': self.attempts,
+            'max_attempts': self.max_attempts,
+            'run_at': self.run_at.isoformat(),
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+            'last_error': self.last_error.strip().splitlines()[-1] if self.last_error else None,
+            'result': json.loads(self.result) if self.result else None,
+        }
+
+    def __repr__(self):
+        return f'<Job {self.id} {self.task} {self.status}>'
+
+
+# ----------------------------------------------------
+# Tasks
+# ----------------------------------------------------
+
+def task(name, max_attempts=None):
+    """Register a function as a background task under `name`."""
+    def decorator(f):
+        TASKS[name] = (f, max_attempts)
+        return f
+    return decorator
+
+
+def enqueue(task_name, hospital_id=None, delay=0, **payload):
+    """Add a job to the current session; it is queued when the session commits.
+
+    `hospital_id` makes the job visible to that tenant at /jobs/<id> and is passed
+    to the task along with `payload`.
+    """
+    if task_name not in TASKS:
+        raise KeyError(f'unknown task {task_name!r}')
+    if hospital_id is not None:
+        payload['hospital_id'] = hospital_id
+    max_attempts = TASKS[task_name][1] or current_app.config['JOB_MAX_ATTEMPTS']
+    job = Job(hospital_id=hospital_id, task=task_name, payload=json.dumps(payload),
+              max_attempts=max_attempts, run_at=datetime.now() + timedelta(seconds=delay))
+    db.session.add(job)
+    return job
+
+
+def send_mail(to, subject, body):
+    """Send a plain-text email through MAIL_SERVER, or log it when none is configured."""
+    config = current_app.config
+    if not config['MAIL_SERVER']:
+        log.info('mail to %s: %s\n%s', to, subject, body)
+        return
+    message = EmailMessage()
+    message['From'] = config['MAIL_SENDER']
+    message['To'] = to
+    message['Subject'] = subject
+    message.set_content(body)
+    with smtplib.SMTP(config['MAIL_SERVER'], config['MAIL_PORT'], timeout=30) as smtp:
+        if config['MAIL_USE_TLS']:
+            smtp.starttls()
+        if config['MAIL_USERNAME']:
+            smtp.login(config['MAIL_USERNAME'], config['MAIL_PASSWORD'])
+        smtp.send_message(message)
+
+
+@task('send_activation_email')
+def send_activation_email(hospital_id):
+    """Welcome email for a newly registered hospital's admin."""
+    hospital = db.session.get(Hospital, hospital_id)
+    admin = User.query.filter_by(hospital_id=hospital_id, email=hospital.admin_email).first()
+    config = current_app.config
+    activate_url = config['BASE_URL'].rstrip('/') + '/auth/activate/' + activation_token(admin)
+    send_mail(hospital.admin_email, f'Welcome to HMS, {hospital.name}', (
+        f'Your hospital "{hospital.name}" has been registered and is awaiting verification.\n\n'
+        f'Set the password of your admin account ({admin.email}) at:\n'
+        f'  {activate_url}\n\n'
+        f'The link works once and expires in {config["ACTIVATION_TOKEN_MAX_AGE"] // 3600} hours.\n'
+    ))
+    return {'sent_to': hospital.admin_email}
+
+
+# ----------------------------------------------------
+# Claiming and running
+# ----------------------------------------------------
+
+def claim_job(worker_name):
+    """Atomically mark the next due job RUNNING for `worker_name`; returns its id or None."""
+    now = datetime.now()
+    candidate = (
+        select(Job.id)
+        .where(Job.status == 'QUEUED', Job.run_at <= now)
+        .order_by(Job.run_at, Job.id)
+        .limit(1)
+        .with_for_update(skip_locked=True)  # ignored by SQLite
+        .scalar_subquery()
+    )
+    statement = (
+        update(Job)
+        .where(Job.id == candidate, Job.status == 'QUEUED')
+        .values(status='RUNNING', locked_by=worker_name, locked_at=now, attempts=Job.attempts + 1)
+        .returning(Job.id)
+        .execution_options(synchronize_session=False)
+    )
+    job_id = db.session.execute(statement).scalar()
+    db.session.commit()
+    return job_id
+
+
+def requeue_stale_jobs():
+    """Put RUNNING jobs whose lease ran out (their worker died) back in the queue.
+
+    Jobs that have used all their attempts are marked FAILED instead; returns the
+    number requeued.
+    """
+    now = datetime.now()
+    stale = (Job.status == 'RUNNING', Job.locked_at < now - timedelta(seconds=current_app.config['JOB_LEASE_SECONDS']))
+    failed = db.session.execute(
+        update(Job)
+        .where(*stale, Job.attempts >= Job.max_attempts)
+        .values(status='FAILED', locked_by=None, locked_at=None, finished_at=now,
+                last_error='worker lease expired on the last attempt')
+        .execution_options(synchronize_session=False)
+    )
+    result = db.session.execute(
+        update(Job)
+        .where(*stale)
+        .values(status='QUEUED', locked_by=None, locked_at=None)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    if failed.rowcount:
+        log.warning('%s job(s) failed: their worker died on the last attempt', failed.rowcount)
+    return result.rowcount
+
+
+def renew_lease(job_id, worker_name):
+    """Push back the lease of a job `worker_name` is running; False if it lost the job."""
+    result = db.session.execute(
+        update(Job)
+        .where(Job.id == job_id, Job.status == 'RUNNING', Job.locked_by == worker_name)
+        .values(locked_at=datetime.now())
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return bool(result.rowcount)
+
+
+class LeaseHeartbeat:
+    """Renews a running job's lease from a background thread until the block exits."""
+
+    def __init__(self, app, job_id, worker_name):
+        self.app = app
+        self.job_id = job_id
+        self.worker_name = worker_name
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f'hms-job-lease-{job_id}', daemon=True)
+
+    def _run(self):
+        interval = self.app.config['JOB_LEASE_SECONDS'] / 3
+        while not self._stop.wait(interval):
+            try:
+                with self.app.app_context():
+                    if not renew_lease(self.job_id, self.worker_name):
+                        log.warning('job %s: lease lost, it may run again elsewhere', self.job_id)
+                        return
+            except Exception:
+                log.exception('job %s: failed to renew the lease', self.job_id)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+
+def backoff_delay(attempts):
+    """Seconds before retry number `attempts`: exponential, capped, with jitter."""
+    base = current_app.config['JOB_BACKOFF_SECONDS']
+    delay = min(base * 2 ** (attempts - 1), current_app.config['JOB_BACKOFF_MAX_SECONDS'])
+    return delay * random.uniform(0.8, 1.2)
+
+
+def run_job(job_id):
+    """Run a claimed job and record the outcome; returns the final Job."""
+    from tenants import tenant_shard
+    job = db.session.get(Job, job_id)
+    try:
+        f = TASKS[job.task][0]
+        with LeaseHeartbeat(current_app._get_current_object(), job.id, job.locked_by), \
+                tenant_shard(job.hospital_id):
+            result = f(**json.loads(job.payload))
+    except Exception:
+        db.session.rollback()
+        job = db.session.get(Job, job_id)
+        job.last_error = traceback.format_exc()
+        job.locked_by = job.locked_at = None
+        if job.attempts < job.max_attempts:
+            job.status = 'QUEUED'
+            job.run_at = datetime.now() + timedelta(seconds=backoff_delay(job.attempts))
+        else:
+            job.status = 'FAILED'
+            job.finished_at = datetime.now()
+        log.warning('job %s (%s) attempt %s failed', job.id, job.task, job.attempts, exc_info=True)
+    else:
+        job.status = 'SUCCEEDED'
+        job.result = json.dumps(result, default=str) if result is not None else None
+        job.locked_by = job.locked_at = None
+        job.finished_at = datetime.now()
+    db.session.commit()
+    return job
+
+
+class Worker:
+    """Polls the jobs table and runs due jobs on a pool of threads."""
+
+    def __init__(self, app, concurrency=1, poll_interval=None, name=None):
+        self.app = app
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval or app.config['JOB_POLL_INTERVAL']
+        self.name = name or f'{socket.gethostname()}:{os.getpid()}'
+        self._stop = threading.Event()
+
+    def work_once(self, thread_name=None):
+        """Claim and run one job; False when nothing was due."""
+        with self.app.app_context():
+            job_id = claim_job(thread_name or self.name)
+            if job_id is None:
+                return False
+            run_job(job_id)
+            return True
+
+    def _loop(self, index):
+        thread_name = f'{self.name}/{index}'
+        while not self._stop.is_set():
+            try:
+                if not self.work_once(thread_name):
+                    self._stop.wait(self.poll_interval)
+            except Exception:
+                # Database unavailable or similar: back off and keep the thread alive
+                log.exception('job worker %s failed to poll', thread_name)
+                self._stop.wait(self.poll_interval)
+
+    def _reaper(self):
+        lease = self.app.config['JOB_LEASE_SECONDS']
+        while not self._stop.wait(min(lease, 60)):
+            try:
+                with self.app.app_context():
+                    requeue_stale_jobs()
+            except Exception:
+                log.exception('job worker %s failed to requeue stale jobs', self.name)
+
+    def start(self):
+        """Run the worker threads in the background (daemon threads)."""
+        for index in range(self.concurrency):
+            threading.Thread(target=self._loop, args=(index,), name=f'hms-job-{index}', daemon=True).start()
+        threading.Thread(target=self._reaper, name='hms-job-reaper', daemon=True).start()
+        return self
+
+    def run(self):
+        """Run in the foreground until interrupted."""
+        with ThreadPoolExecutor(self.concurrency + 1, thread_name_prefix='hms-job') as pool:
+            pool.submit(self._reaper)
+            for index in range(self.concurrency):
+                pool.submit(self._loop, index)
+            try:
+                while not self._stop.wait(1):
+                    pass
+            except KeyboardInterrupt:
+                self.stop()
+
+    def stop(self):
+        self._stop.set()
+
+
+def drain(app, limit=None):
+    """Run due jobs in this thread until none are left (or `limit` ran); returns the count."""
+    worker = Worker(app, name=f'{socket.gethostname()}:{os.getpid()}/drain')
+    count = 0
+    while (limit is None or count < limit) and worker.work_once():
+        count += 1
+    return count
+
+
+# ----------------------------------------------------
+# Entry points
+# ----------------------------------------------------
+
+@jobs_bp.route('/jobs/<int:job_id>')
+@login_required
+def job_status(job_id):
+    """Status of one of the current hospital's jobs."""
+    job = Job.query.filter_by(hospital_id=g.hospital_id, id=job_id).first()
+    if job is None:
+        abort(404)
+    return jsonify(job.as_dict())
+
+
+@hms_cli.command('worker')
+@click.option('--concurrency', type=int, default=2, show_default=True, help='Worker threads.')
+@click.option('--once', is_flag=True, help='Run the jobs that are due now, then exit.')
+def worker_command(concurrency, once):
+    """Process background jobs."""
+    app = current_app._get_current_object()
+    if once:
+        with app.app_context():
+            requeue_stale_jobs()
+        click.echo(f'Ran {drain(app)} job(s).')
+        return
+    click.echo(f'Worker running with {concurrency} thread(s); Ctrl+C to stop.')
+    Worker(app, concurrency).run()
@@ -0,0 +1,420 @@
+# medical_records.py
+# Per-patient medical record timeline, single-record view and batched ingestion.
+#
+# Records are append-only: the ORM refuses to update or delete a MedicalRecord,
+# and a correction is added as a new record. Timelines are read newest first
+# through ix_medical_records_hospital_patient_created, paged with the usual
+# (created_at, id) cursors. The large treatment/prescription bodies are deferred
+# columns, so a timeline page reads only the record headers.
+#
+#   GET  /patients/<id>/records              timeline (HTML)
+#   POST /patients/<id>/records              add one record (form)
+#   GET  /records/<id>                       full record (HTML)
+#   POST /records/ingest                     JSON list or NDJSON body, for lab systems
+#   flask --app app hms ingest-records results.ndjson --hospital-id <id>
+
+import csv
+import io
+from datetime import datetime
+
+import click
+from flask import Blueprint, abort, current_app, flash, g, redirect, request, url_for
+from sqlalchemy import event, select
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import joinedload, object_session, undefer_group
+
+from api import api_login_required, json_response
+from app import Doctor, Hospital, MedicalRecord, Patient, db, hms_cli, login_required, render_page
+from pagination import paginate_request
+from replicas import replica_reads
+from patient_import import PARSERS, ImportReport, detect_format
+
+records_bp = Blueprint('medical_records', __name__)
+
+TEXT_FIELDS = ('diagnosis', 'treatment', 'prescription')
+_DIAGNOSIS_LENGTH = MedicalRecord.__table__.c.diagnosis.type.length
+
+
+class AppendOnlyError(RuntimeError):
+    """A stored medical record was about to be changed or removed."""
+
+
+@event.listens_for(MedicalRecord, 'before_update')
+def _refuse_update(mapper, connection, target):
+    # Flush visits every dirty object, including ones whose values did not change
+    if object_session(target).is_modified(target, include_collections=False):
+        raise AppendOnlyError(f'medical record {target.id} is append-only; add a new record instead')
+
+
+@event.listens_for(MedicalRecord, 'before_delete')
+def _refuse_delete(mapper, connection, target):
+    raise AppendOnlyError(f'medical record {target.id} is append-only and cannot be deleted')
+
+
+# ----------------------------------------------------
+# Templates
+# ----------------------------------------------------
+
+TIMELINE_HTML = r"""
+<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <title>Medical Records - HMS</title>
+    <link href="https://cdn.jsdelivr.net/npm/bootstrap@5.3.3/dist/css/bootstrap.min.css" rel="stylesheet">
+    <link rel="stylesheet" href="https://cdn.jsdelivr.net/npm/bootstrap-icons@1.10.0/font/bootstrap-icons.css">
+    <style>
+        body { background-color: #f5f5f5; }
+        .navbar { background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); }
+        .navbar a { color: white !important; }
+        .btn-back { color: white; text-decoration: none; }
+    </style>
+</head>
+<body>
+    <nav class="navbar navbar-dark">
+        <div class="container-fluid">
+            <span class="navbar-brand"><a href="{{ url_for('patients') }}" class="btn-back"><i class="bi bi-arrow-left"></i> Back to Patients</a></span>
+            <span style="color: white;">Welcome, {{ user_name }}</span>
+        </div>
+    </nav>
+    <div class="container mt-5">
+        <h2>📋 {{ patient.first_name }} {{ patient.last_name }} <small class="text-muted">#{{ patient.id }}</small></h2>
+
+        {% with messages = get_flashed_messages(with_categories=true) %}
+            {% if messages %}
+                <div class="mb-3">
+                    {% for category, message in messages %}
+                        <div class="alert alert-{{ 'danger' if category == 'error' else category }}" role="alert">{{ message }}</div>
+                    {% endfor %}
+                </div>
+            {% endif %}
+        {% endwith %}
+
+        <div class="card mt-4">
+            <div class="card-header bg-primary text-white">
+                <h5 class="mb-0">Add Record</h5>
+            </div>
+            <div class="card-body">
+                <form method="POST" action="{{ url_for('medical_records.add_record', patient_id=patient.id) }}">
+                    <div class="row">
+                        <div class="col-md-8 mb-3">
+                            <label class="form-label">Diagnosis</label>
+                            <input type="text" class="form-control" name="diagnosis" maxlength="255" required>
+                        </div>
+                        <div class="col-md-4 mb-3 position-relative">
+                            <label class="form-label">Doctor</label>
+                            <input type="text" class="form-control" autocomplete="off" placeholder="Not specified"
+                                   data-lookup="{{ url_for('agenda.lookup_doctors') }}" data-target="record-doctor-id">
+                            <input type="hidden" id="record-doctor-id" name="doctor_id">
+                            <div class="list-group position-absolute w-100 shadow-sm" style="z-index: 10;"></div>
+                        </div>
+                    </div>
+                    <div class="row">
+                        <div class="col-md-6 mb-3">
+                            <label class="form-label">Treatment</label>
+                            <textarea class="form-control" name="treatment" rows="3"></textarea>
+                        </div>
+                        <div class="col-md-6 mb-3">
+                            <label class="form-label">Prescription</label>
+                            <textarea class="form-control" name="prescription" rows="3"></textarea>
+                        </div>
+                    </div>
+                    <button type="submit" class="btn btn-success"><i class="bi bi-plus-circle"></i> Add Record</button>
+                </form>
+            </div>
+        </div>
+
+        <div class="card mt-4">
+            <div class="card-header bg-secondary text-white d-flex justify-content-between align-items-center">
+                <h5 class="mb-0">Timeline (showing {{ records|length }})</h5>
+                <form method="GET" class="d-flex gap-2">
+                    <select name="sort" class="form-select form-select-sm" onchange="this.form.submit()">
+                        {% for option in records.sort_options %}
+                            <option value="{{ option }}" {{ 'selected' if option == records.sort }}>{{ option|capitalize }} first</option>
+                        {% endfor %}
+                    </select>
+                    <select name="per_page" class="form-select form-select-sm" onchange="this.form.submit()">
+                        {% for size in records.page_sizes %}
+                            <option value="{{ size }}" {{ 'selected' if size == records.per_page }}>{{ size }} / page</option>
+                        {% endfor %}
+                    </select>
+                </form>
+            </div>
+            <div class="card-body">
+                {% if records %}
+                    <ul class="list-group list-group-flush">
+                        {% for record in records %}
+                        <li class="list-group-item d-flex justify-content-between align-items-start">
+                            <div>
+                                <div class="fw-bold">{{ record.diagnosis or 'No diagnosis' }}</div>
+                                <small class="text-muted">{{ record.created_at.strftime('%d/%m/%Y %H:%M') }}
+                                    {% if record.doctor %}&middot; Dr. {{ record.doctor.first_name }} {{ record.doctor.last_name }}{% endif %}</small>
+                            </div>
+                            <a href="{{ url_for('medical_records.record_detail', record_id=record.id) }}" class="btn btn-sm btn-info">View</a>
+                        </li>
+                        {% endfor %}
+                    </ul>
+                    <nav aria-label="Record pages" class="mt-3">
+                        <ul class="pagination justify-content-end mb-0">
+                            <li class="page-item {{ 'disabled' if not records.has_prev }}"><a class="page-link" href="{{ records.prev_url or '#' }}">&laquo; Previous</a></li>
+                            <li class="page-item {{ 'disabled' if not records.has_next }}"><a class="page-link" href="{{ records.next_url or '#' }}">Next &raquo;</a></li>
+                        </ul>
+                    </nav>
+                {% else %}
+                    <div class="alert alert-info">No medical records for this patient yet.</div>
+                {% endif %}
+            </div>
+        </div>
+    </div>
+    {% include 'typeahead.html' %}
+</body>
+</html>
+"""
+
+RECORD_HTML = r"""
+<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <title>Medical Record - HMS</title>
+    <link href="https://cdn.jsdelivr.net/npm/bootstrap@5.3.3/dist/css/bootstrap.min.css" rel="stylesheet">
+    <link rel="stylesheet" href="https://cdn.jsdelivr.net/npm/bootstrap-icons@1.10.0/font/bootstrap-icons.css">
+    <style>
+        body { background-color: #f5f5f5; }
+        .navbar { background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); }
+        .navbar a { color: white !important; }
+        .btn-back { color: white; text-decoration: none; }
+        pre { white-space: pre-wrap; }
+    </style>
+</head>
+<body>
+    <nav class="navbar navbar-dark">
+        <div class="container-fluid">
+            <span class="navbar-brand"><a href="{{ url_for('medical_records.timeline', patient_id=record.patient_id) }}" class="btn-back"><i class="bi bi-arrow-left"></i> Back to Timeline</a></span>
+            <span style="color: white;">Welcome, {{ user_name }}</span>
+        </div>
+    </nav>
+    <div class="container mt-5">
+        <div class="card">
+            <div class="card-header bg-primary text-white">
+                <h5 class="mb-0">{{ record.diagnosis or 'No diagnosis' }}</h5>
+            </div>
+            <div class="card-body">
+                <p class="text-muted">
+                    Record #{{ record.id }} &middot; {{ record.patient.first_name }} {{ record.patient.last_name }}
+                    &middot; {{ record.created_at.strftime('%d/%m/%Y %H:%M') }}
+                    {% if record.doctor %}&middot; Dr. {{ record.doctor.first_name }} {{ record.doctor.last_name }}{% endif %}
+                </p>
+                <h6>Treatment</h6>
+                <pre>{{ record.treatment or '-' }}</pre>
+                <h6>Prescription</h6>
+                <pre>{{ record.prescription or '-' }}</pre>
+            </div>
+        </div>
+    </div>
+</body>
+</html>
+"""
+
+
+@records_bp.record_once
+def _register_templates(state):
+    registry = state.app.extensions['hms_templates']
+    registry.register('medical_records.html', TIMELINE_HTML)
+    registry.register('medical_record.html', RECORD_HTML)
+
+
+# ----------------------------------------------------
+# Ingestion
+# ----------------------------------------------------
+
+def _parse_timestamp(value):
+    if value in (None, ''):
+        return None
+    if isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(str(value))
+
+
+def validate_record(raw):
+    """Return (values, None) for a valid record row or (None, error_message)."""
+    values = {}
+    try:
+        values['patient_id'] = int(raw.get('patient_id'))
+        values['doctor_id'] = int(raw['doctor_id']) if raw.get('doctor_id') not in (None, '') else None
+    except (TypeError, ValueError):
+        return None, 'patient_id and doctor_id must be integers'
+    for field in TEXT_FIELDS:
+        value = raw.get(field)
+        if value is not None and not isinstance(value, str):
+            return None, f'{field} must be a string'
+        values[field] = value.strip() if value and value.strip() else None
+    if not any(values[field] for field in TEXT_FIELDS):
+        return None, 'a record needs a diagnosis, treatment or prescription'
+    if values['diagnosis'] and len(values['diagnosis']) > _DIAGNOSIS_LENGTH:
+        return None, f'diagnosis longer than {_DIAGNOSIS_LENGTH} characters'
+    try:
+        # Lab systems send when the result was taken; default to now
+        values['created_at'] = _parse_timestamp(raw.get('created_at')) or datetime.now()
+    except ValueError:
+        return None, 'created_at must be an ISO 8601 timestamp'
+    return values, None
+
+
+def _tenant_ids(model, hospital_id, ids):
+    if not ids:
+        return set()
+    rows = db.session.execute(select(model.id).where(model.hospital_id == hospital_id, model.id.in_(ids)))
+    return {row_id for (row_id,) in rows}
+
+
+def _insert_batch(hospital_id, batch, report):
+    """Check a batch's patients/doctors belong to the tenant, then insert it in one executemany."""
+    patients = _tenant_ids(Patient, hospital_id, {values['patient_id'] for _, values in batch})
+    doctors = _tenant_ids(Doctor, hospital_id, {values['doctor_id'] for _, values in batch if values['doctor_id']})
+    lines, rows = [], []
+    for line, values in batch:
+        if values['patient_id'] not in patients:
+            report.fail(line, f"unknown patient {values['patient_id']}")
+        elif values['doctor_id'] and values['doctor_id'] not in doctors:
+            report.fail(line, f"unknown doctor {values['doctor_id']}")
+        else:
+            lines.append(line)
+            rows.append(dict(values, hospital_id=hospital_id))
+    if not rows:
+        return
+    try:
+        db.session.execute(MedicalRecord.__table__.insert(), rows)
+        db.session.commit()
+        report.inserted += len(rows)
+    except DBAPIError as e:
+        db.session.rollback()
+        for line in lines:
+            report.fail(line, f'database rejected batch: {e.orig}')
+
+
+def ingest_records(rows, hospital_id, batch_size=None):
+    """Validate and insert (line_number, row_dict) pairs of medical records for one hospital."""
+    batch_size = batch_size or current_app.config['IMPORT_BATCH_SIZE']
+    report = ImportReport()
+    batch = []
+    line = 0
+    try:
+        for line, raw in rows:
+            if isinstance(raw, Exception):
+                report.fail(line, str(raw))
+                continue
+            values, error = validate_record(raw)
+            if error:
+                report.fail(line, error)
+                continue
+            batch.append((line, values))
+            if len(batch) >= batch_size:
+                _insert_batch(hospital_id, batch, report)
+                batch = []
+    except (UnicodeDecodeError, ValueError, csv.Error) as e:
+        report.unreadable = f'after line {line}: {e}'
+    if batch:
+        _insert_batch(hospital_id, batch, report)
+    return report
+
+
+# ----------------------------------------------------
+# Routes
+# ----------------------------------------------------
+
+def _tenant_patient(patient_id):
+    patient = Patient.query.filter_by(hospital_id=g.hospital_id, id=patient_id).first()
+    if patient is None:
+        abort(404)
+    return patient
+
+
+@records_bp.route('/patients/<int:patient_id>/records')
+@login_required
+@replica_reads
+def timeline(patient_id):
+    """A patient's records, newest first, one cursor page at a time."""
+    patient = _tenant_patient(patient_id)
+    query = MedicalRecord.query.options(joinedload(MedicalRecord.doctor)) \
+        .filter_by(hospital_id=g.hospital_id, patient_id=patient.id)
+    return render_page('medical_records.html', patient=patient,
+                       records=paginate_request(query, MedicalRecord), user_name=g.user.name)
+
+
+@records_bp.route('/patients/<int:patient_id>/records', methods=['POST'])
+@login_required
+def add_record(patient_id):
+    """Append one record to a patient's timeline."""
+    patient = _tenant_patient(patient_id)
+    values, error = validate_record(dict(request.form, patient_id=patient.id, created_at=None))
+    if values and values['doctor_id'] and not _tenant_ids(Doctor, g.hospital_id, {values['doctor_id']}):
+        error = 'Unknown doctor.'
+    if error:
+        flash(f'Error adding record: {error}', 'error')
+    else:
+        db.session.add(MedicalRecord(hospital_id=g.hospital_id, **values))
+        db.session.commit()
+        flash('Record added successfully!', 'success')
+    return redirect(url_for('medical_records.timeline', patient_id=patient.id))
+
+
+@records_bp.route('/records/<int:record_id>')
+@login_required
+@replica_reads
+def record_detail(record_id):
+    """One record with its treatment and prescription bodies."""
+    record = MedicalRecord.query.options(
+        joinedload(MedicalRecord.patient), joinedload(MedicalRecord.doctor), undefer_group('body')
+    ).filter_by(hospital_id=g.hospital_id, id=record_id).first()
+    if record is None:
+        abort(404)
+    return render_page('medical_record.html', record=record, user_name=g.user.name)
+
+
+@records_bp.route('/records/ingest', methods=['POST'])
+@api_login_required
+def ingest():
+    """Bulk-append records sent as a JSON list or an NDJSON body."""
+    if request.is_json:
+        payload = request.get_json(silent=True)
+        if not isinstance(payload, list):
+            return json_response({'error': 'expected a JSON list of records'}, 400)
+        rows = ((number, raw if isinstance(raw, dict) else ValueError('expected a JSON object'))
+                for number, raw in enumerate(payload, 1))
+    else:
+        rows = PARSERS['ndjson'](io.TextIOWrapper(request.stream, encoding='utf-8'))
+    report = ingest_records(rows, g.hospital_id)
+    payload = {
+        'inserted': report.inserted,
+        'failed': report.failed,
+        'errors': [{'line': line, 'message': message} for line, message in report.errors],
+    }
+    if report.unreadable:
+        payload['error'] = f'the body could not be read as UTF-8 NDJSON ({report.unreadable})'
+        return json_response(payload, 400)
+    return json_response(payload)
+
+
+@hms_cli.command('ingest-records')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--hospital-id', required=True, help='Tenant to ingest into.')
+@click.option('--format', 'file_format', type=click.Choice(sorted(PARSERS)), default=None,
+              help='Input format (default: from the file extension).')
+@click.option('--batch-size', type=int, default=None, help='Rows per INSERT batch.')
+def ingest_records_command(path, hospital_id, file_format, batch_size):
+    """Bulk-append medical records from a CSV or JSONL file."""
+    if db.session.get(Hospital, hospital_id) is None:
+        raise click.BadParameter(f'no hospital {hospital_id}', param_hint='--hospital-id')
+    from tenants import tenant_shard
+    file_format = file_format or detect_format(path)
+    with open(path, encoding='utf-8-sig', newline='') as stream, tenant_shard(hospital_id):
+        report = ingest_records(PARSERS[file_format](stream), hospital_id, batch_size)
+    for line, message in report.errors:
+        click.echo(f'line {line}: {message}', err=True)
+    if report.unreadable:
+        click.echo(f'stopped: the file could not be read ({report.unreadable})', err=True)
+    if report.failed > len(report.errors):
+        click.echo(f'... and {report.failed - len(report.errors)} more', err=True)
+    click.echo(f'Inserted {report.inserted} record(s), {report.failed} failed, '
+               f'{report.elapsed:.1f}s ({report.rows_per_second:,.0f} rows/s).')
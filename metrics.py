@@ -0,0 +1,318 @@
+# metrics.py
+# Per-request instrumentation and a Prometheus /metrics endpoint.
+#
+# For every request we record the wall time, the number of SQL statements and the
+# time spent in them (engine cursor events), and the time spent rendering
+# templates (Flask's template signals). These feed histograms labelled by
+# endpoint, so label cardinality is bounded by the routes rather than the URLs. A
+# Server-Timing header lets the browser's devtools show the same breakdown.
+#
+# Requests slower than SLOW_REQUEST_MS and statements slower than SLOW_QUERY_MS
+# are logged on the "hms.slow" logger. Query strings and bound parameters can
+# hold patient data, so the path is logged without its query string, and each
+# parameter is replaced by its type.
+#
+# Metrics live in the worker process. Under gunicorn, each scrape of /metrics
+# sees one worker; the `pid` in hms_worker_info tells them apart. Scrapes must send
+# "Authorization: Bearer <METRICS_TOKEN>"; without a METRICS_TOKEN /metrics is off.
+
+import bisect
+import hmac
+import logging
+import os
+import threading
+import time
+
+from flask import (before_render_template, current_app, g, has_app_context, has_request_context, request,
+                   template_rendered)
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+slow_log = logging.getLogger('hms.slow')
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter with optional labels."""
+
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for labels, value in sorted(values.items()):
+            yield f'{self.name}{_labels(self.labelnames, labels)} {_number(value)}'
+
+
+class Histogram:
+    """Cumulative-bucket histogram with optional labels."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DURATION_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}  # labels -> [per-bucket counts (+Inf last), sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def samples(self):
+        with self._lock:
+            values = {labels: (list(counts), total) for labels, (counts, total) in self._values.items()}
+        for labels, (counts, total) in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                le = bound if bound == '+Inf' else _number(float(bound))
+                yield f'{self.name}_bucket{_labels(self.labelnames, labels, ("le", le))} {cumulative}'
+            yield f'{self.name}_sum{_labels(self.labelnames, labels)} {_number(total)}'
+            yield f'{self.name}_count{_labels(self.labelnames, labels)} {cumulative}'
+
+
+class RequestTimings:
+    """What one request spent, filled in by the hooks below."""
+
+    __slots__ = ('started', 'sql_count', 'sql_time', 'template_time', 'template_depth', 'template_started')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.template_time = 0.0
+        self.template_depth = 0
+        self.template_started = 0.0
+
+
+class Metrics:
+    """The metrics of one app in this worker process."""
+
+    def __init__(self, app):
+        self.app = app
+        self.started_at = time.time()
+        self.requests = Histogram('hms_request_duration_seconds', 'Wall time of HTTP requests.',
+                                  ('method', 'endpoint', 'status'))
+        self.request_sql_count = Histogram('hms_request_sql_statements', 'SQL statements per request.',
+                                           ('endpoint',), COUNT_BUCKETS)
+        self.request_sql_time = Histogram('hms_request_sql_duration_seconds', 'Time in SQL per request.',
+                                          ('endpoint',))
+        self.request_template_time = Histogram('hms_request_template_duration_seconds',
+                                               'Time rendering templates per request.', ('endpoint',))
+        self.statements = Histogram('hms_sql_statement_duration_seconds',
+                                    'Duration of SQL statements, including background jobs.', ('context',))
+        self.slow_requests = Counter('hms_slow_requests_total', 'Requests slower than SLOW_REQUEST_MS.',
+                                     ('endpoint',))
+        self.slow_statements = Counter('hms_slow_sql_statements_total', 'Statements slower than SLOW_QUERY_MS.',
+                                       ('context',))
+        self.collectors = [self.requests, self.request_sql_count, self.request_sql_time,
+                           self.request_template_time, self.statements, self.slow_requests, self.slow_statements]
+
+    def authorized(self):
+        token = self.app.config['METRICS_TOKEN']
+        if not token:
+            return False
+        return hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}')
+
+    def render(self, pool=None, caches=None):
+        """Prometheus text exposition of everything recorded in this worker.
+
+        `pool` is a db_pool.pool_status() dict, `caches` maps a cache name to
+        (CacheStats, entries).
+        """
+        lines = [
+            '# HELP hms_worker_info Worker process serving this scrape.',
+            '# TYPE hms_worker_info gauge',
+            f'hms_worker_info{{pid="{os.getpid()}"}} 1',
+            '# HELP hms_worker_start_time_seconds Unix time the worker started collecting.',
+            '# TYPE hms_worker_start_time_seconds gauge',
+            f'hms_worker_start_time_seconds {_number(self.started_at)}',
+        ]
+        for collector in self.collectors:
+            lines.append(f'# HELP {collector.name} {collector.documentation}')
+            lines.append(f'# TYPE {collector.name} {collector.kind}')
+            lines.extend(collector.samples())
+        if pool:
+            lines.extend(_pool_lines(pool))
+        if caches:
+            lines.extend(_cache_lines(caches))
+        return '\n'.join(lines) + '\n'
+
+
+def _pool_lines(pool):
+    gauges = (
+        ('hms_db_pool_size', 'gauge', 'Persistent connections in the pool.', 'size', 1),
+        ('hms_db_pool_checked_out', 'gauge', 'Connections in use.', 'checked_out', 1),
+        ('hms_db_pool_overflow', 'gauge', 'Connections open beyond the pool size.', 'overflow', 1),
+        ('hms_db_pool_checkouts_total', 'counter', 'Connection checkouts.', 'checkouts', 1),
+        ('hms_db_pool_timeouts_total', 'counter', 'Checkouts that timed out.', 'timeouts', 1),
+        ('hms_db_pool_wait_seconds_total', 'counter', 'Time spent waiting for a connection.', 'wait_total_ms', 0.001),
+    )
+    for name, kind, documentation, key, scale in gauges:
+        if key in pool:
+            yield f'# HELP {name} {documentation}'
+            yield f'# TYPE {name} {kind}'
+            yield f'{name} {_number(pool[key] * scale)}'
+
+
+def _cache_lines(caches):
+    for field, kind, documentation in (('hits', 'counter', 'Cache hits.'),
+                                       ('misses', 'counter', 'Cache misses.'),
+                                       ('evictions', 'counter', 'Entries evicted or invalidated.'),
+                                       ('entries', 'gauge', 'Entries currently stored.')):
+        name = f'hms_cache_{field}_total' if kind == 'counter' else f'hms_cache_{field}'
+        yield f'# HELP {name} {documentation}'
+        yield f'# TYPE {name} {kind}'
+        for cache, (stats, entries) in sorted(caches.items()):
+            value = entries if field == 'entries' else stats.as_dict()[field]
+            yield f'{name}{{cache="{_escape(cache)}"}} {value}'
+
+
+def redact(parameters):
+    """Parameter types instead of values, e.g. ['str', 'int'] or '250 rows' for executemany."""
+    if isinstance(parameters, (list, tuple)) and parameters and isinstance(parameters[0], (list, tuple, dict)):
+        return f'{len(parameters)} rows'
+    if isinstance(parameters, dict):
+        return {key: type(value).__name__ for key, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [type(value).__name__ for value in parameters]
+    return type(parameters).__name__
+
+
+def _metrics():
+    if has_app_context():
+        return current_app.extensions.get('hms_metrics')
+    return None
+
+
+# ----------------------------------------------------
+# Hooks
+# ----------------------------------------------------
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _statement_started(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('hms_statement_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _statement_finished(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get('hms_statement_started')
+    if not started:
+        return
+    elapsed = time.perf_counter() - started.pop()
+    metrics = _metrics()
+    if metrics is None:
+        return
+    in_request = has_request_context()
+    metrics.statements.observe(elapsed, 'request' if in_request else 'background')
+    if in_request:
+        timings = g.get('hms_timings')
+        if timings is not None:
+            timings.sql_count += 1
+            timings.sql_time += elapsed
+    if elapsed * 1000 >= metrics.app.config['SLOW_QUERY_MS']:
+        metrics.slow_statements.inc('request' if in_request else 'background')
+        slow_log.warning('slow query %.1f ms (%s): %s params=%s', elapsed * 1000,
+                         request.endpoint if in_request else 'background',
+                         ' '.join(statement.split()), redact(parameters))
+
+
+@event.listens_for(Engine, 'handle_error')
+def _statement_failed(context):
+    # A failed statement never reaches after_cursor_execute; drop its start time
+    conn = context.connection
+    started = conn.info.get('hms_statement_started') if conn is not None else None
+    if started and context.statement is not None:
+        started.pop()
+
+
+def _template_started(sender, template, context, **extra):
+    timings = g.get('hms_timings')
+    if timings is not None:
+        # Fragments rendered inside a page's render are already part of its time
+        if timings.template_depth == 0:
+            timings.template_started = time.perf_counter()
+        timings.template_depth += 1
+
+
+def _template_finished(sender, template, context, **extra):
+    timings = g.get('hms_timings')
+    if timings is not None and timings.template_depth:
+        timings.template_depth -= 1
+        if timings.template_depth == 0:
+            timings.template_time += time.perf_counter() - timings.template_started
+
+
+def init_app(app):
+    """Install the request hooks; register this before any other before_request hook."""
+    metrics = app.extensions['hms_metrics'] = Metrics(app)
+    before_render_template.connect(_template_started, app)
+    template_rendered.connect(_template_finished, app)
+
+    @app.before_request
+    def _start_timer():
+        g.hms_timings = RequestTimings()
+
+    @app.after_request
+    def _record_request(response):
+        timings = g.pop('hms_timings', None)
+        if timings is None:
+            return response
+        elapsed = time.perf_counter() - timings.started
+        endpoint = request.endpoint or 'none'
+        metrics.requests.observe(elapsed, request.method, endpoint, str(response.status_code))
+        metrics.request_sql_count.observe(timings.sql_count, endpoint)
+        metrics.request_sql_time.observe(timings.sql_time, endpoint)
+        metrics.request_template_time.observe(timings.template_time, endpoint)
+        response.headers['Server-Timing'] = (
+            f'app;dur={elapsed * 1000:.1f}, '
+            f'db;dur={timings.sql_time * 1000:.1f};desc="{timings.sql_count} queries", '
+            f'tpl;dur={timings.template_time * 1000:.1f}'
+        )
+        if elapsed * 1000 >= app.config['SLOW_REQUEST_MS']:
+            metrics.slow_requests.inc(endpoint)
+            slow_log.warning('slow request %.1f ms: %s %s (%s) -> %s, %d queries in %.1f ms, templates %.1f ms',
+                             elapsed * 1000, request.method, request.path, endpoint, response.status_code,
+                             timings.sql_count, timings.sql_time * 1000, timings.template_time * 1000)
+        return response
+
+    return metrics
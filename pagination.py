@@ -0,0 +1,179 @@
+# pagination.py
+# Keyset (cursor) pagination shared by the HMS list views.
+#
+# Pages are walked on (created_at, id) instead of OFFSET, so fetching page N costs
+# the same as fetching page 1: the database seeks straight to the cursor position
+# through the (hospital_id, created_at, id) index and reads per_page + 1 rows.
+# A cursor in the query string that does not decode is a 400, not the first page.
+
+import base64
+import json
+from datetime import datetime
+
+from flask import abort, current_app, request, url_for
+from sqlalchemy import tuple_
+
+# Sort orders the server accepts; anything else falls back to the default.
+# Only (created_at, id) orderings are offered because those are what the cursor encodes.
+SORT_ORDERS = {
+    'newest': True,   # descending
+    'oldest': False,  # ascending
+}
+DEFAULT_SORT = 'newest'
+
+
+class Page:
+    """One page of results plus the cursors needed to move off it."""
+
+    def __init__(self, items, per_page, sort, next_cursor=None, prev_cursor=None):
+        self.items = items
+        self.per_page = per_page
+        self.sort = sort
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    @property
+    def sort_options(self):
+        return list(SORT_ORDERS)
+
+    @property
+    def page_sizes(self):
+        return current_app.config['PAGE_SIZES']
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+    def url(self, cursor=None, **overrides):
+        """URL of the current endpoint with this page's size/sort and the given cursor."""
+        args = dict(request.view_args or {})
+        args.update(per_page=self.per_page, sort=self.sort)
+        if cursor:
+            args['cursor'] = cursor
+        args.update(overrides)
+        return url_for(request.endpoint, **args)
+
+    @property
+    def next_url(self):
+        return self.url(self.next_cursor) if self.next_cursor else None
+
+    @property
+    def prev_url(self):
+        return self.url(self.prev_cursor) if self.prev_cursor else None
+
+
+def encode_cursor(direction, row):
+    """Encode an opaque cursor pointing before ('prev') or after ('next') a row."""
+    payload = [direction, row.created_at.isoformat(), row.id]
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Return (direction, (created_at, id)) or (None, None) for a missing/garbled cursor."""
+    if not cursor:
+        return None, None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        direction, created_at, row_id = json.loads(base64.urlsafe_b64decode(padded))
+        if direction not in ('next', 'prev'):
+            return None, None
+        return direction, (datetime.fromisoformat(created_at), int(row_id))
+    except (ValueError, TypeError):
+        return None, None
+
+
+def page_size(value):
+    """Clamp a requested page size to one of the configured PAGE_SIZES."""
+    sizes = current_app.config['PAGE_SIZES']
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        return current_app.config['PAGE_SIZE_DEFAULT']
+    return value if value in sizes else current_app.config['PAGE_SIZE_DEFAULT']
+
+
+class KeysetPlan:
+    """How keyset_query() shaped a query, so keyset_page() can turn its rows into a Page."""
+
+    def __init__(self, per_page, sort, key, backwards):
+        self.per_page = per_page
+        self.sort = sort
+        self.key = key
+        self.backwards = backwards
+
+
+def keyset_query(query, model, cursor=None, per_page=None, sort=DEFAULT_SORT):
+    """Add the cursor filter, (created_at, id) ordering and limit to `query`.
+
+    Works on an ORM Query or a select(); returns (query, plan). `query` should
+    already be scoped to the tenant; `model` must have `created_at` and `id` columns.
+    """
+    if sort not in SORT_ORDERS:
+        sort = DEFAULT_SORT
+    per_page = per_page or current_app.config['PAGE_SIZE_DEFAULT']
+    descending = SORT_ORDERS[sort]
+    direction, key = decode_cursor(cursor)
+    backwards = direction == 'prev'
+
+    # Walking backwards means scanning in the opposite order and flipping the result.
+    scan_descending = descending != backwards
+    columns = tuple_(model.created_at, model.id)
+    if key is not None:
+        query = query.filter(columns < key if scan_descending else columns > key)
+    if scan_descending:
+        query = query.order_by(model.created_at.desc(), model.id.desc())
+    else:
+        query = query.order_by(model.created_at.asc(), model.id.asc())
+    return query.limit(per_page + 1), KeysetPlan(per_page, sort, key, backwards)
+
+
+def keyset_page(rows, plan):
+    """The Page for `rows` fetched with a query from keyset_query()."""
+    rows = list(rows)
+    has_more = len(rows) > plan.per_page
+    rows = rows[:plan.per_page]
+    if plan.backwards:
+        rows.reverse()
+
+    next_cursor = prev_cursor = None
+    if rows:
+        if plan.backwards:
+            next_cursor = encode_cursor('next', rows[-1])
+            prev_cursor = encode_cursor('prev', rows[0]) if has_more else None
+        else:
+            next_cursor = encode_cursor('next', rows[-1]) if has_more else None
+            prev_cursor = encode_cursor('prev', rows[0]) if plan.key is not None else None
+    return Page(rows, plan.per_page, plan.sort, next_cursor, prev_cursor)
+
+
+def keyset_paginate(query, model, cursor=None, per_page=None, sort=DEFAULT_SORT):
+    """Return a Page of the ORM `query` ordered by (created_at, id) starting at `cursor`."""
+    query, plan = keyset_query(query, model, cursor, per_page, sort)
+    return keyset_page(query.all(), plan)
+
+
+def request_page_args():
+    """cursor/per_page/sort keyword arguments from the query string."""
+    cursor = request.args.get('cursor')
+    if cursor and decode_cursor(cursor) == (None, None):
+        abort(400, description='invalid cursor')
+    return dict(
+        cursor=cursor,
+        per_page=page_size(request.args.get('per_page')),
+        sort=request.args.get('sort', DEFAULT_SORT),
+    )
+
+
+def paginate_request(query, model):
+    """keyset_paginate() driven by the cursor/per_page/sort query-string arguments."""
+    return keyset_paginate(query, model, **request_page_args())
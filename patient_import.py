@@ -0,0 +1,253 @@
+# patient_import.py
+# Bulk patient import (CSV / JSON Lines) for onboarding hospitals.
+#
+# Files are parsed lazily row by row, validated against the Patient schema and
+# inserted in batches with a single executemany per batch, committing after each
+# batch. A row that fails validation, or a batch the database rejects, never
+# aborts the run: bad rows are reported with their line number and skipped. A
+# file that cannot be decoded or parsed (not UTF-8, broken CSV quoting) stops
+# the run at that point; the rows before it are still imported.
+#
+#   flask --app app hms import-patients patients.csv --hospital-id <id>
+#   POST /patients/import  (multipart field "file")
+
+import csv
+import io
+import json
+import time
+from datetime import datetime
+
+import click
+from flask import Blueprint, current_app, flash, g, redirect, request, url_for
+from sqlalchemy.exc import DBAPIError
+
+from app import Hospital, Patient, bump_hospital_stats, db, hms_cli, login_required
+from reports import bump_registrations
+
+import_bp = Blueprint('patient_import', __name__)
+
+REQUIRED_FIELDS = ('first_name', 'last_name', 'email', 'phone', 'date_of_birth')
+OPTIONAL_FIELDS = ('gender', 'blood_group', 'address')
+# Column aliases accepted in input files (the add_patient form calls it "dob")
+FIELD_ALIASES = {'dob': 'date_of_birth'}
+GENDERS = ('Male', 'Female', 'Other')
+BLOOD_GROUPS = ('O+', 'O-', 'A+', 'A-', 'B+', 'B-', 'AB+', 'AB-')
+DATE_FORMAT = '%Y-%m-%d'
+# Errors kept in the report; the failure count is always exact
+MAX_REPORTED_ERRORS = 100
+# Errors shown after an upload, and their length: flashed messages live in the
+# session cookie, which browsers cap at about 4 KB
+MAX_FLASHED_ERRORS = 5
+MAX_FLASHED_LENGTH = 200
+
+
+class ImportReport:
+    """Outcome of an import run."""
+
+    def __init__(self):
+        self.inserted = 0
+        self.failed = 0
+        self.errors = []  # (line, message)
+        self.unreadable = None  # why the file could not be read to the end
+        self.started = time.perf_counter()
+
+    def fail(self, line, message):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line, message))
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    @property
+    def rows_per_second(self):
+        return self.inserted / self.elapsed if self.elapsed else 0.0
+
+
+# ----------------------------------------------------
+# Parsing
+# ----------------------------------------------------
+
+def iter_csv(stream):
+    """Yield (line_number, row_dict) from a CSV text stream with a header row."""
+    reader = csv.DictReader(stream)
+    for row in reader:
+        yield reader.line_num, row
+
+
+def iter_jsonl(stream):
+    """Yield (line_number, row_dict) from a JSON Lines text stream."""
+    for line_number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield line_number, ValueError(f'invalid JSON: {e}')
+            continue
+        yield line_number, row if isinstance(row, dict) else ValueError('expected a JSON object')
+
+
+PARSERS = {'csv': iter_csv, 'jsonl': iter_jsonl, 'ndjson': iter_jsonl}
+
+
+def detect_format(filename, default='csv'):
+    extension = filename.rsplit('.', 1)[-1].lower() if filename and '.' in filename else ''
+    return extension if extension in PARSERS else default
+
+
+# ----------------------------------------------------
+# Validation
+# ----------------------------------------------------
+
+_COLUMN_LENGTHS = {
+    column.name: column.type.length
+    for column in Patient.__table__.columns
+    if getattr(column.type, 'length', None)
+}
+
+
+def validate_patient(raw):
+    """Return (values, None) for a valid row or (None, error_message)."""
+    row = {}
+    for key, value in raw.items():
+        if key is None:
+            return None, 'more values than header columns'
+        key = FIELD_ALIASES.get(key.strip(), key.strip())
+        row[key] = value.strip() if isinstance(value, str) else value
+
+    missing = [field for field in REQUIRED_FIELDS if not row.get(field)]
+    if missing:
+        return None, f"missing required field(s): {', '.join(missing)}"
+
+    values = {field: row.get(field) or None for field in REQUIRED_FIELDS + OPTIONAL_FIELDS}
+    for field, value in values.items():
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            value = values[field] = str(value)  # e.g. phone numbers in JSON
+        elif value is not None and not isinstance(value, str):
+            return None, f'{field} must be a string'
+        limit = _COLUMN_LENGTHS.get(field)
+        if value and limit and len(value) > limit:
+            return None, f'{field} longer than {limit} characters'
+    try:
+        values['date_of_birth'] = datetime.strptime(values['date_of_birth'], DATE_FORMAT).date()
+    except ValueError:
+        return None, 'date_of_birth must be YYYY-MM-DD'
+    if values['gender'] and values['gender'] not in GENDERS:
+        return None, f"gender must be one of {', '.join(GENDERS)}"
+    if values['blood_group'] and values['blood_group'] not in BLOOD_GROUPS:
+        return None, f"blood_group must be one of {', '.join(BLOOD_GROUPS)}"
+    return values, None
+
+
+# ----------------------------------------------------
+# Loading
+# ----------------------------------------------------
+
+def _insert_batch(hospital_id, batch, report):
+    """Insert one batch in its own transaction; on failure retry row by row."""
+    table = Patient.__table__
+    rows = [values for _, values in batch]
+    try:
+        db.session.execute(table.insert(), rows)
+        bump_hospital_stats(db.session.connection(), hospital_id, patients=len(rows))
+        bump_registrations(db.session.connection(), hospital_id, datetime.now().date(), len(rows))
+        db.session.commit()
+        report.inserted += len(rows)
+        return
+    except DBAPIError:
+        db.session.rollback()
+    # Isolate the offending rows so the rest of the batch still lands
+    for line, values in batch:
+        try:
+            db.session.execute(table.insert(), [values])
+            bump_hospital_stats(db.session.connection(), hospital_id, patients=1)
+            bump_registrations(db.session.connection(), hospital_id, datetime.now().date())
+            db.session.commit()
+            report.inserted += 1
+        except DBAPIError as e:
+            db.session.rollback()
+            report.fail(line, f'database rejected row: {e.orig}')
+
+
+def import_patients(rows, hospital_id, batch_size=None):
+    """Validate and insert (line_number, row_dict) pairs for one hospital."""
+    batch_size = batch_size or current_app.config['IMPORT_BATCH_SIZE']
+    report = ImportReport()
+    batch = []
+    try:
+        for line, raw in rows:
+            if isinstance(raw, Exception):
+                report.fail(line, str(raw))
+                continue
+            values, error = validate_patient(raw)
+            if error:
+                report.fail(line, error)
+                continue
+            values['hospital_id'] = hospital_id
+            batch.append((line, values))
+            if len(batch) >= batch_size:
+                _insert_batch(hospital_id, batch, report)
+                batch = []
+    except (UnicodeDecodeError, csv.Error) as e:
+        report.unreadable = str(e)
+    if batch:
+        _insert_batch(hospital_id, batch, report)
+    return report
+
+
+# ----------------------------------------------------
+# Entry points
+# ----------------------------------------------------
+
+def _shorten(message):
+    return message if len(message) <= MAX_FLASHED_LENGTH else message[:MAX_FLASHED_LENGTH - 3] + '...'
+
+
+@import_bp.route('/patients/import', methods=['POST'])
+@login_required
+def upload_patients():
+    """Import an uploaded CSV/JSONL file into the current hospital."""
+    upload = request.files.get('file')
+    if upload is None or not upload.filename:
+        flash('Choose a CSV or JSONL file to import.', 'error')
+        return redirect(url_for('patients'))
+    file_format = detect_format(upload.filename, request.form.get('format', 'csv'))
+    stream = io.TextIOWrapper(upload.stream, encoding='utf-8-sig', newline='')
+    report = import_patients(PARSERS[file_format](stream), g.hospital_id)
+    if report.unreadable:
+        flash(f'The file could not be read ({_shorten(report.unreadable)}). '
+              'Upload a UTF-8 encoded CSV or JSON Lines file.', 'error')
+    if report.inserted or report.failed or not report.unreadable:
+        flash(f'Imported {report.inserted} patient(s); {report.failed} row(s) failed.',
+              'success' if not report.failed else 'warning')
+    for line, message in report.errors[:MAX_FLASHED_ERRORS]:
+        flash(f'Line {line}: {_shorten(message)}', 'error')
+    if report.failed > MAX_FLASHED_ERRORS:
+        flash(f'... and {report.failed - MAX_FLASHED_ERRORS} more row error(s).', 'error')
+    return redirect(url_for('patients'))
+
+
+@hms_cli.command('import-patients')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--hospital-id', required=True, help='Tenant to import into.')
+@click.option('--format', 'file_format', type=click.Choice(sorted(PARSERS)), default=None,
+              help='Input format (default: from the file extension).')
+@click.option('--batch-size', type=int, default=None, help='Rows per INSERT batch.')
+def import_patients_command(path, hospital_id, file_format, batch_size):
+    """Bulk-import patients from a CSV or JSONL file."""
+    if db.session.get(Hospital, hospital_id) is None:
+        raise click.BadParameter(f'no hospital {hospital_id}', param_hint='--hospital-id')
+    from tenants import tenant_shard
+    file_format = file_format or detect_format(path)
+    with open(path, encoding='utf-8-sig', newline='') as stream, tenant_shard(hospital_id):
+        report = import_patients(PARSERS[file_format](stream), hospital_id, batch_size)
+    for line, message in report.errors:
+        click.echo(f'line {line}: {message}', err=True)
+    if report.unreadable:
+        click.echo(f'stopped: the file could not be read ({report.unreadable})', err=True)
+    if report.failed > len(report.errors):
+        click.echo(f'... and {report.failed - len(report.errors)} more', err=True)
+    click.echo(f'Inserted {report.inserted} row(s), {report.failed} failed, '
+               f'{report.elapsed:.1f}s ({report.rows_per_second:,.0f} rows/s).')
@@ -0,0 +1,242 @@
+# replicas.py
+# Read-replica routing for the read-only pages and API calls.
+#
+# REPLICA_URLS lists read-only copies of the primary database (streaming
+# replicas). GET/HEAD requests to views decorated with @replica_reads run their
+# queries on a healthy replica, round robin; every other request, and every
+# write, goes to the primary:
+#
+# - Once a request writes (a flush or a Core INSERT/UPDATE/DELETE), its session
+#   reads from the primary for the rest of the request.
+# - After a request that wrote, the same browser session reads from the primary
+#   for REPLICA_STICKY_SECONDS, so the page a form redirects to shows the new row
+#   even while the replicas catch up.
+# - A replica is checked at most every REPLICA_CHECK_SECONDS, when a request
+#   wants one. A failed connection, or (PostgreSQL) replay lag above
+#   REPLICA_MAX_LAG_SECONDS, takes it out of rotation until a later check passes.
+#   A replica that fails during a request is marked down and the view is run
+#   again on the primary.
+#
+# With no REPLICA_URLS everything runs on the primary, as before. Replica pool
+# and health counters are in /admin/pool.
+
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import current_app, g, has_request_context, request, session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.exc import InterfaceError, OperationalError
+from sqlalchemy.sql.dml import UpdateBase
+
+from db_pool import engine_options, pool_status
+
+CONNECT_TIMEOUT_SECONDS = 3  # health checks run inside a request, so give up on a dead host quickly
+
+_POSTGRES_LAG = text(
+    'SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 '
+    'ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END'
+)
+
+
+def replica_url(url):
+    """`url` as configured, with the postgres:// scheme fixed like the primary's."""
+    if url.startswith('postgres://'):
+        return url.replace('postgres://', 'postgresql://', 1)
+    return url
+
+
+class Replica:
+    """One read replica: its engine and last known health."""
+
+    def __init__(self, name, url, engine):
+        self.name = name
+        self.url = url
+        self.engine = engine
+        self.healthy = True
+        self.checked_at = 0.0
+        self.lag = None
+        self.error = None
+        self.reads = 0
+        self.failures = 0
+        self.watch(engine)
+
+    def watch(self, engine):
+        """Flag the current request when `engine` (this replica's) loses its connection."""
+        @event.listens_for(engine, 'handle_error')
+        def _failed(context):
+            # Connection-level failures only; a bad query is the view's problem, not the replica's
+            if not (context.is_disconnect or isinstance(context.sqlalchemy_exception, (OperationalError, InterfaceError))):
+                return
+            if has_request_context() and g.get('hms_replica') is self:
+                g.hms_replica_failed = True
+
+    def check(self, max_lag):
+        """Connect, measure replay lag where the database reports it, and update `healthy`."""
+        try:
+            with self.engine.connect() as connection:
+                if connection.dialect.name == 'postgresql':
+                    self.lag = float(connection.execute(_POSTGRES_LAG).scalar() or 0)
+                else:
+                    connection.execute(text('SELECT 1'))
+                    self.lag = None
+        except Exception as e:
+            self.mark_down(e)
+            return
+        self.healthy = self.lag is None or self.lag <= max_lag
+        self.error = None if self.healthy else f'replication lag {self.lag:.1f}s'
+        self.checked_at = time.monotonic()
+
+    def mark_down(self, error):
+        self.healthy = False
+        self.failures += 1
+        self.error = str(error).splitlines()[0] if str(error) else type(error).__name__
+        self.checked_at = time.monotonic()
+
+    def status(self):
+        return dict(
+            name=self.name,
+            healthy=self.healthy,
+            lag_seconds=self.lag,
+            error=self.error,
+            reads=self.reads,
+            failures=self.failures,
+            pool=pool_status(self.engine),
+        )
+
+
+class ReplicaSet:
+    """The configured replicas of an app, with round-robin selection over the healthy ones."""
+
+    def __init__(self, app):
+        self.check_interval = app.config['REPLICA_CHECK_SECONDS']
+        self.max_lag = app.config['REPLICA_MAX_LAG_SECONDS']
+        self.replicas = []
+        for index, url in enumerate(app.config['REPLICA_URLS']):
+            url = replica_url(url)
+            options = engine_options(url)
+            if url.startswith('postgresql'):
+                options.setdefault('connect_args', {})['connect_timeout'] = CONNECT_TIMEOUT_SECONDS
+            self.replicas.append(Replica(f'replica{index}', url, create_engine(url, **options)))
+        self._turn = itertools.count()
+        self._lock = threading.Lock()
+
+    def __bool__(self):
+        return bool(self.replicas)
+
+    def _refresh(self):
+        # One thread re-checks stale replicas; the others go on with the last known state
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            now = time.monotonic()
+            for replica in self.replicas:
+                if now - replica.checked_at >= self.check_interval:
+                    replica.check(self.max_lag)
+        finally:
+            self._lock.release()
+
+    def choose(self):
+        """A healthy replica, or None to use the primary."""
+        if not self.replicas:
+            return None
+        self._refresh()
+        healthy = [replica for replica in self.replicas if replica.healthy]
+        if not healthy:
+            return None
+        replica = healthy[next(self._turn) % len(healthy)]
+        replica.reads += 1
+        return replica
+
+    def status(self):
+        return [replica.status() for replica in self.replicas]
+
+    def dispose(self):
+        for replica in self.replicas:
+            replica.engine.dispose()
+
+
+# ----------------------------------------------------
+# Routing
+# ----------------------------------------------------
+
+class RoutingSession(Session):
+    """Flask-SQLAlchemy session that reads from the request's replica until it writes."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if self._flushing or isinstance(clause, UpdateBase):
+            self.info['hms_primary'] = True
+            if has_request_context():
+                g.hms_wrote = True
+        elif bind is None and not self.info.get('hms_primary') and has_request_context():
+            replica = g.get('hms_replica')
+            if replica is not None:
+                return replica.engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def pinned_to_primary():
+    """True while the current browser session should read its own recent writes."""
+    return session.get('hms_primary_until', 0) > time.time()
+
+
+def wants_replica():
+    """True if the current request may read from a replica."""
+    # Replicas copy the primary, so they only serve tenants of the default shard (see shards.py)
+    return bool(current_app.extensions['hms_replicas']) and request.method in ('GET', 'HEAD') \
+        and g.get('hms_shard_engine') is None and not pinned_to_primary()
+
+
+def choose_replica():
+    """The replica for the current request's reads, or None for the primary."""
+    return current_app.extensions['hms_replicas'].choose() if wants_replica() else None
+
+
+@contextmanager
+def primary_reads():
+    """Read from the primary inside the block, e.g. for results other requests will reuse."""
+    replica = g.pop('hms_replica', None) if has_request_context() else None
+    try:
+        yield
+    finally:
+        if replica is not None:
+            g.hms_replica = replica
+
+
+def replica_reads(f):
+    """Run a read-only view on a replica, falling back to the primary if the replica fails."""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        replica = choose_replica()
+        if replica is None:
+            return f(*args, **kwargs)
+        g.hms_replica = replica
+        try:
+            return f(*args, **kwargs)
+        except Exception as e:
+            if not g.pop('hms_replica_failed', False):
+                raise
+            replica.mark_down(e)
+            current_app.extensions['sqlalchemy'].session.rollback()
+            g.hms_replica = None
+            return f(*args, **kwargs)
+        finally:
+            g.pop('hms_replica', None)
+    return decorated_function
+
+
+def init_app(app):
+    """Create the replica engines and the read-your-writes hook."""
+    replicas = app.extensions['hms_replicas'] = ReplicaSet(app)
+    sticky = app.config['REPLICA_STICKY_SECONDS']
+
+    @app.after_request
+    def _pin_after_write(response):
+        if replicas and sticky and g.pop('hms_wrote', False) and session.get('user_id') is not None:
+            session['hms_primary_until'] = time.time() + sticky
+        return response
+
+    return replicas
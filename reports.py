@@ -0,0 +1,418 @@
+# reports.py
+# Hospital reports from daily rollup tables.
+#
+# appointment_daily counts appointments per (day, doctor, status) and
+# patient_daily counts registrations per day. Both are kept current on write:
+# ORM inserts, updates and deletes of Appointment and Patient bump the matching
+# rollup row in the same transaction, and bulk paths (patient imports, the
+# benchmark dataset) bump them explicitly. Writes that bypass both (raw SQL,
+# restores) are corrected by `flask hms rebuild-rollups`, which recomputes a
+# window of days from the source tables; run it nightly, e.g. with --days 7.
+#
+# The report pages read only the rollups (plus the small doctors and departments
+# tables for names), so a year of reports costs a few hundred rows whatever the
+# size of the appointments table. Weekly figures are summed from the daily rows.
+#
+#   GET /reports?report=cancellation-rate&start=2026-01-01&end=2026-03-31
+#   GET /reports/department-load.csv?start=2026-01-01
+#   flask --app app hms rebuild-rollups --days 7
+
+from datetime import date, datetime, timedelta
+
+import click
+from flask import Blueprint, Response, abort, current_app, g, request, url_for
+from sqlalchemy import Date, case, cast, delete, event, func, insert, inspect, literal, select, update
+
+from app import APPOINTMENT_STATUSES, Appointment, Department, Doctor, Patient, db, hms_cli, login_required, render_page
+from exports import encode_csv
+from replicas import replica_reads
+
+reports_bp = Blueprint('reports', __name__)
+
+
+# ----------------------------------------------------
+# Rollup tables
+# ----------------------------------------------------
+
+# Appointments per hospital, day (of appointment_date), doctor and status
+class AppointmentDaily(db.Model):
+    __tablename__ = 'appointment_daily'
+    id = db.Column(db.Integer, primary_key=True)
+    hospital_id = db.Column(db.String(36), db.ForeignKey('hospitals.id'), nullable=False)
+    day = db.Column(db.Date, nullable=False)
+    doctor_id = db.Column(db.Integer, nullable=False)
+    status = db.Column(db.String(20), nullable=False)
+    appointments = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        db.Index('uq_appointment_daily_key', 'hospital_id', 'day', 'doctor_id', 'status', unique=True),
+    )
+
+    def __repr__(self):
+        return f'<AppointmentDaily {self.day} {self.doctor_id} {self.status}>'
+
+# Patient registrations per hospital and day (of created_at)
+class PatientDaily(db.Model):
+    __tablename__ = 'patient_daily'
+    id = db.Column(db.Integer, primary_key=True)
+    hospital_id = db.Column(db.String(36), db.ForeignKey('hospitals.id'), nullable=False)
+    day = db.Column(db.Date, nullable=False)
+    registrations = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        db.Index('uq_patient_daily_key', 'hospital_id', 'day', unique=True),
+    )
+
+    def __repr__(self):
+        return f'<PatientDaily {self.day}>'
+
+
+def bump_rollup(connection, model, key, column, delta):
+    """Add `delta` to `column` of the rollup row identified by `key` (its unique columns), creating it."""
+    if not delta:
+        return
+    table = model.__table__
+    if connection.dialect.name in ('sqlite', 'postgresql'):
+        if connection.dialect.name == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert as upsert
+        else:
+            from sqlalchemy.dialects.postgresql import insert as upsert
+        connection.execute(upsert(table).values(**key, **{column: delta}).on_conflict_do_update(
+            index_elements=list(key), set_={column: table.c[column] + delta}
+        ))
+        return
+    matched = connection.execute(
+        update(table).where(*[table.c[name] == value for name, value in key.items()])
+        .values({column: table.c[column] + delta})
+    ).rowcount
+    if not matched:
+        connection.execute(insert(table).values(**key, **{column: delta}))
+
+
+def _appointment_key(hospital_id, appointment_date, doctor_id, status):
+    # Form values arrive as strings; the rollup key must not depend on that
+    return dict(hospital_id=hospital_id, day=appointment_date.date(), doctor_id=int(doctor_id),
+                status=status or 'SCHEDULED')
+
+
+def bump_appointments(connection, hospital_id, appointment_date, doctor_id, status, delta=1):
+    bump_rollup(connection, AppointmentDaily, _appointment_key(hospital_id, appointment_date, doctor_id, status),
+                'appointments', delta)
+
+
+def bump_registrations(connection, hospital_id, day, delta=1):
+    bump_rollup(connection, PatientDaily, dict(hospital_id=hospital_id, day=day), 'registrations', delta)
+
+
+_ROLLUP_COLUMNS = ('appointment_date', 'doctor_id', 'status')
+
+def _keep_old_value(target, value, oldvalue, initiator):
+    pass
+
+# active_history loads the old value of an expired attribute before it is
+# replaced, so _appointment_moved() can take it out of the old rollup row
+for _name in _ROLLUP_COLUMNS:
+    event.listen(getattr(Appointment, _name), 'set', _keep_old_value, active_history=True)
+
+def _appointment_listener(delta):
+    def listener(mapper, connection, target):
+        bump_appointments(connection, target.hospital_id, target.appointment_date, target.doctor_id,
+                          target.status, delta)
+    return listener
+
+@event.listens_for(Appointment, 'after_update')
+def _appointment_moved(mapper, connection, target):
+    state = inspect(target)
+    histories = {name: state.attrs[name].history for name in _ROLLUP_COLUMNS}
+    if not any(history.has_changes() for history in histories.values()):
+        return
+    old = {name: history.deleted[0] if history.deleted else getattr(target, name)
+           for name, history in histories.items()}
+    bump_appointments(connection, target.hospital_id, old['appointment_date'], old['doctor_id'], old['status'], -1)
+    bump_appointments(connection, target.hospital_id, target.appointment_date, target.doctor_id, target.status, 1)
+
+def _patient_listener(delta):
+    def listener(mapper, connection, target):
+        bump_registrations(connection, target.hospital_id, (target.created_at or datetime.now()).date(), delta)
+    return listener
+
+event.listen(Appointment, 'after_insert', _appointment_listener(1))
+event.listen(Appointment, 'after_delete', _appointment_listener(-1))
+event.listen(Patient, 'after_insert', _patient_listener(1))
+event.listen(Patient, 'after_delete', _patient_listener(-1))
+
+
+def _day(connection, column):
+    """SQL expression for the calendar day of a DATETIME column."""
+    if connection.dialect.name == 'sqlite':
+        return func.date(column)  # CAST(... AS DATE) would keep only the year on SQLite
+    return cast(column, Date)
+
+
+def rebuild_rollups(connection, hospital_id, since=None):
+    """Recompute a hospital's rollup rows from `since` (a date; None for all days) on `connection`."""
+    appointment_day = _day(connection, Appointment.appointment_date)
+    patient_day = _day(connection, Patient.created_at)
+    status = func.coalesce(Appointment.status, 'SCHEDULED')
+    rollups = (
+        (AppointmentDaily, ('day', 'doctor_id', 'status', 'appointments'), Appointment.appointment_date,
+         select(literal(hospital_id), appointment_day, Appointment.doctor_id, status, func.count())
+         .where(Appointment.hospital_id == hospital_id)
+         .group_by(appointment_day, Appointment.doctor_id, status)),
+        (PatientDaily, ('day', 'registrations'), Patient.created_at,
+         select(literal(hospital_id), patient_day, func.count())
+         .where(Patient.hospital_id == hospital_id).group_by(patient_day)),
+    )
+    for rollup, columns, source_column, grouped in rollups:
+        table = rollup.__table__
+        stale = delete(table).where(table.c.hospital_id == hospital_id)
+        if since is not None:
+            stale = stale.where(table.c.day >= since)
+            # Compare the raw DATETIME so the source's (hospital_id, date) index applies
+            grouped = grouped.where(source_column >= datetime.combine(since, datetime.min.time()))
+        connection.execute(stale)
+        connection.execute(insert(table).from_select(['hospital_id', *columns], grouped))
+
+
+@hms_cli.command('rebuild-rollups')
+@click.option('--hospital-id', default=None, help='Only rebuild this hospital.')
+@click.option('--days', type=int, default=None, help='Only the last N days (default: all history).')
+def rebuild_rollups_command(hospital_id, days):
+    """Recompute the report rollups from the appointments and patients tables."""
+    from shards import shard_context
+    from tenants import hospitals_by_shard
+    since = date.today() - timedelta(days=days - 1) if days else None
+    total = 0
+    for shard, hospital_ids in hospitals_by_shard(hospital_id).items():
+        with shard_context(shard):
+            for ident in hospital_ids:
+                rebuild_rollups(db.session.connection(), ident, since)
+                db.session.commit()
+        total += len(hospital_ids)
+    click.echo(f"Rebuilt rollups for {total} hospital(s){f' from {since}' if since else ''}.")
+
+
+# ----------------------------------------------------
+# Reports
+# ----------------------------------------------------
+# Each report takes (hospital_id, start, end), both days inclusive, and returns
+# (column names, rows).
+
+REPORTS = {}
+
+
+def report(name, title):
+    def decorator(f):
+        REPORTS[name] = (title, f)
+        return f
+    return decorator
+
+
+def _status_totals():
+    """One SUM of AppointmentDaily.appointments per status, in APPOINTMENT_STATUSES order."""
+    return [func.sum(case((AppointmentDaily.status == status, AppointmentDaily.appointments), else_=0))
+            for status in APPOINTMENT_STATUSES]
+
+
+def _in_range(model, hospital_id, start, end):
+    return (model.hospital_id == hospital_id, model.day >= start, model.day <= end)
+
+
+def _week(day):
+    return day - timedelta(days=day.weekday())
+
+
+def _status_columns():
+    return [status.replace('_', ' ').title() for status in APPOINTMENT_STATUSES]
+
+
+@report('appointments-per-doctor', 'Appointments per doctor per day')
+def appointments_per_doctor(hospital_id, start, end):
+    rows = db.session.execute(
+        select(AppointmentDaily.day, Doctor.first_name, Doctor.last_name, *_status_totals(),
+               func.sum(AppointmentDaily.appointments))
+        .join(Doctor, Doctor.id == AppointmentDaily.doctor_id)
+        .where(*_in_range(AppointmentDaily, hospital_id, start, end))
+        .group_by(AppointmentDaily.day, AppointmentDaily.doctor_id, Doctor.first_name, Doctor.last_name)
+        .order_by(AppointmentDaily.day, Doctor.last_name, Doctor.first_name)
+    )
+    return (['Day', 'Doctor', *_status_columns(), 'Total'],
+            [(day, f'Dr. {first} {last}', *counts) for day, first, last, *counts in rows])
+
+
+@report('registrations-per-week', 'Patient registrations per week')
+def registrations_per_week(hospital_id, start, end):
+    weeks = {}
+    for day, registrations in db.session.execute(
+        select(PatientDaily.day, PatientDaily.registrations).where(*_in_range(PatientDaily, hospital_id, start, end))
+    ):
+        weeks[_week(day)] = weeks.get(_week(day), 0) + registrations
+    return ['Week of', 'Registrations'], sorted(weeks.items())
+
+
+@report('cancellation-rate', 'Cancellation rate per week')
+def cancellation_rate(hospital_id, start, end):
+    weeks = {}
+    for day, cancelled, total in db.session.execute(
+        select(AppointmentDaily.day,
+               func.sum(case((AppointmentDaily.status == 'CANCELLED', AppointmentDaily.appointments), else_=0)),
+               func.sum(AppointmentDaily.appointments))
+        .where(*_in_range(AppointmentDaily, hospital_id, start, end))
+        .group_by(AppointmentDaily.day)
+    ):
+        week = weeks.setdefault(_week(day), [0, 0])
+        week[0] += cancelled
+        week[1] += total
+    return (['Week of', 'Appointments', 'Cancelled', 'Cancellation rate %'],
+            [(week, total, cancelled, round(100 * cancelled / total, 1) if total else 0.0)
+             for week, (cancelled, total) in sorted(weeks.items())])
+
+
+@report('department-load', 'Department load')
+def department_load(hospital_id, start, end):
+    # Departments of the doctors as they are now
+    rows = db.session.execute(
+        select(Department.name, func.count(func.distinct(AppointmentDaily.doctor_id)), *_status_totals(),
+               func.sum(AppointmentDaily.appointments))
+        .select_from(AppointmentDaily)
+        .join(Doctor, Doctor.id == AppointmentDaily.doctor_id)
+        .outerjoin(Department, Department.id == Doctor.department_id)
+        .where(*_in_range(AppointmentDaily, hospital_id, start, end))
+        .group_by(Department.id, Department.name)
+        .order_by(func.sum(AppointmentDaily.appointments).desc())
+    )
+    return (['Department', 'Doctors', *_status_columns(), 'Total'],
+            [(name or 'No department', *counts) for name, *counts in rows])
+
+
+def report_range():
+    """(start, end) days from ?start= and ?end=; the last 30 days by default."""
+    try:
+        end = date.fromisoformat(request.args['end']) if request.args.get('end') else date.today()
+        start = date.fromisoformat(request.args['start']) if request.args.get('start') else end - timedelta(days=29)
+    except ValueError:
+        abort(400, description='start and end must be dates (YYYY-MM-DD)')
+    max_days = current_app.config['REPORT_MAX_DAYS']
+    if start > end or (end - start).days >= max_days:
+        abort(400, description=f'start must not be after end, and the range at most {max_days} days')
+    return start, end
+
+
+# ----------------------------------------------------
+# Views
+# ----------------------------------------------------
+
+REPORTS_HTML = r"""
+<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <title>Reports - HMS</title>
+    <link href="https://cdn.jsdelivr.net/npm/bootstrap@5.3.3/dist/css/bootstrap.min.css" rel="stylesheet">
+    <link rel="stylesheet" href="https://cdn.jsdelivr.net/npm/bootstrap-icons@1.10.0/font/bootstrap-icons.css">
+    <style>
+        body { background-color: #f5f5f5; }
+        .navbar { background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); }
+        .navbar a { color: white !important; }
+        .btn-back { color: white; text-decoration: none; }
+    </style>
+</head>
+<body>
+    <nav class="navbar navbar-dark">
+        <div class="container-fluid">
+            <span class="navbar-brand"><a href="{{ url_for('dashboard') }}" class="btn-back"><i class="bi bi-arrow-left"></i> Back to Dashboard</a></span>
+            <span style="color: white;">Welcome, {{ user_name }}</span>
+        </div>
+    </nav>
+    <div class="container mt-5">
+        <h2>📊 {{ title }}</h2>
+
+        <form method="GET" class="row g-2 align-items-end mt-3">
+            <div class="col-md-4">
+                <label class="form-label">Report</label>
+                <select class="form-select" name="report">
+                    {% for name, (label, _) in reports.items() %}
+                        <option value="{{ name }}" {{ 'selected' if name == report }}>{{ label }}</option>
+                    {% endfor %}
+                </select>
+            </div>
+            <div class="col-md-3">
+                <label class="form-label">From</label>
+                <input type="date" class="form-control" name="start" value="{{ start.isoformat() }}">
+            </div>
+            <div class="col-md-3">
+                <label class="form-label">To</label>
+                <input type="date" class="form-control" name="end" value="{{ end.isoformat() }}">
+            </div>
+            <div class="col-md-2 text-end">
+                <button type="submit" class="btn btn-primary">Show</button>
+                <a class="btn btn-outline-secondary" href="{{ csv_url }}"><i class="bi bi-download"></i> CSV</a>
+            </div>
+        </form>
+
+        <div class="card mt-3">
+            <div class="card-body">
+                {% if rows %}
+                    <table class="table table-striped table-hover mb-0">
+                        <thead class="table-dark">
+                            <tr>{% for column in columns %}<th>{{ column }}</th>{% endfor %}</tr>
+                        </thead>
+                        <tbody>
+                            {% for row in rows %}
+                            <tr>{% for value in row %}<td>{{ value }}</td>{% endfor %}</tr>
+                            {% endfor %}
+                        </tbody>
+                    </table>
+                {% else %}
+                    <div class="alert alert-info mb-0">No data in this period.</div>
+                {% endif %}
+            </div>
+        </div>
+    </div>
+</body>
+</html>
+"""
+
+
+@reports_bp.record_once
+def _register_templates(state):
+    state.app.extensions['hms_templates'].register('reports.html', REPORTS_HTML)
+
+
+def _run_report(name):
+    if name not in REPORTS:
+        abort(404)
+    start, end = report_range()
+    columns, rows = REPORTS[name][1](g.hospital_id, start, end)
+    return start, end, columns, rows
+
+
+@reports_bp.route('/reports')
+@login_required
+@replica_reads
+def reports():
+    """One report over a date range, as a table."""
+    name = request.args.get('report', next(iter(REPORTS)))
+    start, end, columns, rows = _run_report(name)
+    return render_page('reports.html',
+        user_name=g.user.name,
+        title=REPORTS[name][0],
+        reports=REPORTS,
+        report=name,
+        start=start,
+        end=end,
+        columns=columns,
+        rows=rows,
+        csv_url=url_for('reports.report_csv', name=name, start=start.isoformat(), end=end.isoformat())
+    )
+
+
+@reports_bp.route('/reports/<name>.csv')
+@login_required
+@replica_reads
+def report_csv(name):
+    """Download one report over a date range as CSV."""
+    start, end, columns, rows = _run_report(name)
+    filename = f'{name}-{start.isoformat()}-{end.isoformat()}.csv'
+    return Response(b''.join(encode_csv(columns, rows)), mimetype='text/csv',
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
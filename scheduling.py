@@ -0,0 +1,308 @@
+# scheduling.py
+# Doctor working hours, free-slot search and conflict-free booking.
+#
+# Each doctor has weekly working-hour templates (DoctorSchedule rows) that cut a day
+# into fixed-length slots. Free slots are computed by expanding the templates over a
+# date window and subtracting the live appointments in that window, which are read
+# through the (hospital_id, doctor_id, appointment_date) index. The cost therefore
+# depends on the size of the window, not on appointment history.
+#
+# Double booking is prevented by the partial unique index uq_appointments_doctor_slot
+# on appointments (doctor_id, appointment_date) for non-cancelled rows. That is only
+# enough if two bookings that overlap always share a start time, so:
+# - every booking must start on one of the doctor's slot boundaries. Doctors without
+#   working hours get the default ones (SCHEDULING_DEFAULT_*), for booking and for
+#   the free-slot search alike;
+# - a doctor's templates may not overlap on a weekday, and new hours are refused while
+#   future bookings exist that would not start on a slot of the new grid.
+#
+#   GET  /scheduling/slots?doctor_id=3&start=2026-01-05&limit=10
+#   GET  /scheduling/slots?department_id=2&start=2026-01-05&end=2026-01-12
+#   GET  /doctors/<id>/hours
+#   PUT  /doctors/<id>/hours   [{"weekday": 0, "start": "09:00", "end": "17:00", "slot_minutes": 30}, ...]
+#   flask --app app hms set-hours <doctor_id> --weekdays 0-4 --start 09:00 --end 17:00
+
+from datetime import datetime, timedelta
+
+import click
+from flask import Blueprint, abort, current_app, g, jsonify, request
+
+from app import Appointment, Doctor, db, hms_cli, login_required
+from replicas import replica_reads
+
+scheduling_bp = Blueprint('scheduling', __name__)
+
+WEEKDAYS = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+TIME_FORMAT = '%H:%M'
+# Days scanned per round trip while searching for the next free slots
+SEARCH_WINDOW_DAYS = 7
+
+
+class SlotUnavailable(ValueError):
+    """The requested appointment time is not a bookable slot."""
+
+
+# Model for doctor working-hour templates
+class DoctorSchedule(db.Model):
+    __tablename__ = 'doctor_schedules'
+    id = db.Column(db.Integer, primary_key=True)
+    hospital_id = db.Column(db.String(36), db.ForeignKey('hospitals.id'), nullable=False)
+    doctor_id = db.Column(db.Integer, db.ForeignKey('doctors.id'), nullable=False)
+    weekday = db.Column(db.Integer, nullable=False)  # 0 = Monday
+    start_time = db.Column(db.Time, nullable=False)
+    end_time = db.Column(db.Time, nullable=False)
+    slot_minutes = db.Column(db.Integer, nullable=False, default=30)
+    created_at = db.Column(db.DateTime, default=datetime.now)
+
+    __table_args__ = (
+        db.Index('ix_doctor_schedules_hospital_doctor', 'hospital_id', 'doctor_id', 'weekday'),
+    )
+
+    def has_slot(self, when):
+        """True if one of this template's slots starts at `when`."""
+        if when.weekday() != self.weekday:
+            return False
+        start = datetime.combine(when.date(), self.start_time)
+        step = timedelta(minutes=self.slot_minutes)
+        return start <= when and when + step <= datetime.combine(when.date(), self.end_time) \
+            and (when - start) % step == timedelta(0)
+
+    def slot_starts(self, day):
+        """Slot start datetimes of this template on `day` (a date with the same weekday)."""
+        current = datetime.combine(day, self.start_time)
+        end = datetime.combine(day, self.end_time)
+        step = timedelta(minutes=self.slot_minutes)
+        while current + step <= end:
+            yield current
+            current += step
+
+    def as_dict(self):
+        return {
+            'weekday': self.weekday,
+            'start': self.start_time.strftime(TIME_FORMAT),
+            'end': self.end_time.strftime(TIME_FORMAT),
+            'slot_minutes': self.slot_minutes,
+        }
+
+    def __repr__(self):
+        return f'<DoctorSchedule {self.doctor_id} {WEEKDAYS[self.weekday]}>'
+
+
+# ----------------------------------------------------
+# Slot index
+# ----------------------------------------------------
+
+def default_templates(hospital_id, doctor_id):
+    """Unsaved templates of a doctor who has no working hours (the SCHEDULING_DEFAULT_* hours)."""
+    config = current_app.config
+    start = datetime.strptime(config['SCHEDULING_DEFAULT_START'], TIME_FORMAT).time()
+    end = datetime.strptime(config['SCHEDULING_DEFAULT_END'], TIME_FORMAT).time()
+    return [DoctorSchedule(hospital_id=hospital_id, doctor_id=doctor_id, weekday=weekday, start_time=start,
+                           end_time=end, slot_minutes=config['SCHEDULING_DEFAULT_SLOT_MINUTES'])
+            for weekday in _parse_weekdays(config['SCHEDULING_DEFAULT_WEEKDAYS'])]
+
+
+def _templates_by_doctor(hospital_id, doctor_ids):
+    rows = DoctorSchedule.query.filter(
+        DoctorSchedule.hospital_id == hospital_id,
+        DoctorSchedule.doctor_id.in_(doctor_ids)
+    ).all()
+    templates = {}
+    for row in rows:
+        templates.setdefault(row.doctor_id, []).append(row)
+    for doctor_id in doctor_ids:
+        if doctor_id not in templates:
+            templates[doctor_id] = default_templates(hospital_id, doctor_id)
+    return templates
+
+
+def booked_starts(hospital_id, doctor_ids, start, end):
+    """{(doctor_id, start)} of live appointments in [start, end)."""
+    rows = db.session.query(Appointment.doctor_id, Appointment.appointment_date).filter(
+        Appointment.hospital_id == hospital_id,
+        Appointment.doctor_id.in_(doctor_ids),
+        Appointment.appointment_date >= start,
+        Appointment.appointment_date < end,
+        Appointment.status != 'CANCELLED'
+    )
+    return set(rows)
+
+
+def free_slots(hospital_id, doctor_ids, start, end=None, limit=10):
+    """Up to `limit` free slots for the doctors, in time order, from `start` until `end`.
+
+    Without `end` the search continues window by window up to SCHEDULING_HORIZON_DAYS.
+    """
+    doctor_ids = list(doctor_ids)
+    templates = _templates_by_doctor(hospital_id, doctor_ids) if doctor_ids else {}
+    if not templates:
+        return []
+    start = max(start, datetime.now())
+    end = end or start + timedelta(days=current_app.config['SCHEDULING_HORIZON_DAYS'])
+
+    slots = []
+    window_start = start
+    while window_start < end and len(slots) < limit:
+        window_end = min(window_start + timedelta(days=SEARCH_WINDOW_DAYS), end)
+        booked = booked_starts(hospital_id, list(templates), window_start, window_end)
+        candidates = []
+        day = window_start.date()
+        last_day = (window_end - timedelta(microseconds=1)).date()
+        while day <= last_day:
+            for doctor_id, rows in templates.items():
+                for row in rows:
+                    if row.weekday != day.weekday():
+                        continue
+                    for slot_start in row.slot_starts(day):
+                        if window_start <= slot_start < window_end and (doctor_id, slot_start) not in booked:
+                            candidates.append((slot_start, doctor_id, row.slot_minutes))
+            day += timedelta(days=1)
+        candidates.sort()
+        for slot_start, doctor_id, minutes in candidates[:limit - len(slots)]:
+            slots.append({
+                'doctor_id': doctor_id,
+                'start': slot_start.isoformat(timespec='minutes'),
+                'end': (slot_start + timedelta(minutes=minutes)).isoformat(timespec='minutes'),
+            })
+        window_start = window_end
+    return slots
+
+
+def validate_slot(hospital_id, doctor_id, when):
+    """Raise SlotUnavailable unless one of the doctor's slots starts at `when`.
+
+    Doctors without working hours have the default ones.
+    """
+    doctor = Doctor.query.filter_by(hospital_id=hospital_id, id=doctor_id).first()
+    if doctor is None:
+        raise SlotUnavailable('Unknown doctor.')
+    if not any(row.has_slot(when) for row in _templates_by_doctor(hospital_id, [doctor.id])[doctor.id]):
+        raise SlotUnavailable(
+            f'Dr. {doctor.last_name} has no slot starting at {when.strftime("%d/%m/%Y %H:%M")}. '
+            'Pick one of the free slots.'
+        )
+
+
+def set_working_hours(hospital_id, doctor_id, entries):
+    """Replace a doctor's working-hour templates with `entries` (dicts as in as_dict())."""
+    parsed = []
+    for entry in entries:
+        weekday = int(entry['weekday'])
+        start = datetime.strptime(entry['start'], TIME_FORMAT).time()
+        end = datetime.strptime(entry['end'], TIME_FORMAT).time()
+        slot_minutes = int(entry.get('slot_minutes', 30))
+        if not 0 <= weekday <= 6 or start >= end or slot_minutes <= 0:
+            raise ValueError(f'invalid working hours: {entry}')
+        parsed.append(DoctorSchedule(hospital_id=hospital_id, doctor_id=doctor_id, weekday=weekday,
+                                     start_time=start, end_time=end, slot_minutes=slot_minutes))
+    # Overlapping templates would let two bookings overlap with different start times
+    parsed.sort(key=lambda row: (row.weekday, row.start_time))
+    for previous, row in zip(parsed, parsed[1:]):
+        if row.weekday == previous.weekday and row.start_time < previous.end_time:
+            raise ValueError(f'overlapping working hours on {WEEKDAYS[row.weekday]}: '
+                             f'{previous.as_dict()} and {row.as_dict()}')
+    # A booking that is off the new grid could be overlapped by one made on it
+    templates = parsed or default_templates(hospital_id, doctor_id)
+    booked = db.session.query(Appointment.appointment_date).filter(
+        Appointment.hospital_id == hospital_id,
+        Appointment.doctor_id == doctor_id,
+        Appointment.status == 'SCHEDULED',
+        Appointment.appointment_date >= datetime.now()
+    ).order_by(Appointment.appointment_date)
+    misfits = [when for (when,) in booked if not any(row.has_slot(when) for row in templates)]
+    if misfits:
+        raise ValueError(f'{len(misfits)} booked appointment(s) would not start on a slot of these hours, '
+                         f'the first on {misfits[0].strftime("%d/%m/%Y %H:%M")}; move or cancel them first')
+    DoctorSchedule.query.filter_by(hospital_id=hospital_id, doctor_id=doctor_id).delete()
+    db.session.add_all(parsed)
+    db.session.commit()
+    return parsed
+
+
+# ----------------------------------------------------
+# Routes
+# ----------------------------------------------------
+
+def _parse_day(value, default=None):
+    if not value:
+        return default
+    try:
+        return datetime.strptime(value, '%Y-%m-%d')
+    except ValueError:
+        abort(400, description=f'invalid date {value!r}, expected YYYY-MM-DD')
+
+
+@scheduling_bp.route('/scheduling/slots')
+@login_required
+@replica_reads
+def slots():
+    """Next free slots for a doctor or a whole department."""
+    doctors = Doctor.query.filter_by(hospital_id=g.hospital_id, status='ACTIVE')
+    if request.args.get('doctor_id'):
+        doctors = doctors.filter_by(id=request.args.get('doctor_id', type=int))
+    elif request.args.get('department_id'):
+        doctors = doctors.filter_by(department_id=request.args.get('department_id', type=int))
+    else:
+        abort(400, description='doctor_id or department_id is required')
+    doctor_ids = [doctor_id for (doctor_id,) in doctors.with_entities(Doctor.id)]
+
+    start = _parse_day(request.args.get('start'), datetime.now())
+    end = _parse_day(request.args.get('end'))
+    limit = min(request.args.get('limit', 10, type=int), current_app.config['SCHEDULING_MAX_SLOTS'])
+    return jsonify(slots=free_slots(g.hospital_id, doctor_ids, start, end, limit))
+
+
+@scheduling_bp.route('/doctors/<int:doctor_id>/hours', methods=['GET', 'PUT'])
+@login_required
+def working_hours(doctor_id):
+    """Read or replace a doctor's weekly working hours."""
+    if Doctor.query.filter_by(hospital_id=g.hospital_id, id=doctor_id).first() is None:
+        abort(404)
+    if request.method == 'PUT':
+        entries = request.get_json(silent=True)
+        if not isinstance(entries, list):
+            abort(400, description='expected a JSON list of working-hour entries')
+        try:
+            set_working_hours(g.hospital_id, doctor_id, entries)
+        except (KeyError, TypeError, ValueError) as e:
+            db.session.rollback()
+            abort(400, description=str(e))
+    rows = DoctorSchedule.query.filter_by(hospital_id=g.hospital_id, doctor_id=doctor_id) \
+        .order_by(DoctorSchedule.weekday, DoctorSchedule.start_time).all()
+    return jsonify(doctor_id=doctor_id, hours=[row.as_dict() for row in rows])
+
+
+def _parse_weekdays(value):
+    days = set()
+    for part in value.split(','):
+        if '-' in part:
+            first, last = part.split('-')
+            days.update(range(int(first), int(last) + 1))
+        else:
+            days.add(int(part))
+    return sorted(days)
+
+
+@hms_cli.command('set-hours')
+@click.argument('doctor_id', type=int)
+@click.option('--weekdays', default='0-4', show_default=True, help='Days, 0 = Monday (e.g. 0-4 or 0,2,4).')
+@click.option('--start', default='09:00', show_default=True)
+@click.option('--end', default='17:00', show_default=True)
+@click.option('--slot-minutes', type=int, default=30, show_default=True)
+@click.option('--hospital-id', default=None, help="The doctor's hospital, if it is not on the default shard.")
+def set_hours_command(doctor_id, weekdays, start, end, slot_minutes, hospital_id):
+    """Replace a doctor's working hours with one block on the given weekdays."""
+    from tenants import tenant_shard
+    with tenant_shard(hospital_id):
+        doctor = db.session.get(Doctor, doctor_id)
+        if doctor is None or hospital_id not in (None, doctor.hospital_id):
+            raise click.BadParameter(f'no doctor {doctor_id}', param_hint='DOCTOR_ID')
+        entries = [dict(weekday=day, start=start, end=end, slot_minutes=slot_minutes)
+                   for day in _parse_weekdays(weekdays)]
+        try:
+            set_working_hours(doctor.hospital_id, doctor.id, entries)
+        except ValueError as e:
+            db.session.rollback()
+            raise click.ClickException(str(e))
+    click.echo(f"Dr. {doctor.last_name}: {start}-{end} every {slot_minutes} min on "
+               f"{', '.join(WEEKDAYS[day] for day in _parse_weekdays(weekdays))}.")
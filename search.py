@@ -0,0 +1,241 @@
+# search.py
+# Patient search by partial name, email or phone, for the front-desk typeahead.
+#
+# SQLite: a contentless FTS5 table (patients_fts) with prefix indexes, kept in sync
+#   with `patients` by triggers, so ORM writes and bulk Core imports are both
+#   covered. The tenant is stored as a single token so the tenant filter runs
+#   inside the full-text index rather than row by row afterwards.
+# PostgreSQL: GIN indexes on (hospital_id, to_tsvector(...)) for prefix word
+#   matches, and on (hospital_id, document gin_trgm_ops) for substrings such as
+#   the middle of a phone number. This needs the pg_trgm and btree_gin extensions.
+#
+# Only the newest SEARCH_MAX_RESULTS matches are ranked. They are ordered by
+# where the first term matched: name prefix, then email prefix, then the rest.
+# bm25/ts_rank need statistics over every matching row, which costs a scan of
+# the whole tenant for a short prefix such as "jo". A typeahead user who does
+# not see the right patient types another letter rather than paging.
+#
+# `flask hms init` runs the setup. `flask hms search-setup` can be run on its own,
+# and `--rebuild` reindexes existing patients.
+#
+#   GET /patients/search?q=jo%20smi&per_page=10&page=1
+
+import re
+
+import click
+from flask import Blueprint, current_app, g, jsonify, request, url_for
+from sqlalchemy import or_, text
+
+from app import Patient, db, hms_cli, login_required
+from pagination import page_size
+from replicas import replica_reads
+
+search_bp = Blueprint('search', __name__)
+
+# Letters and digits only: FTS5 and to_tsquery both have their own query syntax
+_TERM = re.compile(r'[^\W_]+')
+
+
+def search_terms(query):
+    """Lower-cased search terms of a free-text query.
+
+    A query made only of digit groups ("555-12") is one phone-number prefix.
+    """
+    terms = _TERM.findall((query or '').lower())
+    if len(terms) > 1 and all(term.isdigit() for term in terms):
+        return [''.join(terms)]
+    return terms
+
+
+# ----------------------------------------------------
+# SQLite (FTS5)
+# ----------------------------------------------------
+
+# Phone numbers are also indexed without separators, so "5551234" finds "555-1234"
+_SQLITE_DIGITS = "replace(replace(replace(replace(replace({0}, '-', ''), ' ', ''), '(', ''), ')', ''), '.', '')"
+_SQLITE_VALUES = (
+    "{0}.id, 't' || replace({0}.hospital_id, '-', ''), {0}.first_name || ' ' || {0}.last_name, "
+    "{0}.email, {0}.phone || ' ' || " + _SQLITE_DIGITS.format('{0}.phone')
+)
+_SQLITE_INSERT = 'INSERT INTO patients_fts(rowid, tenant, name, email, phone) VALUES ({});'
+_SQLITE_DELETE = "INSERT INTO patients_fts(patients_fts, rowid, tenant, name, email, phone) VALUES ('delete', {});"
+
+SQLITE_DDL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS patients_fts USING fts5("
+    "tenant, name, email, phone, content='', prefix='2 3 4', tokenize='unicode61')",
+    'CREATE TRIGGER IF NOT EXISTS patients_fts_ai AFTER INSERT ON patients BEGIN '
+    + _SQLITE_INSERT.format(_SQLITE_VALUES.format('new')) + ' END',
+    'CREATE TRIGGER IF NOT EXISTS patients_fts_ad AFTER DELETE ON patients BEGIN '
+    + _SQLITE_DELETE.format(_SQLITE_VALUES.format('old')) + ' END',
+    'CREATE TRIGGER IF NOT EXISTS patients_fts_au AFTER UPDATE OF hospital_id, first_name, last_name, email, phone '
+    'ON patients BEGIN '
+    + _SQLITE_DELETE.format(_SQLITE_VALUES.format('old')) + ' '
+    + _SQLITE_INSERT.format(_SQLITE_VALUES.format('new')) + ' END',
+)
+SQLITE_REBUILD = (
+    "INSERT INTO patients_fts(patients_fts) VALUES ('delete-all')",
+    'INSERT INTO patients_fts(rowid, tenant, name, email, phone) SELECT '
+    + _SQLITE_VALUES.format('patients') + ' FROM patients',
+)
+
+# CROSS JOIN keeps SQLite from driving the join from the patients side
+_SQLITE_SEARCH = text(
+    "SELECT p.id, p.first_name, p.last_name, p.email, p.phone FROM ("
+    "SELECT rowid FROM patients_fts WHERE patients_fts MATCH :match ORDER BY rowid DESC LIMIT :candidates"
+    ") AS f CROSS JOIN patients AS p ON p.id = f.rowid "
+    "WHERE p.hospital_id = :hospital_id "
+    "ORDER BY CASE WHEN lower(p.first_name) LIKE :prefix ESCAPE '\\' OR lower(p.last_name) LIKE :prefix ESCAPE '\\' THEN 0 "
+    "WHEN lower(p.email) LIKE :prefix ESCAPE '\\' THEN 1 ELSE 2 END, p.id DESC "
+    "LIMIT :limit OFFSET :offset"
+)
+
+
+def _sqlite_match(hospital_id, terms):
+    tenant = 't' + hospital_id.replace('-', '')
+    words = ' AND '.join(f'"{term}"*' for term in terms)
+    return f'tenant : "{tenant}" AND {{name email phone}} : ({words})'
+
+
+# ----------------------------------------------------
+# PostgreSQL (tsvector + pg_trgm)
+# ----------------------------------------------------
+
+# Must match the indexed expressions exactly for the planner to use them
+PG_DOCUMENT = ("(coalesce(first_name, '') || ' ' || coalesce(last_name, '') || ' ' || "
+               "coalesce(email, '') || ' ' || coalesce(phone, ''))")
+PG_VECTOR = f"to_tsvector('simple'::regconfig, {PG_DOCUMENT})"
+
+POSTGRES_DDL = (
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    'CREATE EXTENSION IF NOT EXISTS btree_gin',
+    f'CREATE INDEX IF NOT EXISTS ix_patients_search_tsv ON patients USING gin (hospital_id, {PG_VECTOR})',
+    f'CREATE INDEX IF NOT EXISTS ix_patients_search_trgm ON patients USING gin (hospital_id, {PG_DOCUMENT} gin_trgm_ops)',
+)
+
+# The inner query picks the newest candidates, as the SQLite one does, so that pages
+# of the ranking are cut from one fixed set instead of whatever rows the scan yields first
+_POSTGRES_SEARCH = text(
+    "SELECT id, first_name, last_name, email, phone FROM ("
+    f"SELECT id, first_name, last_name, email, phone, {PG_DOCUMENT} AS document FROM patients "
+    f"WHERE hospital_id = :hospital_id AND ({PG_VECTOR} @@ to_tsquery('simple', :tsquery) "
+    f"OR {PG_DOCUMENT} ILIKE :pattern) ORDER BY created_at DESC, id DESC LIMIT :candidates"
+    ") AS candidates "
+    "ORDER BY similarity(document, :raw) DESC, id DESC "
+    "LIMIT :limit OFFSET :offset"
+)
+
+
+def like_pattern(value, prefix_only=False):
+    """LIKE pattern (ESCAPE '\\') matching `value` anywhere, or only at the start."""
+    escaped = value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f'{escaped}%' if prefix_only else f'%{escaped}%'
+
+
+# ----------------------------------------------------
+# Search
+# ----------------------------------------------------
+
+def search_statement(dialect, hospital_id, query, limit=10, offset=0):
+    """(statement, params) of the indexed search on `dialect`, or None where there is no index."""
+    terms = search_terms(query)
+    page = dict(limit=limit, offset=offset, candidates=current_app.config['SEARCH_MAX_RESULTS'])
+    if dialect == 'sqlite':
+        params = dict(match=_sqlite_match(hospital_id, terms), hospital_id=hospital_id,
+                      prefix=like_pattern(terms[0], prefix_only=True))
+        return _SQLITE_SEARCH, dict(params, **page)
+    if dialect == 'postgresql':
+        params = dict(hospital_id=hospital_id, tsquery=' & '.join(f'{term}:*' for term in terms),
+                      pattern=like_pattern(query.strip()), raw=' '.join(terms))
+        return _POSTGRES_SEARCH, dict(params, **page)
+    return None
+
+
+def search_patients(hospital_id, query, limit=10, offset=0):
+    """Best matches for `query` among the hospital's patients, as row mappings."""
+    terms = search_terms(query)
+    if not terms:
+        return []
+    indexed = search_statement(db.engine.dialect.name, hospital_id, query, limit, offset)
+    if indexed is not None:
+        return db.session.execute(*indexed).mappings().all()
+    # Other databases: unindexed LIKE scan, good enough for development
+    filters = [or_(*[column.ilike(like_pattern(term)) for column in
+                     (Patient.first_name, Patient.last_name, Patient.email, Patient.phone)])
+               for term in terms]
+    rows = db.session.query(Patient.id, Patient.first_name, Patient.last_name, Patient.email, Patient.phone) \
+        .filter(Patient.hospital_id == hospital_id, *filters) \
+        .order_by(Patient.last_name, Patient.first_name, Patient.id).limit(limit).offset(offset)
+    return [row._mapping for row in rows]
+
+
+def setup_search(engine, rebuild=False):
+    """Create the search index for `engine` if missing; reindex all patients when new or asked to."""
+    with engine.begin() as connection:
+        if engine.dialect.name == 'sqlite':
+            exists = connection.execute(
+                text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'patients_fts'")
+            ).first() is not None
+            for statement in SQLITE_DDL:
+                connection.execute(text(statement))
+            if rebuild or not exists:
+                for statement in SQLITE_REBUILD:
+                    connection.execute(text(statement))
+            return True
+        if engine.dialect.name == 'postgresql':
+            for statement in POSTGRES_DDL:
+                connection.execute(text(statement))
+            if rebuild:
+                connection.execute(text('REINDEX INDEX ix_patients_search_tsv'))
+                connection.execute(text('REINDEX INDEX ix_patients_search_trgm'))
+            return True
+    return False
+
+
+# ----------------------------------------------------
+# Entry points
+# ----------------------------------------------------
+
+def search_request():
+    """(query, per_page, page, offset) from the query string."""
+    per_page = page_size(request.args.get('per_page', 10))
+    page = max(request.args.get('page', 1, type=int), 1)
+    return request.args.get('q', ''), per_page, page, (page - 1) * per_page
+
+
+def search_response(query, per_page, page, rows):
+    """JSON for the typeahead from up to per_page + 1 matching rows."""
+    results = [{
+        'id': row['id'],
+        'name': f"{row['first_name']} {row['last_name']}",
+        'email': row['email'],
+        'phone': row['phone'],
+        'url': url_for('api_v1.get_resource', resource='patients', item_id=row['id']),
+    } for row in rows[:per_page]]
+    return jsonify(q=query, page=page, per_page=per_page, has_more=len(rows) > per_page, results=results)
+
+
+@search_bp.route('/patients/search')
+@login_required
+@replica_reads
+def search():
+    """Ranked patient matches for the typeahead, one page at a time."""
+    query, per_page, page, offset = search_request()
+    if offset >= current_app.config['SEARCH_MAX_RESULTS']:
+        rows = []
+    else:
+        # One extra row tells us whether there is a next page
+        rows = search_patients(g.hospital_id, query, per_page + 1, offset)
+    return search_response(query, per_page, page, rows)
+
+
+@hms_cli.command('search-setup')
+@click.option('--rebuild', is_flag=True, help='Reindex every existing patient.')
+def search_setup_command(rebuild):
+    """Create (or rebuild) the patient search index on every shard."""
+    shards = current_app.extensions['hms_shards']
+    for name in shards.names():
+        engine = shards.engine(name)
+        if setup_search(engine, rebuild=rebuild):
+            click.echo(f'{name}: patient search index ready.')
+        else:
+            click.echo(f'{name}: no search index for {engine.dialect.name}; falling back to LIKE scans.')
@@ -0,0 +1,166 @@
+# security.py
+# Password hashing policy, off-thread verification and login rate limiting.
+#
+# Hashing policy (Config / environment):
+#   PASSWORD_HASH_METHOD      'scrypt' or 'pbkdf2'                   (HMS_PASSWORD_HASH, default scrypt)
+#   PASSWORD_SCRYPT_N/R/P     scrypt cost parameters                  (default 2**15, 8, 1)
+#   PASSWORD_PBKDF2_ITERATIONS pbkdf2-sha256 iterations               (default 600000)
+#   PASSWORD_HASH_WORKERS     processes verifying passwords, 0 = inline (HMS_PASSWORD_WORKERS)
+#   PASSWORD_HASH_MAX_PENDING verifications queued per web worker before logins get a 503
+#
+# Stored hashes record the method and cost they were made with. A login whose hash
+# does not match the current policy is rehashed with the password just verified,
+# so changing the policy migrates users as they sign in.
+#
+# Login attempts go through token buckets keyed by client IP and by email and
+# client IP (LOGIN_RATE_PER_IP / LOGIN_RATE_PER_EMAIL, "attempts/seconds"). The
+# second bucket includes the IP so that failed logins from elsewhere cannot lock
+# a user out of their own account. An attempt over the limit gets a 429 before
+# any hashing. Buckets live in the worker
+# process, so the effective limit scales with the number of workers. Behind a
+# reverse proxy, set PROXY_HOPS so the IP bucket is the client's.
+
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from flask import current_app, has_app_context
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from cache import TTLCache
+
+DEFAULT_POLICY = {
+    'PASSWORD_HASH_METHOD': 'scrypt',
+    'PASSWORD_SCRYPT_N': 2 ** 15,
+    'PASSWORD_SCRYPT_R': 8,
+    'PASSWORD_SCRYPT_P': 1,
+    'PASSWORD_PBKDF2_ITERATIONS': 600000,
+}
+
+
+class VerifierBusy(RuntimeError):
+    """Too many password verifications are already waiting in this worker."""
+
+
+def _policy(name):
+    if has_app_context():
+        return current_app.config.get(name, DEFAULT_POLICY.get(name))
+    return DEFAULT_POLICY.get(name)
+
+
+def hash_method():
+    """werkzeug method string for the configured policy, e.g. 'scrypt:32768:8:1'."""
+    method = _policy('PASSWORD_HASH_METHOD')
+    if method == 'scrypt':
+        return f"scrypt:{_policy('PASSWORD_SCRYPT_N')}:{_policy('PASSWORD_SCRYPT_R')}:{_policy('PASSWORD_SCRYPT_P')}"
+    if method == 'pbkdf2':
+        return f"pbkdf2:sha256:{_policy('PASSWORD_PBKDF2_ITERATIONS')}"
+    raise ValueError(f'unsupported PASSWORD_HASH_METHOD {method!r}')
+
+
+def needs_rehash(pwhash):
+    """True if `pwhash` was made with a different method or cost than the current policy."""
+    return not pwhash or pwhash.split('$', 1)[0] != hash_method()
+
+
+# ----------------------------------------------------
+# Verification pool
+# ----------------------------------------------------
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+_pending = None
+
+
+def _executor():
+    """This process's verification pool, created on first use (after any fork)."""
+    global _pool, _pool_pid, _pending
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            # spawn, not fork: the web process runs threads (job workers, replica health
+            # checks, pool bookkeeping), and a child forked while one of them holds a lock
+            # can deadlock. Spawned workers import the __main__ module of the process that
+            # started them, so every entry script keeps its work under
+            # `if __name__ == '__main__':`.
+            _pool = ProcessPoolExecutor(
+                max_workers=current_app.config['PASSWORD_HASH_WORKERS'],
+                mp_context=multiprocessing.get_context('spawn'),
+            )
+            _pool_pid = os.getpid()
+            _pending = threading.BoundedSemaphore(current_app.config['PASSWORD_HASH_MAX_PENDING'])
+        return _pool, _pending
+
+
+def _offload(function, *args):
+    if not has_app_context() or current_app.config['PASSWORD_HASH_WORKERS'] <= 0:
+        return function(*args)
+    pool, pending = _executor()
+    if not pending.acquire(blocking=False):
+        raise VerifierBusy('password verification queue is full')
+    try:
+        return pool.submit(function, *args).result()
+    finally:
+        pending.release()
+
+
+def hash_password(password):
+    """Hash `password` with the current policy."""
+    return _offload(generate_password_hash, password, hash_method())
+
+
+def verify_password(pwhash, password):
+    """Check `password` against `pwhash` in the verification pool."""
+    if not pwhash or password is None:
+        return False
+    return _offload(check_password_hash, pwhash, password)
+
+
+# ----------------------------------------------------
+# Rate limiting
+# ----------------------------------------------------
+
+def parse_rate(value):
+    """'10/60' -> (10, 60.0): `10` attempts per `60` seconds."""
+    attempts, seconds = str(value).split('/')
+    return int(attempts), float(seconds)
+
+
+class TokenBucketLimiter:
+    """Per-key token buckets: `capacity` attempts, refilled evenly over `period` seconds."""
+
+    def __init__(self, capacity, period, maxsize=100000):
+        self.capacity = capacity
+        self.rate = capacity / period
+        # An untouched bucket is full again after `period`, so it can be forgotten
+        self._buckets = TTLCache(ttl=period, maxsize=maxsize)
+        self._lock = threading.Lock()
+
+    def hit(self, key):
+        """Take a token for `key`; returns 0 if allowed, else seconds until one is available."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key) or (self.capacity, now)
+            tokens = min(self.capacity, tokens + (now - updated) * self.rate)
+            if tokens < 1:
+                self._buckets.set(key, (tokens, now))
+                return (1 - tokens) / self.rate
+            self._buckets.set(key, (tokens - 1, now))
+            return 0
+
+
+class LoginLimiter:
+    """Token buckets for login attempts per client IP and per (email, client IP)."""
+
+    def __init__(self, per_ip, per_email):
+        self.by_ip = TokenBucketLimiter(*parse_rate(per_ip))
+        self.by_email = TokenBucketLimiter(*parse_rate(per_email))
+
+    def check(self, ip, email):
+        """Seconds the caller must wait, or 0 if the attempt may go ahead."""
+        wait = self.by_ip.hit(ip or '-')
+        if not wait and email:
+            wait = self.by_email.hit((email.strip().lower(), ip or '-'))
+        return wait
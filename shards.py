@@ -0,0 +1,125 @@
+# shards.py
+# Tenant sharding: each hospital's rows live in one of several databases.
+#
+# The primary database (SQLALCHEMY_DATABASE_URI) is the directory. It holds the
+# hospitals, users, the job queue and tenant_shards, which maps a hospital to its
+# shard. It is also the "default" shard. HMS_SHARDS adds more, as name=url pairs:
+#
+#   HMS_SHARDS="east=postgresql://hms@db2/hms,west=postgresql://hms@db1/hms?options=-csearch_path%3Dwest"
+#   HMS_SHARDS="big=sqlite:////srv/hms/big.db"
+#
+# A shard can be another server, a schema of the same server (via search_path)
+# or a SQLite file. Every shard has the full schema; its tenant tables hold only
+# its own tenants' rows, and its `hospitals` table a copy of their hospital rows
+# for the foreign keys.
+#
+# The tenant middleware points each request at its hospital's shard
+# (route_to_shard()). From then on the session sends statements on tenant tables
+# to that shard and statements on DIRECTORY_TABLES to the primary. Hospitals
+# without a tenant_shards row live on the default shard, so a single-database
+# deployment needs no migration. Placement of new hospitals and moving a
+# hospital between shards are in tenants.py.
+
+from contextlib import contextmanager
+
+from flask import current_app, g, has_app_context
+from sqlalchemy import create_engine
+from sqlalchemy.sql.util import find_tables
+
+from db_pool import engine_options, pool_status
+from replicas import RoutingSession, replica_url
+
+DEFAULT_SHARD = 'default'
+
+# Shared by every tenant, so they stay on the primary
+DIRECTORY_TABLES = frozenset({'hospitals', 'users', 'tenant_shards', 'jobs'})
+
+
+def parse_shards(value):
+    """{name: url} from "name=url,name=url"."""
+    shards = {}
+    for item in filter(None, (part.strip() for part in value.split(','))):
+        name, _, url = item.partition('=')
+        name, url = name.strip(), url.strip()
+        if not name or not url or name == DEFAULT_SHARD or name in shards:
+            raise ValueError(f'invalid shard {item!r}: expected a unique name=url, not named {DEFAULT_SHARD!r}')
+        shards[name] = replica_url(url)
+    return shards
+
+
+def touches_tenant_data(mapper=None, clause=None):
+    """False only for statements on DIRECTORY_TABLES alone; text() and bare connections count as tenant data."""
+    if mapper is not None:
+        return mapper.local_table.name not in DIRECTORY_TABLES
+    if clause is None:
+        return True  # session.connection(), e.g. for bump_hospital_stats()
+    tables = find_tables(clause, include_crud=True, check_columns=True)
+    return not tables or any(table.name not in DIRECTORY_TABLES for table in tables)
+
+
+class ShardSet:
+    """Engines of the configured shards; the default shard is the app's own engine."""
+
+    def __init__(self, app):
+        self.engines = {name: create_engine(url, **engine_options(url))
+                        for name, url in app.config['SHARD_URLS'].items()}
+        self.open = app.config['SHARDS_OPEN'] or self.names()
+        unknown = set(self.open) - set(self.names())
+        if unknown:
+            raise ValueError(f'SHARDS_OPEN names unknown shards: {", ".join(sorted(unknown))}')
+
+    def names(self):
+        return [DEFAULT_SHARD] + list(self.engines)
+
+    def engine(self, name):
+        """Engine of shard `name`; the default shard's is the app's own (needs an app context)."""
+        if name == DEFAULT_SHARD:
+            return current_app.extensions['sqlalchemy'].engine
+        try:
+            return self.engines[name]
+        except KeyError:
+            raise ValueError(f'unknown shard {name!r}; configured: {", ".join(self.names())}') from None
+
+    def status(self):
+        return {name: pool_status(engine) for name, engine in self.engines.items()}
+
+    def dispose(self):
+        for engine in self.engines.values():
+            engine.dispose()
+
+
+# ----------------------------------------------------
+# Routing
+# ----------------------------------------------------
+
+class ShardedSession(RoutingSession):
+    """RoutingSession that sends tenant-table statements to the current tenant's shard."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and has_app_context():
+            engine = g.get('hms_shard_engine')
+            if engine is not None and touches_tenant_data(mapper, clause):
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def route_to_shard(name):
+    """Send this request's (or app context's) tenant statements to shard `name`."""
+    g.hms_shard = name
+    g.hms_shard_engine = None if name == DEFAULT_SHARD else current_app.extensions['hms_shards'].engine(name)
+
+
+@contextmanager
+def shard_context(name):
+    """route_to_shard() for the duration of the block, for CLI commands and jobs."""
+    previous = g.get('hms_shard', DEFAULT_SHARD)
+    route_to_shard(name)
+    try:
+        yield
+    finally:
+        route_to_shard(previous)
+
+
+def init_app(app):
+    app.extensions['hms_shards'] = ShardSet(app)
+    return app.extensions['hms_shards']
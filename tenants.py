@@ -0,0 +1,338 @@
+# tenants.py
+# Tenant placement and moves between shards (see shards.py).
+#
+# A new hospital goes to the open shard (SHARDS_OPEN) with the fewest hospitals.
+# `flask hms move-tenant HOSPITAL_ID SHARD` moves an existing one while it stays
+# online:
+#
+# 1. Copy its rows to the target shard in batches; the hospital keeps working.
+# 2. Pause its writes (tenant_shards.status = MOVING: POST/PUT/DELETE get a 503,
+#    reads go on) and wait out the tenant cache, so every process has seen it.
+# 3. Re-sync what changed during the copy: upsert rows that differ, delete rows
+#    gone from the source. Compare row counts; on a mismatch give up and resume.
+# 4. Point the hospital at the target, wait out the cache again, and delete its
+#    rows from the source.
+#
+# Rows keep their ids, so a move refuses to overwrite another hospital's rows
+# with the same id. On PostgreSQL each shard's sequences start in their own
+# SHARD_ID_STRIDE range (set when `flask hms init` creates the shard's tables),
+# which keeps ids unique across shards; SQLite shards number rows independently,
+# so moves between them only work where the ids do not overlap.
+
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import click
+from flask import current_app
+from sqlalchemy import delete, func, select, text
+
+from app import Hospital, TenantShard, create_missing_indexes, db, hms_cli
+from shards import DEFAULT_SHARD, DIRECTORY_TABLES, shard_context
+
+
+def shard_set():
+    return current_app.extensions['hms_shards']
+
+
+def shard_tables():
+    """Tables every shard has: the tenant tables and, for their foreign keys, hospitals."""
+    return [table for table in db.metadata.sorted_tables
+            if table.name == 'hospitals' or table.name not in DIRECTORY_TABLES]
+
+
+def tenant_tables():
+    """Tables holding a hospital's own rows, parents first."""
+    return [table for table in db.metadata.sorted_tables if table.name not in DIRECTORY_TABLES]
+
+
+def shard_of(hospital_id):
+    """Name of the shard holding `hospital_id`'s rows (the default shard for None)."""
+    placement = db.session.get(TenantShard, hospital_id) if hospital_id is not None else None
+    return placement.shard if placement is not None else DEFAULT_SHARD
+
+
+@contextmanager
+def tenant_shard(hospital_id):
+    """Route the block's tenant statements to `hospital_id`'s shard (CLI commands, jobs)."""
+    with shard_context(shard_of(hospital_id)):
+        yield
+
+
+def hospitals_by_shard(hospital_id=None):
+    """{shard: [hospital ids]} for every hospital, or just `hospital_id`."""
+    query = select(Hospital.id, TenantShard.shard).outerjoin(TenantShard, TenantShard.hospital_id == Hospital.id)
+    if hospital_id:
+        query = query.where(Hospital.id == hospital_id)
+    grouped = {}
+    for ident, shard in db.session.execute(query):
+        grouped.setdefault(shard or DEFAULT_SHARD, []).append(ident)
+    return grouped
+
+
+def upsert(connection, table, rows):
+    """INSERT `rows`, updating the ones whose primary key already exists."""
+    if connection.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    elif connection.dialect.name == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        raise click.ClickException(f'moving tenants is not supported on {connection.dialect.name}')
+    statement = insert(table)
+    keys = [column.name for column in table.primary_key.columns]
+    statement = statement.on_conflict_do_update(
+        index_elements=keys,
+        set_={column.name: statement.excluded[column.name] for column in table.columns if column.name not in keys},
+    )
+    connection.execute(statement, rows)
+
+
+def _copy_hospital_row(connection, hospital):
+    table = Hospital.__table__
+    upsert(connection, table, [{column.name: getattr(hospital, column.key) for column in table.columns}])
+
+
+# ----------------------------------------------------
+# Placement
+# ----------------------------------------------------
+
+def place_tenant(hospital):
+    """Assign a new hospital to the open shard with the fewest hospitals.
+
+    On another shard than the default, its hospital row is copied there and its
+    stats row created there; both commit with the session.
+    """
+    shards = shard_set()
+    counts = dict.fromkeys(shards.open, 0)
+    placed = 0
+    with db.session.no_autoflush:  # the hospital's stats row is created on flush, once placed
+        for shard, total in db.session.execute(select(TenantShard.shard, func.count()).group_by(TenantShard.shard)):
+            placed += total
+            if shard in counts:
+                counts[shard] += total
+        if DEFAULT_SHARD in counts:
+            # Hospitals from before sharding have no tenant_shards row
+            counts[DEFAULT_SHARD] += db.session.scalar(select(func.count()).select_from(Hospital)) - placed
+    name = min(counts, key=lambda shard: (counts[shard], shard != DEFAULT_SHARD))
+    hospital.placement = TenantShard(shard=name)
+    if name != DEFAULT_SHARD:
+        db.session.flush()  # fills in the column defaults for the copy
+        engine = shards.engine(name)
+        _copy_hospital_row(db.session.connection(bind_arguments={'bind': engine}), hospital)
+        db.session.execute(db.metadata.tables['hospital_stats'].insert().values(hospital_id=hospital.id),
+                           bind_arguments={'bind': engine})
+    return name
+
+
+def init_shard_schema(engine, index, echo=click.echo):
+    """Create the shard tables, indexes and search index on `engine` (idempotent)."""
+    from search import setup_search
+    tables = shard_tables()
+    db.metadata.create_all(engine, tables=tables)
+    create_missing_indexes(engine, echo=echo, tables=tables)
+    setup_search(engine)
+    if engine.dialect.name == 'postgresql' and index:
+        start = index * current_app.config['SHARD_ID_STRIDE'] + 1
+        with engine.begin() as connection:
+            for table in tables:
+                key = table.primary_key.columns[0]
+                if not isinstance(key.type, db.Integer):
+                    continue
+                # Only on empty tables: a used sequence keeps counting from where it is
+                connection.execute(text(
+                    f"SELECT setval(pg_get_serial_sequence('{table.name}', '{key.name}'), :start, false) "
+                    f"WHERE NOT EXISTS (SELECT 1 FROM {table.name})"
+                ), {'start': start})
+
+
+def init_shard_schemas(echo=click.echo):
+    """init_shard_schema() on every configured shard but the default."""
+    shards = shard_set()
+    for index, name in enumerate(shards.names()):
+        if name != DEFAULT_SHARD:
+            echo(f'Shard {name}:')
+            init_shard_schema(shards.engine(name), index, echo=echo)
+
+
+# ----------------------------------------------------
+# Moving a tenant
+# ----------------------------------------------------
+
+def _key(table):
+    return table.primary_key.columns[0]  # every tenant table has a single-column key
+
+
+def _batches(connection, table, hospital_id, batch_size):
+    """A hospital's rows of `table` in key order, `batch_size` at a time."""
+    key = _key(table)
+    last = None
+    while True:
+        query = select(table).where(table.c.hospital_id == hospital_id).order_by(key).limit(batch_size)
+        if last is not None:
+            query = query.where(key > last)
+        rows = [dict(row) for row in connection.execute(query).mappings()]
+        if not rows:
+            return
+        yield rows
+        last = rows[-1][key.name]
+
+
+def _store(target, table, hospital_id, rows):
+    """Upsert `rows` into the target unless one would overwrite another hospital's row."""
+    key = _key(table)
+    keys = [row[key.name] for row in rows]
+    taken = target.scalar(select(func.count()).select_from(table)
+                          .where(key.in_(keys), table.c.hospital_id != hospital_id))
+    if taken:
+        raise click.ClickException(f'{table.name}: {taken} id(s) of this hospital are used by other hospitals '
+                                   f'on the target shard')
+    upsert(target, table, rows)
+
+
+def _count(connection, table, hospital_id):
+    return connection.scalar(select(func.count()).select_from(table).where(table.c.hospital_id == hospital_id))
+
+
+def _delete_tenant_rows(engine, hospital_id, batch_size):
+    """Delete a hospital's rows from every tenant table on `engine`, children first."""
+    for table in reversed(tenant_tables()):
+        key = _key(table)
+        while True:
+            with engine.begin() as connection:
+                keys = connection.scalars(select(key).where(table.c.hospital_id == hospital_id)
+                                          .limit(batch_size)).all()
+                if not keys:
+                    break
+                connection.execute(delete(table).where(key.in_(keys)))
+
+
+def copy_tenant(source, target, hospital_id, batch_size):
+    """Bulk-copy a hospital's rows; returns the number of rows written."""
+    copied = 0
+    for table in tenant_tables():
+        for rows in _batches(source, table, hospital_id, batch_size):
+            with target.begin() as connection:
+                _store(connection, table, hospital_id, rows)
+            copied += len(rows)
+    return copied
+
+
+def sync_tenant(source, target, hospital_id, batch_size):
+    """Make the target's copy of a hospital's rows equal the source's; returns rows changed."""
+    changed = 0
+    source_keys = {}
+    for table in tenant_tables():
+        key = _key(table)
+        source_keys[table.name] = seen = set()
+        for rows in _batches(source, table, hospital_id, batch_size):
+            keys = [row[key.name] for row in rows]
+            seen.update(keys)
+            with target.begin() as connection:
+                current = {row[key.name]: dict(row)
+                           for row in connection.execute(select(table).where(key.in_(keys))).mappings()}
+                different = [row for row in rows if current.get(row[key.name]) != row]
+                if different:
+                    _store(connection, table, hospital_id, different)
+            changed += len(different)
+    for table in reversed(tenant_tables()):
+        key = _key(table)
+        with target.begin() as connection:
+            stale = [ident for ident in connection.scalars(select(key).where(table.c.hospital_id == hospital_id))
+                     if ident not in source_keys[table.name]]
+            for start in range(0, len(stale), batch_size):
+                connection.execute(delete(table).where(key.in_(stale[start:start + batch_size])))
+        changed += len(stale)
+    return changed
+
+
+def _set_placement(hospital_id, **values):
+    placement = db.session.get(TenantShard, hospital_id)
+    if placement is None:
+        placement = TenantShard(hospital_id=hospital_id, shard=DEFAULT_SHARD)
+        db.session.add(placement)
+    for name, value in values.items():
+        setattr(placement, name, value)
+    db.session.commit()
+
+
+def move_tenant(hospital_id, target_name, wait, batch_size, keep_source=False, echo=click.echo):
+    """Move a hospital's rows to shard `target_name`; see the module comment."""
+    shards = shard_set()
+    hospital = db.session.get(Hospital, hospital_id)
+    if hospital is None:
+        raise click.ClickException(f'no hospital {hospital_id}')
+    source_name = shard_of(hospital_id)
+    if hospital.placement is not None and hospital.placement.status != 'ACTIVE':
+        raise click.ClickException(f'hospital is {hospital.placement.status}; is another move running?')
+    if source_name == target_name:
+        raise click.ClickException(f'hospital is already on shard {target_name}')
+    source, target = shards.engine(source_name), shards.engine(target_name)
+
+    started = time.perf_counter()
+    try:
+        if target_name != DEFAULT_SHARD:
+            with target.begin() as connection:
+                _copy_hospital_row(connection, hospital)
+        with source.connect() as connection:
+            copied = copy_tenant(connection, target, hospital_id, batch_size)
+        echo(f'Copied {copied} row(s) to {target_name} in {time.perf_counter() - started:.1f}s.')
+
+        _set_placement(hospital_id, status='MOVING')
+        echo(f'Writes paused; waiting {wait}s for every process to see it.')
+        time.sleep(wait)
+        with source.connect() as connection:
+            changed = sync_tenant(connection, target, hospital_id, batch_size)
+        echo(f'Re-synced {changed} row(s) changed during the copy.')
+        with source.connect() as left, target.connect() as right:
+            for table in tenant_tables():
+                expected, actual = _count(left, table, hospital_id), _count(right, table, hospital_id)
+                if expected != actual:
+                    raise click.ClickException(f'{table.name}: {actual} row(s) on {target_name}, '
+                                               f'{expected} on {source_name}')
+    except (Exception, KeyboardInterrupt):
+        echo(f'Move failed; {hospital_id} stays on {source_name}.', err=True)
+        db.session.rollback()
+        _set_placement(hospital_id, status='ACTIVE')
+        _delete_tenant_rows(target, hospital_id, batch_size)
+        raise
+
+    _set_placement(hospital_id, shard=target_name, status='ACTIVE', moved_at=datetime.now())
+    echo(f'{hospital_id} is now served from {target_name}.')
+    if keep_source:
+        return
+    # Processes with an older snapshot still read the source until it expires
+    time.sleep(wait)
+    _delete_tenant_rows(source, hospital_id, batch_size)
+    if source_name != DEFAULT_SHARD:
+        with source.begin() as connection:
+            connection.execute(delete(Hospital.__table__).where(Hospital.__table__.c.id == hospital_id))
+    echo(f'Deleted its rows from {source_name}.')
+
+
+@hms_cli.command('move-tenant')
+@click.argument('hospital_id')
+@click.argument('shard')
+@click.option('--wait', type=float, default=None,
+              help='Seconds to let processes pick up a change (default: TENANT_CACHE_TTL + 5).')
+@click.option('--batch-size', type=int, default=None, help='Rows per copy batch.')
+@click.option('--keep-source', is_flag=True, help='Leave the rows on the old shard.')
+def move_tenant_command(hospital_id, shard, wait, batch_size, keep_source):
+    """Move one hospital's rows to another shard while it stays online."""
+    if shard not in shard_set().names():
+        raise click.BadParameter(f'unknown shard {shard!r}', param_hint='SHARD')
+    if wait is None:
+        wait = current_app.config['TENANT_CACHE_TTL'] + 5
+    move_tenant(hospital_id, shard, wait, batch_size or current_app.config['SHARD_MOVE_BATCH_SIZE'],
+                keep_source=keep_source)
+
+
+@hms_cli.command('shards')
+def shards_command():
+    """List the shards and how many hospitals each holds."""
+    shards = shard_set()
+    counts = {shard: len(ids) for shard, ids in hospitals_by_shard().items()}
+    for name in shards.names():
+        url = db.engine.url if name == DEFAULT_SHARD else shards.engine(name).url
+        flag = 'open' if name in shards.open else 'closed'
+        click.echo(f'{name:<16} {counts.get(name, 0):>6} hospital(s)  {flag:<6}  '
+                   f'{url.render_as_string(hide_password=True)}')
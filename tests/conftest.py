@@ -0,0 +1,73 @@
+# Shared fixtures: a fresh app on an in-memory SQLite database per test, a seeded
+# hospital, and a test client logged in as its admin.
+
+import os
+
+# Config reads the environment when app.py is imported
+os.environ['DATABASE_URL'] = 'sqlite://'
+os.environ['HMS_PASSWORD_WORKERS'] = '0'
+os.environ['HMS_CACHE_BACKEND'] = 'memory'
+os.environ.pop('HMS_SHARDS', None)
+os.environ.pop('HMS_REPLICA_URLS', None)
+
+from datetime import date, datetime, timedelta
+
+import pytest
+
+import app as hms
+
+ROWS = 5  # rows seeded per model, enough for any N+1 to show in the query counts
+
+
+@pytest.fixture
+def app():
+    flask_app = hms.create_app()
+    flask_app.config['TESTING'] = True
+    hms.bootstrap(flask_app, verbose=False)
+    with flask_app.app_context():
+        yield flask_app
+        hms.db.session.remove()
+        hms.db.engine.dispose()
+
+
+@pytest.fixture
+def hospital(app):
+    """A hospital with ROWS departments, doctors, patients and appointments, and its admin."""
+    db = hms.db
+    hospital = hms.Hospital(name='Seed Hospital', license_number='SEED-001', admin_email='admin@seed.hms',
+                            status='ACTIVE')
+    db.session.add(hospital)
+    db.session.flush()
+    admin = hms.User(hospital_id=hospital.id, first_name='Seed', last_name='Admin', email='admin@seed.hms',
+                     password_hash='unused')
+    departments = [hms.Department(hospital_id=hospital.id, name=f'Department {i}', email=f'dept{i}@seed.hms')
+                   for i in range(ROWS)]
+    db.session.add_all([admin] + departments)
+    db.session.flush()
+    doctors = [hms.Doctor(hospital_id=hospital.id, department_id=departments[i].id, first_name=f'Doc{i}',
+                          last_name='Seed', specialization='General', email=f'doc{i}@seed.hms', phone='555-0100')
+               for i in range(ROWS)]
+    patients = [hms.Patient(hospital_id=hospital.id, first_name=f'Pat{i}', last_name='Seed',
+                            email=f'pat{i}@seed.hms', phone='555-0200', date_of_birth=date(1980, 1, 1 + i))
+                for i in range(ROWS)]
+    db.session.add_all(doctors + patients)
+    db.session.flush()
+    start = datetime.now().replace(hour=9, minute=0, second=0, microsecond=0) + timedelta(days=1)
+    db.session.add_all([
+        hms.Appointment(hospital_id=hospital.id, patient_id=patients[i].id, doctor_id=doctors[i].id,
+                        appointment_date=start + timedelta(minutes=30 * i), status='SCHEDULED')
+        for i in range(ROWS)
+    ])
+    db.session.commit()
+    return hospital.id, admin.id
+
+
+@pytest.fixture
+def client(app, hospital):
+    """A test client with the seeded hospital's admin logged in."""
+    hospital_id, user_id = hospital
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = user_id
+        session['hospital_id'] = hospital_id
+    return client
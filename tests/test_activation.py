@@ -0,0 +1,49 @@
+import re
+
+import app as hms
+import jobs
+
+
+def register(client):
+    client.post('/auth/register', data={'name': 'New Hospital', 'license_number': 'NEW-001',
+                                        'admin_email': 'admin@new.hms', 'phone': '555-0300',
+                                        'address': '1 New Street'})
+    return hms.Hospital.query.filter_by(license_number='NEW-001').one()
+
+
+def test_activation_email_carries_a_single_use_link(app, monkeypatch):
+    client = app.test_client()
+    hospital = register(client)
+    admin = hms.User.query.filter_by(hospital_id=hospital.id).one()
+    assert admin.password_hash is None
+
+    sent = []
+    monkeypatch.setattr(jobs, 'send_mail', lambda to, subject, body: sent.append((to, body)))
+    jobs.send_activation_email(hospital.id)
+    (to, body), = sent
+    assert to == 'admin@new.hms'
+    assert 'password:' not in body.lower()
+    path = re.search(r'http://localhost:5000(/auth/activate/\S+)', body).group(1)
+
+    assert client.get(path).status_code == 200
+    client.post(path, data={'password': 'short', 'confirm': 'short'})
+    client.post(path, data={'password': 'long enough', 'confirm': 'different'})
+    assert hms.db.session.get(hms.User, admin.id).password_hash is None
+
+    response = client.post(path, data={'password': 'long enough', 'confirm': 'long enough'})
+    assert response.status_code == 302
+    assert hms.db.session.get(hms.User, admin.id).check_password('long enough')
+    # The link is spent once the password is set
+    assert client.get(path).status_code == 302
+    assert client.post(path, data={'password': 'hijacked!', 'confirm': 'hijacked!'}).status_code == 302
+    assert hms.db.session.get(hms.User, admin.id).check_password('long enough')
+
+
+def test_tampered_activation_tokens_are_refused(app):
+    client = app.test_client()
+    admin = hms.User.query.filter_by(hospital_id=register(client).id).one()
+    token = hms.activation_token(admin)
+    assert hms.user_for_activation_token(token).id == admin.id
+    assert hms.user_for_activation_token(token[:-2] + 'xx') is None
+    assert hms.user_for_activation_token('garbage') is None
+    assert client.get('/auth/activate/garbage').status_code == 302
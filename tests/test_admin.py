@@ -0,0 +1,11 @@
+import pytest
+
+
+@pytest.mark.parametrize('path', ['/admin/pool', '/admin/cache'])
+def test_admin_views_are_for_superadmins_only(app, client, monkeypatch, path):
+    assert app.test_client().get(path).status_code == 302  # not logged in
+    assert client.get(path).status_code == 403  # a hospital's admin
+    monkeypatch.setitem(app.config, 'SUPERADMIN_EMAILS', 'root@hms.example, Admin@Seed.hms')
+    response = client.get(path)
+    assert response.status_code == 200
+    assert response.is_json
@@ -0,0 +1,8 @@
+def test_department_options_are_cached_once_per_tenant(app, client):
+    fragments = app.extensions['hms_fragments']
+    for query in ('view=week', 'view=month', 'view=day&department_id=1'):
+        assert client.get(f'/appointments/calendar?{query}').status_code == 200
+    # The doctors page shares the same options fragment
+    assert client.get('/doctors').status_code == 200
+    stats = fragments.stats.as_dict()
+    assert (stats['misses'], stats['hits']) == (2, 3)  # the options once, the doctor list once
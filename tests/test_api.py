@@ -0,0 +1,18 @@
+import app as hms
+
+
+def test_item_etag_changes_when_the_row_changes(client, hospital):
+    hospital_id, _ = hospital
+    appointment = hms.Appointment.query.filter_by(hospital_id=hospital_id).first()
+    path = f'/api/v1/appointments/{appointment.id}'
+
+    first = client.get(path)
+    assert first.status_code == 200
+    assert 'Last-Modified' not in first.headers
+    assert client.get(path, headers={'If-None-Match': first.headers['ETag']}).status_code == 304
+
+    response = client.post('/appointments/status', json={'status': 'CANCELLED', 'ids': [appointment.id]})
+    assert response.get_json()['changed'] == 1
+    second = client.get(path, headers={'If-None-Match': first.headers['ETag']})
+    assert second.status_code == 200
+    assert second.get_json()['status'] == 'CANCELLED'
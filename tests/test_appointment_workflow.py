@@ -0,0 +1,20 @@
+from datetime import datetime, timedelta
+
+import app as hms
+
+
+def test_only_future_appointments_are_reinstated(client, hospital):
+    hospital_id = hospital[0]
+    past, future = hms.Appointment.query.filter_by(hospital_id=hospital_id).order_by(hms.Appointment.id).limit(2).all()
+    past.appointment_date = datetime.now().replace(second=0, microsecond=0) - timedelta(days=1)
+    hms.db.session.commit()
+    ids = [past.id, future.id]
+
+    assert client.post('/appointments/status', json={'status': 'CANCELLED', 'ids': ids}).get_json()['changed'] == 2
+    response = client.post('/appointments/status', json={'status': 'SCHEDULED', 'ids': ids})
+    assert response.get_json()['appointments'] == [{'id': future.id, 'from': 'CANCELLED'}]
+
+    assert '>Reinstate<' not in client.get(f'/appointments/{past.id}').get_data(as_text=True)
+    client.post(f'/appointments/{past.id}/status', data={'status': 'SCHEDULED'})
+    hms.db.session.expire_all()
+    assert (past.status, future.status) == ('CANCELLED', 'SCHEDULED')
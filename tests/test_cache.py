@@ -0,0 +1,16 @@
+from cache import FileSystemCache, FragmentCache
+
+
+def test_fragments_are_shared_and_invalidated_across_workers(tmp_path):
+    # Two workers of one host, each with its own FragmentCache over the shared directory
+    worker1 = FragmentCache(FileSystemCache(str(tmp_path), ttl=300, maxsize=100))
+    worker2 = FragmentCache(FileSystemCache(str(tmp_path), ttl=300, maxsize=100))
+
+    assert worker1.get_or_render('h1', 'doctors', 'list', lambda: 'v1') == 'v1'
+    assert worker2.get_or_render('h1', 'doctors', 'list', lambda: 'v2') == 'v1'
+    worker2.invalidate('h1', 'doctors')
+    assert worker1.get_or_render('h1', 'doctors', 'list', lambda: 'v3') == 'v3'
+
+    assert worker1.stats.as_dict()['sets'] == 2
+    assert worker2.stats.as_dict()['hits'] == 1
+
@@ -0,0 +1,14 @@
+import csv
+import io
+
+from exports import CHUNK_SIZE, encode_csv
+
+
+def test_encode_csv_streams_in_chunks():
+    rows = [(i, f'name {i}', 'a, "quoted" value') for i in range(5000)]
+    chunks = list(encode_csv(('id', 'name', 'note'), rows))
+    assert len(chunks) > 1
+    assert all(len(chunk) < 2 * CHUNK_SIZE for chunk in chunks)
+    parsed = list(csv.reader(io.StringIO(b''.join(chunks).decode())))
+    assert parsed[0] == ['id', 'name', 'note']
+    assert parsed[1:] == [[str(i), name, note] for i, name, note in rows]
@@ -0,0 +1,39 @@
+import time
+from datetime import datetime, timedelta
+
+import app as hms
+import jobs
+from jobs import Job, requeue_stale_jobs
+
+
+def test_stale_jobs_fail_after_their_last_attempt(app):
+    expired = datetime.now() - timedelta(seconds=app.config['JOB_LEASE_SECONDS'] + 1)
+    retry = Job(task='send_activation_email', status='RUNNING', attempts=1, max_attempts=3,
+                locked_by='dead-worker', locked_at=expired)
+    last = Job(task='send_activation_email', status='RUNNING', attempts=3, max_attempts=3,
+               locked_by='dead-worker', locked_at=expired)
+    running = Job(task='send_activation_email', status='RUNNING', attempts=3, max_attempts=3,
+                  locked_by='live-worker', locked_at=datetime.now())
+    hms.db.session.add_all([retry, last, running])
+    hms.db.session.commit()
+
+    assert requeue_stale_jobs() == 1
+    hms.db.session.expire_all()
+    assert (retry.status, last.status, running.status) == ('QUEUED', 'FAILED', 'RUNNING')
+    assert last.finished_at is not None and last.locked_by is None
+
+
+def test_long_jobs_keep_their_lease(app, monkeypatch):
+    monkeypatch.setitem(app.config, 'JOB_LEASE_SECONDS', 0.3)
+
+    def slow_task():
+        time.sleep(1.0)  # several leases long
+        return {'requeued': requeue_stale_jobs()}
+
+    monkeypatch.setitem(jobs.TASKS, 'slow_task', (slow_task, None))
+    jobs.enqueue('slow_task')
+    hms.db.session.commit()
+
+    assert jobs.drain(app) == 1
+    job = Job.query.one()
+    assert (job.status, job.attempts, job.as_dict()['result']) == ('SUCCEEDED', 1, {'requeued': 0})
@@ -0,0 +1,28 @@
+import re
+
+import pytest
+
+from conftest import ROWS
+
+# Each list page, and a string every seeded row renders on it
+LIST_PAGES = [
+    ('/patients', 'pat{}@seed.hms'),
+    ('/appointments', 'Pat{} Seed'),
+    ('/doctors', 'doc{}@seed.hms'),
+    ('/departments', 'dept{}@seed.hms'),
+]
+
+
+@pytest.mark.parametrize('path, row', LIST_PAGES)
+def test_list_page_renders_rows(client, path, row):
+    response = client.get(path)
+    assert response.status_code == 200
+    html = response.get_data(as_text=True)
+    assert all(row.format(i) in html for i in range(ROWS))
+
+
+def test_appointment_view_links_to_detail(client):
+    html = client.get('/appointments').get_data(as_text=True)
+    appointment_ids = re.findall(r'href="/appointments/(\d+)"', html)
+    assert len(appointment_ids) == ROWS
+    assert client.get(f'/appointments/{appointment_ids[0]}').status_code == 200
@@ -0,0 +1,36 @@
+import pytest
+
+import app as hms
+from security import LoginLimiter
+
+
+@pytest.fixture
+def proxied_app(monkeypatch):
+    """An app behind one reverse proxy, allowing two login attempts per IP."""
+    monkeypatch.setattr(hms.Config, 'PROXY_HOPS', 1)
+    monkeypatch.setattr(hms.Config, 'LOGIN_RATE_PER_IP', '2/60')
+    flask_app = hms.create_app()
+    hms.bootstrap(flask_app, verbose=False)
+    with flask_app.app_context():
+        yield flask_app
+        hms.db.session.remove()
+        hms.db.engine.dispose()
+
+
+def login(client, email, forwarded_for):
+    return client.post('/auth/login', data={'email': email, 'password': 'wrong'},
+                       headers={'X-Forwarded-For': forwarded_for}, environ_base={'REMOTE_ADDR': '10.0.0.1'})
+
+
+def test_login_limit_is_per_forwarded_client(proxied_app):
+    client = proxied_app.test_client()
+    assert [login(client, f'user{i}@example.com', '203.0.113.7').status_code for i in range(3)] == [200, 200, 429]
+    # Another client behind the same proxy still gets in
+    assert login(client, 'user9@example.com', '198.51.100.4').status_code == 200
+
+
+def test_failed_logins_elsewhere_do_not_lock_out_an_email(proxied_app, monkeypatch):
+    monkeypatch.setitem(proxied_app.extensions, 'hms_login_limiter', LoginLimiter('100/60', '2/60'))
+    client = proxied_app.test_client()
+    assert [login(client, 'victim@example.com', '203.0.113.7').status_code for _ in range(3)] == [200, 200, 429]
+    assert login(client, 'victim@example.com', '198.51.100.4').status_code == 200
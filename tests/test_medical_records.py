@@ -0,0 +1,39 @@
+import re
+
+import app as hms
+
+
+def test_timeline_picks_the_doctor_with_the_typeahead(client, hospital):
+    hospital_id = hospital[0]
+    patient = hms.Patient.query.filter_by(hospital_id=hospital_id).first()
+    doctor = hms.Doctor.query.filter_by(hospital_id=hospital_id).first()
+
+    response = client.get(f'/patients/{patient.id}/records')
+    assert response.status_code == 200
+    html = response.get_data(as_text=True)
+    assert 'data-lookup="/lookup/doctors"' in html
+    assert 'Doc0 Seed' not in html  # no list of every doctor
+    # user and hospital, the patient, and one page of records, however many doctors there are
+    assert re.search(r'desc="4 queries"', response.headers['Server-Timing'])
+
+    client.post(f'/patients/{patient.id}/records', data={'diagnosis': 'Flu', 'doctor_id': doctor.id})
+    record = hms.MedicalRecord.query.filter_by(hospital_id=hospital_id, patient_id=patient.id).one()
+    assert record.doctor_id == doctor.id
+
+
+def test_ingest_of_a_non_utf8_body_is_a_400(client, hospital):
+    patient = hms.Patient.query.filter_by(hospital_id=hospital[0]).first()
+    body = f'{{"patient_id": {patient.id}, "diagnosis": "Grippe é"}}\n'.encode('latin-1')
+    response = client.post('/records/ingest', data=body, content_type='application/x-ndjson')
+    assert response.status_code == 400
+    assert 'could not be read' in response.get_json()['error']
+    assert hms.MedicalRecord.query.count() == 0
+
+
+def test_ingest_records_command_reports_an_unreadable_file(app, hospital, tmp_path):
+    path = tmp_path / 'results.jsonl'
+    path.write_bytes('{"diagnosis": "Grippe é"}\n'.encode('latin-1'))
+    result = app.test_cli_runner().invoke(args=['hms', 'ingest-records', str(path),
+                                                '--hospital-id', str(hospital[0])])
+    assert result.exit_code == 0
+    assert 'could not be read' in result.output
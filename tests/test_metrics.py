@@ -0,0 +1,26 @@
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+import app as hms
+
+
+def test_failed_statements_do_not_leave_a_start_time_behind(app):
+    with hms.db.engine.connect() as conn:
+        for _ in range(3):
+            with pytest.raises(OperationalError):
+                conn.execute(text('SELECT * FROM no_such_table'))
+        assert conn.info.get('hms_statement_started') == []
+        conn.execute(text('SELECT 1'))
+        assert conn.info['hms_statement_started'] == []
+
+
+def test_metrics_need_a_configured_token(client, monkeypatch):
+    monkeypatch.setitem(client.application.config, 'METRICS_TOKEN', None)
+    assert client.get('/metrics').status_code == 401
+    monkeypatch.setitem(client.application.config, 'METRICS_TOKEN', 's3cret')
+    assert client.get('/metrics').status_code == 401
+    assert client.get('/metrics', headers={'Authorization': 'Bearer wrong'}).status_code == 401
+    response = client.get('/metrics', headers={'Authorization': 'Bearer s3cret'})
+    assert response.status_code == 200
+    assert 'hms_request_duration_seconds' in response.get_data(as_text=True)
@@ -0,0 +1,58 @@
+import base64
+import json
+from datetime import datetime
+
+import pytest
+
+import app as hms
+from pagination import decode_cursor, encode_cursor, keyset_paginate
+
+
+@pytest.fixture
+def same_instant(hospital):
+    """The seeded patients, all created at the same moment."""
+    hms.Patient.query.filter_by(hospital_id=hospital[0]).update({'created_at': datetime(2024, 1, 1, 12)})
+    hms.db.session.commit()
+    return hms.Patient.query.filter_by(hospital_id=hospital[0])
+
+
+def walk(query, sort, direction='next', cursor=None):
+    pages = []
+    while True:
+        page = keyset_paginate(query, hms.Patient, cursor, per_page=2, sort=sort)
+        pages.append([patient.id for patient in page])
+        cursor = page.next_cursor if direction == 'next' else page.prev_cursor
+        if cursor is None:
+            return pages, page
+
+
+@pytest.mark.parametrize('sort, descending', [('newest', True), ('oldest', False)])
+def test_pages_split_rows_that_share_a_created_at(same_instant, sort, descending):
+    ids = sorted((patient.id for patient in same_instant), reverse=descending)
+    pages, last = walk(same_instant, sort)
+    assert pages == [ids[0:2], ids[2:4], ids[4:]]
+    # and back again from the last page
+    back, first = walk(same_instant, sort, 'prev', last.prev_cursor)
+    assert back == [ids[2:4], ids[0:2]]
+    assert first.prev_cursor is None and first.next_cursor is not None
+
+
+def test_cursors_round_trip():
+    row = hms.Patient(id=7, created_at=datetime(2024, 1, 1, 12, 30, 15, 250))
+    assert decode_cursor(encode_cursor('next', row)) == ('next', (row.created_at, 7))
+    assert decode_cursor(encode_cursor('prev', row)) == ('prev', (row.created_at, 7))
+
+
+def _cursor(payload):
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode().rstrip('=')
+
+
+@pytest.mark.parametrize('path', ['/patients', '/appointments', '/doctors', '/departments', '/api/v1/patients'])
+def test_invalid_cursors_are_a_400(client, path):
+    valid = client.get(path)
+    assert valid.status_code == 200
+    for cursor in ['garbage!', 'bm90IGpzb24', _cursor(['sideways', '2024-01-01T12:00:00', 1]),
+                   _cursor(['next', 'yesterday', 1]), _cursor(['next', '2024-01-01T12:00:00', 'one']),
+                   _cursor(['next', '2024-01-01T12:00:00']), _cursor({'next': 1})]:
+        assert client.get(path, query_string={'cursor': cursor}).status_code == 400, cursor
+    assert client.get(path, query_string={'cursor': _cursor(['next', '2024-01-01T12:00:00', 1])}).status_code == 200
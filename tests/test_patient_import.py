@@ -0,0 +1,36 @@
+import io
+
+HEADER = 'first_name,last_name,email,phone,date_of_birth\n'
+
+
+def upload(client, body):
+    return client.post('/patients/import', data={'file': (io.BytesIO(body), 'patients.csv')},
+                       content_type='multipart/form-data')
+
+
+def flashed(client):
+    with client.session_transaction() as session:
+        return session.get('_flashes', [])
+
+
+def test_non_utf8_csv_is_a_validation_error(client):
+    body = HEADER + 'Jos\xe9,Imported,jose@example.com,555,1990-01-01\n'
+    assert upload(client, body.encode('latin-1')).status_code == 302
+    assert any('could not be read' in message for _, message in flashed(client))
+
+
+def test_malformed_csv_is_a_validation_error(client):
+    # A field over the csv module's size limit
+    body = HEADER + 'Ana,Imported,"' + 'x' * 200000 + '",555,1990-01-01\n'
+    assert upload(client, body.encode()).status_code == 302
+    assert any('could not be read' in message for _, message in flashed(client))
+
+
+def test_flashed_row_errors_are_capped(client):
+    body = HEADER + ''.join(f'P{i},Imported,p{i}@example.com,555,{"x" * 300}\n' for i in range(50))
+    response = upload(client, body.encode())
+    assert response.status_code == 302
+    messages = flashed(client)
+    assert len(messages) <= 7  # summary, 5 rows, and "... and 45 more"
+    assert '45 more' in messages[-1][1]
+    assert len(response.headers['Set-Cookie']) < 4096
@@ -0,0 +1,27 @@
+# Each list route loads a page in a fixed number of statements, however many rows
+# the page shows: lazy loads per row (N+1) would add at least ROWS more.
+# Counted by the cursor hooks of metrics.py, which report them in Server-Timing.
+
+import re
+
+import pytest
+
+TENANT_LOOKUPS = 2  # user and hospital, on a cold tenant cache
+
+LIST_ROUTES = [
+    ('/patients', 1),
+    ('/appointments', 1),  # patient and doctor joined in
+    ('/doctors', 2),  # doctors with their departments, and the department options
+    ('/departments', 1),
+]
+
+
+def sql_statements(response):
+    return int(re.search(r'desc="(\d+) queries"', response.headers['Server-Timing']).group(1))
+
+
+@pytest.mark.parametrize('path, statements', LIST_ROUTES)
+def test_list_route_query_count(client, path, statements):
+    response = client.get(path)
+    assert response.status_code == 200
+    assert sql_statements(response) == TENANT_LOOKUPS + statements
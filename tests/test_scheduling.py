@@ -0,0 +1,80 @@
+from datetime import datetime, timedelta
+
+import app as hms
+import scheduling
+
+
+def _doctor_and_patient(hospital_id):
+    doctor = hms.Doctor.query.filter_by(hospital_id=hospital_id).first()
+    patient = hms.Patient.query.filter_by(hospital_id=hospital_id).first()
+    # Free the doctor of the seeded booking, which new hours would otherwise strand
+    hms.Appointment.query.filter_by(hospital_id=hospital_id, doctor_id=doctor.id).delete()
+    hms.db.session.commit()
+    return doctor.id, patient.id
+
+
+def test_overlapping_working_hours_are_rejected(client, hospital):
+    doctor_id, _ = _doctor_and_patient(hospital[0])
+    overlapping = [
+        {'weekday': 0, 'start': '09:00', 'end': '12:00', 'slot_minutes': 30},
+        {'weekday': 0, 'start': '11:00', 'end': '13:00', 'slot_minutes': 20},
+    ]
+    assert client.put(f'/doctors/{doctor_id}/hours', json=overlapping).status_code == 400
+    back_to_back = [
+        {'weekday': 0, 'start': '09:00', 'end': '12:00', 'slot_minutes': 30},
+        {'weekday': 0, 'start': '12:00', 'end': '13:00', 'slot_minutes': 20},
+        {'weekday': 1, 'start': '11:00', 'end': '13:00', 'slot_minutes': 20},
+    ]
+    response = client.put(f'/doctors/{doctor_id}/hours', json=back_to_back)
+    assert response.status_code == 200
+    assert len(response.get_json()['hours']) == 3
+
+
+def _next_monday():
+    today = datetime.now().date()
+    return today + timedelta(days=7 - today.weekday())
+
+
+def test_bookings_must_start_on_a_slot_of_the_default_hours(client, hospital):
+    hospital_id = hospital[0]
+    doctor_id, patient_id = _doctor_and_patient(hospital_id)
+    day = _next_monday()
+
+    def book(time):
+        client.post('/add_appointment', data={'patient_id': patient_id, 'doctor_id': doctor_id,
+                                              'appointment_date': f'{day}T{time}'})
+        return hms.Appointment.query.filter_by(hospital_id=hospital_id, doctor_id=doctor_id) \
+            .filter(hms.Appointment.appointment_date >= datetime.combine(day, datetime.min.time())).all()
+
+    assert book('10:15') == []
+    assert book('18:00') == []
+    assert [apt.appointment_date.strftime('%H:%M') for apt in book('10:00')] == ['10:00']
+    assert len(book('10:00')) == 1
+    assert len(book('10:30')) == 2
+
+
+def test_free_slots_use_the_default_hours(app, hospital):
+    hospital_id = hospital[0]
+    doctor_id, _ = _doctor_and_patient(hospital_id)
+    monday = datetime.combine(_next_monday(), datetime.min.time())
+    slots = scheduling.free_slots(hospital_id, [doctor_id], monday, monday + timedelta(days=1), limit=100)
+    assert slots[0]['start'] == f'{monday.date()}T09:00'
+    assert slots[-1]['end'] == f'{monday.date()}T17:00'
+    assert len(slots) == 16
+    assert scheduling.free_slots(hospital_id, [doctor_id], monday + timedelta(days=5),
+                                 monday + timedelta(days=7)) == []
+
+
+def test_hours_that_strand_a_booking_are_refused(client, hospital):
+    hospital_id = hospital[0]
+    doctor_id, patient_id = _doctor_and_patient(hospital_id)
+    day = _next_monday()
+    client.post('/add_appointment', data={'patient_id': patient_id, 'doctor_id': doctor_id,
+                                          'appointment_date': f'{day}T10:30'})
+    hourly = [{'weekday': 0, 'start': '09:00', 'end': '17:00', 'slot_minutes': 60}]
+    response = client.put(f'/doctors/{doctor_id}/hours', json=hourly)
+    assert response.status_code == 400
+    assert 'move or cancel them first' in response.get_data(as_text=True)
+    assert hms.db.session.query(scheduling.DoctorSchedule).filter_by(doctor_id=doctor_id).count() == 0
+    half_hourly = [{'weekday': 0, 'start': '10:00', 'end': '12:00', 'slot_minutes': 30}]
+    assert client.put(f'/doctors/{doctor_id}/hours', json=half_hourly).status_code == 200
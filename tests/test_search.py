@@ -0,0 +1,18 @@
+import re
+
+from flask import current_app
+
+import search
+
+
+def test_postgres_ranks_the_newest_candidates(app):
+    statement, params = search.search_statement('postgresql', 'h1', 'jo smi', limit=10, offset=10)
+    candidates = re.search(r'\(SELECT .*?LIMIT :candidates\)', str(statement)).group(0)
+    assert candidates.endswith('ORDER BY created_at DESC, id DESC LIMIT :candidates)')
+    assert params['candidates'] == current_app.config['SEARCH_MAX_RESULTS']
+
+
+
+def test_like_pattern_escapes_wildcards():
+    assert search.like_pattern('50%_off\\') == '%50\\%\\_off\\\\%'
+    assert search.like_pattern('jo', prefix_only=True) == 'jo%'